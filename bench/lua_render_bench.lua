@@ -0,0 +1,332 @@
+-- Lokale render benchmark voor de gegenereerde Lua modules (dispatcher + data submodule).
+--
+-- Laadt de modules in een gewone Lua 5.1 interpreter (zoals Scribunto) met nagebootste
+-- mw.text, mw.loadData en frame objecten, en speelt een vaste mix van getStat aanroepen af:
+-- bestaande regio's, stat=Ref, ontbrekende regio's en onbekende stats.
+--
+-- Gebruik (vanuit de hoofdmap van het project):
+--   lua bench/lua_render_bench.lua <output_map> <jaar> [opties]
+--
+-- Opties:
+--   --dispatcher <pad>  Dispatcher module (standaard <output_map>/..._DISPATCHER_MANUAL_COPY.lua,
+--                       anders gedeeld/wiki_output/...)
+--   --calls <N>         Aantal getStat aanroepen (standaard 5000)
+--   --page-calls <N>    Aanroepen per gesimuleerde pagina; daarna worden de mw.loadData
+--                       caches geleegd (standaard 50)
+--   --seed <N>          Seed voor de aanroepen mix (standaard 1)
+--   --json              Resultaat als één JSON regel (voor vergelijken tussen layouts/jaren)
+--
+-- Draait volledig offline: er is geen MediaWiki installatie nodig.
+
+local MODULE_BASE_NAME = 'CBS_Kerncijfers_Wijken_en_Buurten_Data'
+local MIX = { ok = 0.80, ref = 0.05, missing_region = 0.10, unknown_stat = 0.05 }
+
+-- === Argumenten ===
+local output_dir, year = arg[1], arg[2]
+local options = { calls = 5000, page_calls = 50, seed = 1 }
+local i = 3
+while arg[i] do
+    local name = arg[i]
+    if name == '--json' then
+        options.json = true
+    elseif name == '--dispatcher' or name == '--calls' or name == '--page-calls' or name == '--seed' then
+        local key = string.gsub(string.sub(name, 3), '-', '_')
+        options[key] = (key == 'dispatcher') and arg[i + 1] or tonumber(arg[i + 1])
+        i = i + 1
+    else
+        io.stderr:write('Onbekende optie: ' .. name .. '\n')
+        os.exit(2)
+    end
+    i = i + 1
+end
+if not output_dir or not year then
+    io.stderr:write('Gebruik: lua bench/lua_render_bench.lua <output_map> <jaar> [--dispatcher pad] [--calls N] [--page-calls N] [--seed N] [--json]\n')
+    os.exit(2)
+end
+
+local function file_exists(path)
+    local f = io.open(path, 'rb')
+    if f then f:close() return true end
+    return false
+end
+
+local function file_size(path)
+    local f = io.open(path, 'rb')
+    if not f then return 0 end
+    local size = f:seek('end')
+    f:close()
+    return size
+end
+
+local function read_file(path)
+    local f = assert(io.open(path, 'rb'))
+    local content = f:read('*a')
+    f:close()
+    return content
+end
+
+local file_base = 'Module_' .. MODULE_BASE_NAME
+local dispatcher_path = options.dispatcher
+if not dispatcher_path then
+    dispatcher_path = output_dir .. '/' .. file_base .. '_DISPATCHER_MANUAL_COPY.lua'
+    if not file_exists(dispatcher_path) then
+        dispatcher_path = 'gedeeld/wiki_output/' .. file_base .. '_DISPATCHER_MANUAL_COPY.lua'
+    end
+end
+
+-- Wiki pagina -> lokaal bestand: Module:Naam/JAAR en Module:Naam/JAAR/<shard>
+local function module_file(page)
+    local y, shard = string.match(page, '^Module:' .. MODULE_BASE_NAME .. '/(%d+)/?(.*)$')
+    if not y then return nil end
+    if shard == '' then
+        return output_dir .. '/' .. file_base .. '_' .. y .. '.lua'
+    end
+    return output_dir .. '/' .. file_base .. '_' .. y .. '_shards/' .. file_base .. '_' .. y .. '_' .. shard .. '.lua'
+end
+
+-- === Nagebootste Scribunto omgeving ===
+local load_data_cache = {}
+local stats = { load_data_calls = 0, load_data_misses = 0, load_data_seconds = 0, module_bytes = 0 }
+
+local function load_module(page)
+    local path = module_file(page)
+    if not path or not file_exists(path) then
+        error('module niet gevonden: ' .. page)
+    end
+    local chunk = assert(loadfile(path))
+    stats.module_bytes = stats.module_bytes + file_size(path)
+    return chunk()
+end
+
+mw = {
+    text = {
+        trim = function(s)
+            return (string.gsub(s, '^%s*(.-)%s*$', '%1'))
+        end,
+        split = function(s, separator, plain)
+            local parts, start = {}, 1
+            while true do
+                local from, to = string.find(s, separator, start, plain)
+                if not from then
+                    table.insert(parts, string.sub(s, start))
+                    return parts
+                end
+                table.insert(parts, string.sub(s, start, from - 1))
+                start = to + 1
+            end
+        end,
+        tag = function(t)
+            local attrs = ''
+            for name, value in pairs(t.attrs or {}) do
+                attrs = attrs .. ' ' .. name .. '="' .. value .. '"'
+            end
+            return '<' .. t.name .. attrs .. '>' .. (t.content or '') .. '</' .. t.name .. '>'
+        end,
+    },
+    -- Zoals Scribunto: één keer laden per pagina, gedeeld door alle #invoke aanroepen
+    loadData = function(page)
+        stats.load_data_calls = stats.load_data_calls + 1
+        local cached = load_data_cache[page]
+        if cached == nil then
+            stats.load_data_misses = stats.load_data_misses + 1
+            local start = os.clock()
+            cached = load_module(page)
+            stats.load_data_seconds = stats.load_data_seconds + (os.clock() - start)
+            load_data_cache[page] = cached
+        end
+        return cached
+    end,
+}
+
+local real_require = require
+require = function(name)
+    if module_file(name) then return load_module(name) end
+    return real_require(name)
+end
+
+local function new_frame(args)
+    local parent = { args = {} }
+    return {
+        args = args,
+        getParent = function() return parent end,
+        expandTemplate = function(_, t) return '{{' .. t.title .. '}}' end,
+        preprocess = function(_, text) return text end,
+    }
+end
+
+-- Deterministische pseudo-random reeks (gelijk voor alle Lua versies), zodat runs vergelijkbaar zijn
+local seed = options.seed
+local function random()
+    seed = (seed * 1103515245 + 12345) % 2147483648
+    return seed / 2147483648
+end
+local function pick(list)
+    return list[math.floor(random() * #list) + 1]
+end
+
+-- === Regio's en stats voor de mix (buiten de metingen) ===
+local index_path = module_file('Module:' .. MODULE_BASE_NAME .. '/' .. year)
+if not file_exists(index_path) then
+    io.stderr:write('Data submodule niet gevonden: ' .. index_path .. '\n')
+    os.exit(1)
+end
+local index = dofile(index_path)
+local layout = index.shards and 'sharded' or (index.columns and 'columns' or 'rows')
+local shard_layout = nil
+local regions = {}
+local function collect_regions(source)
+    if source.columns then
+        for code in pairs(source.regions or {}) do table.insert(regions, code) end
+        return 'columns'
+    end
+    for code in pairs(source.data or {}) do table.insert(regions, code) end
+    return 'rows'
+end
+if index.shards then
+    local seen = {}
+    for _, shard in pairs(index.shards) do
+        if not seen[shard] then
+            seen[shard] = true
+            shard_layout = collect_regions(dofile(module_file('Module:' .. MODULE_BASE_NAME .. '/' .. year .. '/' .. shard)))
+        end
+    end
+    layout = 'sharded-' .. (shard_layout or 'rows')
+else
+    collect_regions(index)
+end
+table.sort(regions)
+if #regions == 0 then
+    io.stderr:write('Geen regio\'s gevonden in ' .. index_path .. '\n')
+    os.exit(1)
+end
+
+local dispatcher_source = read_file(dispatcher_path)
+local stat_names, seen_stats = {}, {}
+for alias in string.gmatch(dispatcher_source, "stat_alias == '([^']+)'") do
+    if alias ~= 'Ref' and not seen_stats[alias] then
+        seen_stats[alias] = true
+        table.insert(stat_names, alias)
+    end
+end
+for key in pairs(index.metadata or {}) do
+    -- Sleutels zonder CBS suffix (bv. afgeleide stats) hebben geen alias regel
+    if not string.match(key, '_%d+$') and not seen_stats[key] then
+        seen_stats[key] = true
+        table.insert(stat_names, key)
+    end
+end
+table.sort(stat_names)
+index = nil
+collectgarbage('collect')
+
+-- === Metingen ===
+local memory_start = collectgarbage('count')
+
+local start = os.clock()
+local dispatcher_chunk = assert(loadfile(dispatcher_path))
+local dispatcher_compile_seconds = os.clock() - start
+
+-- Koude load van de data submodule (eerste aanroep op een pagina)
+start = os.clock()
+mw.loadData('Module:' .. MODULE_BASE_NAME .. '/' .. year)
+local data_load_seconds = os.clock() - start
+local memory_loaded = collectgarbage('count')
+load_data_cache = {}
+stats.load_data_seconds, stats.load_data_calls, stats.load_data_misses, stats.module_bytes = 0, 0, 0, 0
+
+local latencies, counts, errors = {}, { ok = 0, ref = 0, missing_region = 0, unknown_stat = 0 }, 0
+local memory_peak = memory_loaded
+local total_start = os.clock()
+for call = 1, options.calls do
+    if (call - 1) % options.page_calls == 0 then
+        load_data_cache = {} -- Nieuwe pagina
+    end
+    local r, kind, args = random(), nil, nil
+    if r < MIX.ok then
+        kind, args = 'ok', { jaar = year, regio = pick(regions), stat = pick(stat_names), leeg = '-' }
+    elseif r < MIX.ok + MIX.ref then
+        kind, args = 'ref', { jaar = year, regio = '', stat = 'Ref' }
+    elseif r < MIX.ok + MIX.ref + MIX.missing_region then
+        kind, args = 'missing_region', { jaar = year, regio = 'WK9999' .. string.format('%02d', call % 100), stat = pick(stat_names), leeg = '-' }
+    else
+        kind, args = 'unknown_stat', { jaar = year, regio = pick(regions), stat = 'OnbekendeStat', leeg = '-' }
+    end
+    counts[kind] = counts[kind] + 1
+
+    local call_start = os.clock()
+    local p = dispatcher_chunk() -- Elke #invoke krijgt een verse module omgeving
+    local result = p.getStat(new_frame(args))
+    latencies[call] = os.clock() - call_start
+
+    local is_error = type(result) == 'string' and string.find(result, 'class="error"', 1, true) ~= nil
+    if is_error ~= (kind == 'missing_region' or kind == 'unknown_stat') then errors = errors + 1 end
+    if call % 100 == 0 then
+        local memory = collectgarbage('count')
+        if memory > memory_peak then memory_peak = memory end
+    end
+end
+local total_seconds = os.clock() - total_start
+
+table.sort(latencies)
+local function percentile(q)
+    return latencies[math.max(1, math.ceil(q * #latencies))] * 1e6
+end
+
+local result = {
+    year = year,
+    layout = layout,
+    lua_version = _VERSION,
+    regions = #regions,
+    stats = #stat_names,
+    calls = options.calls,
+    page_calls = options.page_calls,
+    dispatcher_compile_ms = dispatcher_compile_seconds * 1e3,
+    data_load_ms = data_load_seconds * 1e3,
+    data_load_per_page_ms = stats.load_data_seconds * 1e3 / math.max(1, math.ceil(options.calls / options.page_calls)),
+    load_data_bytes_per_page = stats.module_bytes / math.max(1, math.ceil(options.calls / options.page_calls)),
+    call_p50_us = percentile(0.50),
+    call_p90_us = percentile(0.90),
+    call_p99_us = percentile(0.99),
+    call_max_us = latencies[#latencies] * 1e6,
+    total_ms = total_seconds * 1e3,
+    memory_data_kib = memory_loaded - memory_start,
+    memory_peak_kib = memory_peak - memory_start,
+    mix_ok = counts.ok,
+    mix_ref = counts.ref,
+    mix_missing_region = counts.missing_region,
+    mix_unknown_stat = counts.unknown_stat,
+    unexpected_results = errors,
+}
+local order = {
+    'year', 'layout', 'lua_version', 'regions', 'stats', 'calls', 'page_calls',
+    'dispatcher_compile_ms', 'data_load_ms', 'data_load_per_page_ms', 'load_data_bytes_per_page',
+    'call_p50_us', 'call_p90_us', 'call_p99_us', 'call_max_us', 'total_ms',
+    'memory_data_kib', 'memory_peak_kib',
+    'mix_ok', 'mix_ref', 'mix_missing_region', 'mix_unknown_stat', 'unexpected_results',
+}
+
+local function format_value(value, quoted)
+    if type(value) == 'number' then
+        if value == math.floor(value) then return string.format('%d', value) end
+        return string.format('%.3f', value)
+    end
+    if quoted then return '"' .. tostring(value) .. '"' end
+    return tostring(value)
+end
+
+if options.json then
+    local parts = {}
+    for _, key in ipairs(order) do
+        table.insert(parts, '"' .. key .. '": ' .. format_value(result[key], true))
+    end
+    print('{' .. table.concat(parts, ', ') .. '}')
+else
+    print('--- Lua render benchmark ---')
+    for _, key in ipairs(order) do
+        print(string.format('%-26s %s', key, format_value(result[key])))
+    end
+end
+if errors > 0 then
+    io.stderr:write('Waarschuwing: ' .. errors .. ' aanroep(en) gaven een onverwacht resultaat (fout vs. waarde).\n')
+    os.exit(1)
+end
@@ -0,0 +1,150 @@
+# Lokale stand-in van de MediaWiki action API, om --upload te testen zonder echte wiki.
+#
+# Ondersteunt wat main.py gebruikt: tokens (login/csrf), login, query met prop=revisions
+# (rvprop=sha1, met titelnormalisatie 'Template:' -> 'Sjabloon:') en edit (met md5 controle en
+# nochange). Kan maxlag fouten en een edit rate limit simuleren, en logt per edit het tijdstip,
+# zodat gelijktijdigheid en rate limiting zichtbaar zijn.
+#
+# Gebruik (vanuit de hoofdmap van het project):
+#   python bench/mediawiki_stub.py [--port 8089] [--maxlag-every N] [--edits-per-minute N] [--dump map]
+#   KWB_WIKI_PASSWORD=geheim python main.py 2099 --dataset-id SYNTHETISCH --upload \
+#       --wiki-api http://127.0.0.1:8089/w/api.php --wiki-user Bot@Generator
+
+import argparse
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+NAMESPACE_ALIASES = {'Template:': 'Sjabloon:'} # Zoals op nl.wikipedia
+DEFAULT_PASSWORD = 'geheim'
+
+class WikiState:
+    """Pagina's, sessies en tellers van de stand-in wiki (gedeeld door alle request threads)."""
+
+    def __init__(self, password, maxlag_every, edits_per_minute, dump_dir):
+        self.password = password
+        self.maxlag_every = maxlag_every
+        self.edit_interval = 60.0 / edits_per_minute if edits_per_minute else 0.0
+        self.dump_dir = dump_dir
+        self.lock = threading.Lock()
+        self.pages = {}       # titel -> inhoud
+        self.sessions = {}    # cookie -> {'user': ..., 'csrf': ...}
+        self.requests = 0
+        self.last_edit = {}   # gebruiker -> tijdstip van de laatste edit
+        self.edits = 0
+        self.started = time.monotonic()
+
+    def normalize(self, title):
+        for alias, canonical in NAMESPACE_ALIASES.items():
+            if title.startswith(alias): return canonical + title[len(alias):]
+        return title
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_api(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        self.handle_api(parse_qs(body, keep_blank_values=True))
+
+    def send_json(self, result, cookie=None, retry_after=None):
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if cookie: self.send_header('Set-Cookie', f"wikisession={cookie}; Path=/")
+        if retry_after: self.send_header('Retry-After', str(retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, code, info, **extra):
+        self.send_json({'error': {'code': code, 'info': info}}, **extra)
+
+    def session(self):
+        cookies = dict(part.strip().split('=', 1) for part in self.headers.get('Cookie', '').split(';') if '=' in part)
+        cookie = cookies.get('wikisession')
+        with state.lock:
+            if cookie not in state.sessions:
+                cookie = secrets.token_hex(8)
+                state.sessions[cookie] = {'user': None, 'csrf': None, 'login': secrets.token_hex(8)}
+            return cookie, state.sessions[cookie]
+
+    def handle_api(self, query):
+        params = {key: values[-1] for key, values in query.items()}
+        cookie, session = self.session()
+        with state.lock:
+            state.requests += 1
+            lagged = state.maxlag_every and state.requests % state.maxlag_every == 0
+        if lagged and 'maxlag' in params:
+            return self.error('maxlag', 'Waiting for a database server: 7 seconds lagged.', cookie=cookie, retry_after=1)
+
+        action = params.get('action')
+        if action == 'query' and params.get('meta') == 'tokens':
+            if params.get('type') == 'login':
+                return self.send_json({'query': {'tokens': {'logintoken': session['login'] + '+\\'}}}, cookie)
+            return self.send_json({'query': {'tokens': {'csrftoken': (session['csrf'] or '') + '+\\'}}}, cookie)
+        if action == 'login':
+            if params.get('lgtoken') != session['login'] + '+\\': return self.send_json({'login': {'result': 'WrongToken'}}, cookie)
+            if params.get('lgpassword') != state.password:
+                return self.send_json({'login': {'result': 'Failed', 'reason': 'Incorrect username or password entered.'}}, cookie)
+            session.update(user=params.get('lgname'), csrf=secrets.token_hex(8))
+            return self.send_json({'login': {'result': 'Success', 'lgusername': params.get('lgname')}}, cookie)
+        if action == 'query' and params.get('prop') == 'revisions':
+            titles = params.get('titles', '').split('|')
+            normalized = [{'from': t, 'to': state.normalize(t)} for t in titles if state.normalize(t) != t]
+            pages = []
+            with state.lock:
+                for title in titles:
+                    content = state.pages.get(state.normalize(title))
+                    page = {'title': state.normalize(title)}
+                    if content is None: page['missing'] = True
+                    else: page['revisions'] = [{'sha1': hashlib.sha1(content.encode('utf-8')).hexdigest()}]
+                    pages.append(page)
+            return self.send_json({'query': {'normalized': normalized, 'pages': pages}}, cookie)
+        if action == 'edit':
+            if self.command != 'POST': return self.error('mustbeposted', 'The edit module requires a POST request.')
+            if not session['user'] or params.get('token') != session['csrf'] + '+\\':
+                return self.error('badtoken', 'Invalid CSRF token.', cookie=cookie)
+            text = params.get('text', '')
+            if params.get('md5') and params['md5'] != hashlib.md5(text.encode('utf-8')).hexdigest():
+                return self.error('badmd5', 'The supplied MD5 hash was incorrect.', cookie=cookie)
+            title, text = state.normalize(params['title']), text.rstrip() # Zoals MediaWiki's pre-save transform
+            with state.lock:
+                now = time.monotonic()
+                if state.edit_interval and now - state.last_edit.get(session['user'], -1e9) < state.edit_interval:
+                    return self.error('ratelimited', "You've exceeded your rate limit.", cookie=cookie)
+                state.last_edit[session['user']] = now
+                nochange = state.pages.get(title) == text
+                state.pages[title] = text
+                if not nochange: state.edits += 1
+            print(f"{now - state.started:8.2f}s edit {'(nochange) ' if nochange else ''}{title} ({len(text)} tekens)")
+            if state.dump_dir and not nochange:
+                os.makedirs(state.dump_dir, exist_ok=True)
+                with open(os.path.join(state.dump_dir, title.replace(':', '_').replace('/', '_')), 'w', encoding='utf-8') as f: f.write(text)
+            result = {'result': 'Success', 'title': title}
+            if nochange: result['nochange'] = True
+            return self.send_json({'edit': result}, cookie)
+        return self.error('badvalue', f"Niet ondersteund door de stand-in: {params}", cookie=cookie)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lokale stand-in van de MediaWiki action API voor --upload.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD, help="Wachtwoord dat login accepteert.")
+    parser.add_argument("--maxlag-every", type=int, default=0, help="Geef elk N-de request een maxlag fout (0 = nooit).")
+    parser.add_argument("--edits-per-minute", type=float, default=0, help="Rate limit per gebruiker; sneller geeft 'ratelimited' (0 = geen).")
+    parser.add_argument("--dump", default=None, help="Schrijf de opgeslagen pagina's naar deze map.")
+    args = parser.parse_args()
+
+    state = WikiState(args.password, args.maxlag_every, args.edits_per_minute, args.dump)
+    print(f"MediaWiki stand-in op http://127.0.0.1:{args.port}/w/api.php")
+    ThreadingHTTPServer(('127.0.0.1', args.port), ApiHandler).serve_forever()
@@ -0,0 +1,145 @@
+# Lokale stand-in van de CBS OData API, om de geprojecteerde download van main.py te testen zonder internet.
+#
+# Serveert TableInfos, DataProperties en TypedDataSet van een synthetische dataset (zie
+# synthetic_dataset.py) en ondersteunt wat main.py gebruikt: $format=json, $select, $filter
+# (substringof('...',Sleutel) termen met 'or'), $top/$skip en odata.nextLink (zonder $top, net als
+# de echte API maximaal 10000 rijen per response). Kan per page vertraging toevoegen en een page laten
+# mislukken, zodat parallelle en hervatte downloads zichtbaar worden.
+#
+# Gebruik (vanuit de hoofdmap van het project):
+#   python bench/odata_stub.py [--port 8088] [--data-dir map] [--gemeenten N] [--delay 0.2] [--fail-page 3 --fail-times 10]
+#   python main.py 2099 --dataset-id SYNTHETISCH --overwrite --odata-url http://127.0.0.1:8088/ODataApi/odata
+#
+# Een page die vaker mislukt dan de retries van main.py (5, met backoff) breekt de download af; de al
+# binnengekomen pages blijven in cbs_data/_pages_TypedDataSet/ staan en de volgende run hervat daar.
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic_dataset import generate_dataset
+
+MAX_ROWS_PER_RESPONSE = 10000 # Limiet van de CBS OData API
+PATH_PATTERN = re.compile(r'^/ODataApi/odata/([^/]+)/(TableInfos|DataProperties|TypedDataSet)/?$')
+FILTER_TERM = re.compile(r"^substringof\('([^']*)',(\w+)\)$")
+
+class ODataState:
+    """Tabellen, page fouten en tellers van de stand-in (gedeeld door alle request threads)."""
+
+    def __init__(self, data_dir, dataset_id, delay, fail_page, fail_times, page_size):
+        self.dataset_id = dataset_id
+        self.delay = delay
+        self.fail_page = fail_page
+        self.fail_times = fail_times
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.requests = 0
+        self.started = time.monotonic()
+        self.tables = {}
+        for name in ('TableInfos', 'DataProperties', 'TypedDataSet'):
+            with open(os.path.join(data_dir, f"{name}.json"), encoding='utf-8') as f: self.tables[name] = json.load(f)
+
+def parse_filter(expression):
+    """Zet een $filter van substringof termen (met 'or') om naar een lijst (tekst, sleutel); None als onbekend."""
+    if not expression: return []
+    terms = []
+    for term in expression.split(' or '):
+        match = FILTER_TERM.match(term.strip())
+        if not match: return None
+        terms.append((match.group(1), match.group(2)))
+    return terms
+
+class ODataHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, result):
+        body = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, status, message):
+        self.send_json(status, {'odata.error': {'code': '', 'message': {'lang': 'nl-NL', 'value': message}}})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        match = PATH_PATTERN.match(url.path)
+        if not match: return self.error(404, f"Onbekend pad: {url.path}")
+        dataset_id, table_name = match.groups()
+        if dataset_id != state.dataset_id: return self.error(404, f"Onbekende dataset: {dataset_id}")
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        rows = state.tables[table_name]
+        with state.lock: state.requests += 1
+
+        terms = parse_filter(params.get('$filter'))
+        if terms is None: return self.error(400, f"Niet ondersteund door de stand-in: $filter={params['$filter']}")
+        if terms: rows = [row for row in rows if any(text in (row.get(key) or '') for text, key in terms)]
+        skip = int(params.get('$skip', 0))
+        top = params.get('$top')
+        limit = min(int(top), MAX_ROWS_PER_RESPONSE) if top is not None else MAX_ROWS_PER_RESPONSE
+        page = rows[skip:skip + limit]
+
+        if table_name == 'TypedDataSet' and state.fail_times and skip == state.fail_page * state.page_size:
+            with state.lock:
+                fail = state.failures < state.fail_times
+                if fail: state.failures += 1
+            if fail:
+                print(f"{time.monotonic() - state.started:8.2f}s page {state.fail_page} ($skip={skip}) -> 500 "
+                      f"(fout {state.failures}/{state.fail_times})")
+                return self.error(500, "Gesimuleerde serverfout.")
+        if state.delay and table_name == 'TypedDataSet': time.sleep(state.delay)
+
+        select = params.get('$select')
+        if select:
+            keys = select.split(',')
+            unknown = [key for key in keys if rows and key not in rows[0]]
+            if unknown: return self.error(400, f"Onbekende kolom(men) in $select: {', '.join(unknown)}")
+            page = [{key: row.get(key) for key in keys} for row in page]
+
+        result = {'odata.metadata': f"{self.headers.get('Host', '')}/$metadata#{table_name}", 'value': page}
+        if top is None and skip + limit < len(rows):
+            next_params = {**params, '$skip': skip + limit}
+            result['odata.nextLink'] = f"http://{self.headers.get('Host')}{url.path}?{urlencode(next_params)}"
+        if table_name == 'TypedDataSet':
+            print(f"{time.monotonic() - state.started:8.2f}s {table_name} $skip={skip} $top={top} -> {len(page)} rijen")
+        self.send_json(200, result)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lokale stand-in van de CBS OData API voor de geprojecteerde download.")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--dataset-id", default="SYNTHETISCH", help="Dataset ID in de URL (en in TableInfos).")
+    parser.add_argument("--data-dir", default=None, help="Bestaande synthetische dataset; anders wordt er een gegenereerd.")
+    parser.add_argument("--gemeenten", type=int, default=50, help="Zonder --data-dir: aantal gemeenten.")
+    parser.add_argument("--wijken", type=int, default=10, help="Zonder --data-dir: aantal wijken per gemeente.")
+    parser.add_argument("--buurten", type=int, default=4, help="Zonder --data-dir: aantal buurten per wijk.")
+    parser.add_argument("--topics", type=int, default=100, help="Zonder --data-dir: aantal topics.")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconden vertraging per TypedDataSet page.")
+    parser.add_argument("--page-size", type=int, default=10000, help="Page grootte van main.py (DOWNLOAD_PAGE_SIZE), voor --fail-page.")
+    parser.add_argument("--fail-page", type=int, default=None, help="Laat deze page (0 = eerste) mislukken met HTTP 500.")
+    parser.add_argument("--fail-times", type=int, default=1, help="Aantal keer dat --fail-page mislukt (meer dan 5 breekt de download af).")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir
+    if data_dir is None:
+        data_dir = tempfile.mkdtemp(prefix="kwb_odata_")
+        records = generate_dataset(data_dir, args.gemeenten, args.wijken, args.buurten, args.topics)
+        print(f"Synthetische dataset: {records} records in {data_dir}")
+    state = ODataState(data_dir, args.dataset_id, args.delay, args.fail_page,
+                       args.fail_times if args.fail_page is not None else 0, args.page_size)
+    for info in state.tables['TableInfos']: info['Identifier'] = args.dataset_id
+    print(f"CBS OData stand-in op http://127.0.0.1:{args.port}/ODataApi/odata/{args.dataset_id}/")
+    ThreadingHTTPServer(('127.0.0.1', args.port), ODataHandler).serve_forever()
@@ -0,0 +1,185 @@
+# Benchmark van de pipeline in main.py op een synthetische dataset (zie synthetic_dataset.py).
+#
+# Meet per stap de tijd (mediaan van --repeat runs) en de geheugenpiek (tracemalloc, aparte
+# run) en vergelijkt die met de opgeslagen baseline. Een stap die meer dan --threshold keer
+# trager of groter is dan de baseline telt als regressie (exit code 1).
+#
+# Gebruik (vanuit de hoofdmap van het project):
+#   python bench/pipeline_bench.py [--scale small|medium|large] [--repeat N] [--update-baseline]
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import main
+from synthetic_dataset import generate_dataset
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_THRESHOLD = 1.25 # Meer dan 25% trager/groter dan de baseline is een regressie
+MIN_SECONDS_DELTA = 0.005 # Kleinere tijdsverschillen zijn ruis
+MIN_KIB_DELTA = 256       # Kleinere geheugenverschillen zijn ruis
+SCALES = {
+    # naam: (gemeenten, wijken per gemeente, buurten per wijk, topics)
+    'small': (50, 10, 4, 50),
+    'medium': (350, 10, 4, 100),
+    'large': (350, 40, 8, 120),
+}
+BENCH_YEAR = 2099
+
+class PipelineState:
+    """Paden en tussenresultaten die de stappen aan elkaar doorgeven."""
+
+    def __init__(self, work_dir):
+        self.data_dir = os.path.join(work_dir, "cbs_data")
+        self.output_dir = os.path.join(work_dir, "wiki_output")
+        self.typed_data_set = os.path.join(self.data_dir, "TypedDataSet.json")
+        self.cache_path = os.path.join(self.data_dir, main.STRIPPED_DATA_CACHE_FILENAME.format(year=BENCH_YEAR))
+        self.key_map = self.metadata_dict = self.stripped = self.derived = None
+
+    def output(self, name):
+        return os.path.join(self.output_dir, name)
+
+def stage_key_map(state):
+    data_properties = main.load_json(os.path.join(state.data_dir, "DataProperties.json"))
+    state.key_map, state.metadata_dict, _ = main.build_key_map(data_properties, main.REQUIRED_STATS_BASE_NAMES)
+
+def stage_strip(state, streaming):
+    state.stripped = main.load_and_strip_typed_data(
+        state.typed_data_set, main.REGION_IDENTIFIER_KEY, main.REGION_TYPE_KEY,
+        main.TARGET_REGION_TYPES, set(state.key_map.values()), streaming=streaming)
+
+def stage_cache_save(state):
+    main.save_stripped_cache(state.stripped, state.cache_path, state.typed_data_set,
+                             set(state.key_map.values()), main.TARGET_REGION_TYPES)
+
+def stage_cache_load(state):
+    assert main.load_stripped_cache(state.cache_path, state.typed_data_set,
+                                    set(state.key_map.values()), main.TARGET_REGION_TYPES) is not None
+
+def stage_derive(state):
+    state.derived = main.derive_statistics(state.stripped, state.key_map, state.metadata_dict)
+
+def stage_lua(state, layout):
+    table, key_map, metadata_dict = state.derived
+    main.generate_lua_data_submodule(table, metadata_dict, key_map, "SYNTHETISCH", BENCH_YEAR,
+                                     state.output(f"data_{layout}.lua"), state.output(f"data_{layout}_doc.wikitext"),
+                                     layout=layout)
+
+def stage_templates(state):
+    _, key_map, metadata_dict = state.derived
+    main.generate_dispatcher_lua(key_map, state.output("dispatcher.lua"))
+    main.generate_dispatcher_doc(key_map, BENCH_YEAR, "SYNTHETISCH", state.output("dispatcher_doc.wikitext"))
+    main.generate_wikitemplates(metadata_dict, key_map, BENCH_YEAR, "SYNTHETISCH",
+                                state.output("stat.wikitext"), state.output("info.wikitext"),
+                                state.output("stat_doc.wikitext"), state.output("info_doc.wikitext"),
+                                state.output("stats.wikitext"), state.output("stats_doc.wikitext"))
+
+# Volgorde is belangrijk: latere stappen gebruiken de resultaten van eerdere
+STAGES = [
+    ('key_map', stage_key_map),
+    ('strip_streaming', lambda state: stage_strip(state, True)),
+    ('strip_in_memory', lambda state: stage_strip(state, False)),
+    ('cache_save', stage_cache_save),
+    ('cache_load', stage_cache_load),
+    ('derive', stage_derive),
+    ('lua_rows', lambda state: stage_lua(state, 'rows')),
+    ('lua_columns', lambda state: stage_lua(state, 'columns')),
+    ('templates', stage_templates),
+]
+
+def run_stages(state, measure_memory=False):
+    """Draait alle stappen één keer; geeft {stap: seconden} of {stap: piek KiB} terug."""
+    results = {}
+    for name, stage in STAGES:
+        gc.collect()
+        with contextlib.redirect_stdout(io.StringIO()):
+            if measure_memory:
+                tracemalloc.start()
+                stage(state)
+                results[name] = tracemalloc.get_traced_memory()[1] / 1024
+                tracemalloc.stop()
+            else:
+                start = time.perf_counter()
+                stage(state)
+                results[name] = time.perf_counter() - start
+    return results
+
+def run_benchmark(scale, repeat):
+    """Genereert de dataset voor `scale` en meet alle stappen; geeft {stap: {seconds, peak_kib}} terug."""
+    gemeenten, wijken, buurten, topics = SCALES[scale]
+    with tempfile.TemporaryDirectory(prefix="kwb_bench_") as work_dir:
+        state = PipelineState(work_dir)
+        records = generate_dataset(state.data_dir, gemeenten, wijken, buurten, topics)
+        print(f"Synthetische dataset '{scale}': {records} records, {topics} topics, "
+              f"{os.path.getsize(state.typed_data_set) / 1024 / 1024:.1f} MiB")
+        timings = [run_stages(state) for _ in range(repeat)]
+        memory = run_stages(state, measure_memory=True)
+    return {name: {'seconds': statistics.median(run[name] for run in timings), 'peak_kib': memory[name]}
+            for name, _ in STAGES}
+
+def compare(results, baseline, threshold):
+    """Print de resultaten naast de baseline; geeft de lijst met regressies terug."""
+    regressions = []
+    print(f"{'stap':<18}{'tijd (ms)':>12}{'baseline':>12}{'ratio':>8}{'piek (KiB)':>14}{'baseline':>12}{'ratio':>8}")
+    for name, result in results.items():
+        base = (baseline or {}).get(name)
+        row = f"{name:<18}{result['seconds'] * 1000:>12.1f}"
+        if base:
+            time_ratio = result['seconds'] / base['seconds'] if base['seconds'] else 1.0
+            memory_ratio = result['peak_kib'] / base['peak_kib'] if base['peak_kib'] else 1.0
+            row += f"{base['seconds'] * 1000:>12.1f}{time_ratio:>8.2f}"
+            row += f"{result['peak_kib']:>14.0f}{base['peak_kib']:>12.0f}{memory_ratio:>8.2f}"
+            if time_ratio > threshold and result['seconds'] - base['seconds'] > MIN_SECONDS_DELTA:
+                regressions.append(f"{name}: tijd {time_ratio:.2f}x")
+            if memory_ratio > threshold and result['peak_kib'] - base['peak_kib'] > MIN_KIB_DELTA:
+                regressions.append(f"{name}: geheugen {memory_ratio:.2f}x")
+        else:
+            row += f"{'-':>12}{'':>8}{result['peak_kib']:>14.0f}{'-':>12}"
+        print(row)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de KWB pipeline per stap op een synthetische dataset.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default='medium', help="Grootte van de synthetische dataset.")
+    parser.add_argument("--repeat", type=int, default=3, help="Aantal tijdsmetingen per stap (de mediaan telt).")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="JSON bestand met de baselines per schaal.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Maximale ratio t.o.v. de baseline.")
+    parser.add_argument("--update-baseline", action="store_true", help="Sla de resultaten op als nieuwe baseline voor deze schaal.")
+    parser.add_argument("--json", help="Schrijf de resultaten ook naar dit JSON bestand.")
+    args = parser.parse_args()
+
+    main.TEMPLATE_DIR = os.path.join(ROOT, main.TEMPLATE_DIR)
+    results = run_benchmark(args.scale, args.repeat)
+    baselines = main.load_json(args.baseline) if os.path.exists(args.baseline) else None
+    baselines = baselines if isinstance(baselines, dict) else {}
+    baseline = baselines.get(args.scale, {}).get('stages')
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.json: main.save_json({'scale': args.scale, 'stages': results}, args.json)
+    if args.update_baseline:
+        baselines[args.scale] = {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'recorded': time.strftime('%Y-%m-%d'),
+            'stages': results,
+        }
+        if main.save_json(baselines, args.baseline): print(f"Baseline '{args.scale}' opgeslagen in {args.baseline}")
+    elif baseline is None:
+        print(f"Geen baseline voor '{args.scale}' in {args.baseline}; gebruik --update-baseline.")
+    elif regressions:
+        print(f"REGRESSIE (drempel {args.threshold:.2f}x): {', '.join(regressions)}")
+        sys.exit(1)
+    else:
+        print(f"Geen regressies (drempel {args.threshold:.2f}x).")
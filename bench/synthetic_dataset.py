@@ -0,0 +1,126 @@
+# Synthetische CBS Kerncijfers Wijken en Buurten dataset, voor benchmarks zonder download.
+#
+# Schrijft TypedDataSet.json, DataProperties.json en TableInfos.json in dezelfde vorm als
+# de CBS OData API: opgevulde regiocodes en -soorten, sleutels met suffix (AantalInwoners_5),
+# nulls en vreemde strings (quotes, backslashes, regeleinden, unicode).
+#
+# Gebruik (vanuit de hoofdmap van het project):
+#   python bench/synthetic_dataset.py <data_map> [--gemeenten N] [--wijken N] [--buurten N] [--topics N]
+
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from main import REQUIRED_STATS_BASE_NAMES, REGION_IDENTIFIER_KEY, REGION_TYPE_KEY
+
+# Suffixen zoals in de echte KWB datasets (het nummer is de kolompositie)
+KNOWN_SUFFIXES = {
+    'AantalInwoners': 5, 'Mannen': 6, 'Vrouwen': 7, 'Bevolkingsdichtheid': 33, 'Woningvoorraad': 34,
+    'OppervlakteTotaal': 111, 'OppervlakteLand': 112, 'OppervlakteWater': 113,
+}
+ODD_STRINGS = [
+    "'s-Hertogenbosch", "Súdwest-Fryslân", "Bergen (NH.)", 'Naam met "quotes"', 'Pad\\met\\backslashes',
+    "Regel\neinde", "  spaties  ", "", ".", "Ĳsselstein",
+]
+STRING_TOPICS = ['MeestVoorkomendePostcode', 'Dekkingspercentage'] # Tekst kolommen, zoals in de echte data
+
+def build_topics(topic_count):
+    """Geeft de topic sleutels: eerst de vereiste basisnamen (met bekende suffix), daarna opvullers."""
+    topics, position = [], 8
+    for base_name in REQUIRED_STATS_BASE_NAMES:
+        suffix = KNOWN_SUFFIXES.get(base_name)
+        if suffix is None:
+            position += 1
+            suffix = position
+        topics.append(f"{base_name}_{suffix}")
+    for base_name in STRING_TOPICS:
+        position += 1
+        topics.append(f"{base_name}_{position}")
+    while len(topics) < topic_count:
+        position += 1
+        topics.append(f"Kerncijfer{len(topics)}_{position}")
+    return topics
+
+def topic_value(topic, rng, null_fraction):
+    """Een waarde voor een topic: null, een string (tekst topics) of een int/float."""
+    if rng.random() < null_fraction: return None
+    base_name = topic.rsplit('_', 1)[0]
+    if base_name in STRING_TOPICS:
+        return rng.choice(ODD_STRINGS) if rng.random() < 0.2 else f"{rng.randint(1000, 9999)} {rng.choice('ABCDEFGH')}{rng.choice('KLMNPRST')}"
+    if base_name.startswith('Oppervlakte') or base_name == 'Bevolkingsdichtheid':
+        return rng.randint(0, 100000)
+    if rng.random() < 0.1:
+        return round(rng.uniform(0, 1000), 1)
+    return rng.randint(0, 100000)
+
+def iter_regions(gemeenten, wijken, buurten):
+    """Levert (code, soort) voor Nederland, de gemeenten, hun wijken en buurten."""
+    yield 'NL01', 'Land'
+    for g in range(gemeenten):
+        yield f'GM{g:04d}', 'Gemeente'
+        for w in range(wijken):
+            yield f'WK{g:04d}{w:02d}', 'Wijk'
+            for b in range(buurten):
+                yield f'BU{g:04d}{w:02d}{b:02d}', 'Buurt'
+
+def generate_dataset(data_dir, gemeenten=350, wijken=10, buurten=4, topic_count=100, null_fraction=0.05, seed=1):
+    """Schrijft de synthetische dataset naar `data_dir` en geeft het aantal records terug.
+
+    TypedDataSet.json wordt record voor record geschreven, dus ook grote schalen passen in het geheugen.
+    """
+    rng = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    topics = build_topics(topic_count)
+
+    count = 0
+    with open(os.path.join(data_dir, 'TypedDataSet.json'), 'w', encoding='utf-8') as f:
+        f.write('[')
+        for count, (code, region_type) in enumerate(iter_regions(gemeenten, wijken, buurten), 1):
+            record = {
+                'ID': count - 1,
+                'WijkenEnBuurten': code.ljust(10),
+                'Gemeentenaam_1': (rng.choice(ODD_STRINGS) if rng.random() < 0.05 else f"Gemeente {code[2:6]}").ljust(40),
+                REGION_TYPE_KEY: region_type.ljust(10),
+                REGION_IDENTIFIER_KEY: code.ljust(10),
+                'IndelingswijzigingWijkenEnBuurten_4': rng.choice(['1', '2', '3', None]),
+            }
+            for topic in topics: record[topic] = topic_value(topic, rng, null_fraction)
+            if count > 1: f.write(',\n')
+            json.dump(record, f, ensure_ascii=False)
+        f.write(']')
+
+    properties = [
+        {'odata.type': 'Cbs.OData.Dimension', 'ID': 0, 'Key': 'WijkenEnBuurten', 'Title': 'Wijken en buurten'},
+        {'odata.type': 'Cbs.OData.TopicGroup', 'ID': 1, 'Key': '', 'Title': 'Regioaanduiding'},
+    ]
+    for position, topic in enumerate(topics, 2):
+        base_name = topic.rsplit('_', 1)[0]
+        properties.append({
+            'odata.type': 'Cbs.OData.Topic', 'ID': position, 'Key': topic, 'Title': base_name,
+            'Description': f"Synthetische beschrijving van {base_name}.\nMet een \"quote\" en een regeleinde.",
+            'Type': 'String' if base_name in STRING_TOPICS else 'Double',
+            'Unit': '' if base_name in STRING_TOPICS else 'aantal',
+            'Decimals': 0,
+        })
+    with open(os.path.join(data_dir, 'DataProperties.json'), 'w', encoding='utf-8') as f:
+        json.dump(properties, f, ensure_ascii=False, indent=1)
+    with open(os.path.join(data_dir, 'TableInfos.json'), 'w', encoding='utf-8') as f:
+        json.dump([{'ID': 0, 'Title': 'Kerncijfers wijken en buurten (synthetisch)', 'Identifier': 'SYNTHETISCH'}], f)
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genereer een synthetische CBS KWB dataset (TypedDataSet/DataProperties/TableInfos).")
+    parser.add_argument("data_dir", help="Doelmap, bv. 2099/cbs_data.")
+    parser.add_argument("--gemeenten", type=int, default=350, help="Aantal gemeenten.")
+    parser.add_argument("--wijken", type=int, default=10, help="Aantal wijken per gemeente.")
+    parser.add_argument("--buurten", type=int, default=4, help="Aantal buurten per wijk.")
+    parser.add_argument("--topics", type=int, default=100, help="Aantal topics (kolommen), incl. de vereiste stats.")
+    parser.add_argument("--null-fraction", type=float, default=0.05, help="Kans op een null waarde.")
+    parser.add_argument("--seed", type=int, default=1, help="Seed voor de random generator.")
+    args = parser.parse_args()
+
+    records = generate_dataset(args.data_dir, args.gemeenten, args.wijken, args.buurten, args.topics, args.null_fraction, args.seed)
+    print(f"Geschreven: {records} records, {args.topics} topics naar {args.data_dir}")
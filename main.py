@@ -3,11 +3,33 @@
 import cbsodata
 import json
 import os
+import shutil
 import datetime
 import sys
 import argparse
+import array
+import cProfile
 import gc
+import hashlib
+import re
+import struct
+import threading
+import time
+import tracemalloc
+import zlib
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
+from itertools import compress, count, repeat
+from operator import itemgetter, ne
+try:
+    import resource # Niet beschikbaar op Windows; dan geen RSS in het profiel
+except ImportError:
+    resource = None
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED, as_completed
 from datetime import datetime, timezone # Explicitly import timezone
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # --- Configuratie ---
 DEFAULT_DATASET_ID_PATTERN = '85984NED' # Basis patroon, pas aan per jaar indien nodig
@@ -31,15 +53,109 @@ REQUIRED_STATS_BASE_NAMES = [
 # Definieer welke regio soorten behouden moeten blijven (opgeschoonde waarden)
 TARGET_REGION_TYPES = {'Gemeente', 'Wijk'}
 
+# Afgeleide statistieken, berekend tijdens het genereren (zie derive_statistics).
+# Verhoudingen: naam -> teller / noemer * schaal (basisnamen), afgerond op `decimals`.
+DERIVED_RATIO_STATS = {
+    'PercentageVrouwen': {'numerator': 'Vrouwen', 'denominator': 'AantalInwoners', 'scale': 100, 'decimals': 1,
+                          'title': 'Percentage vrouwen', 'unit': '%'},
+    'InwonersPerWoning': {'numerator': 'AantalInwoners', 'denominator': 'Woningvoorraad', 'scale': 1, 'decimals': 2,
+                          'title': 'Inwoners per woning', 'unit': 'aantal'},
+    'PercentageLand': {'numerator': 'OppervlakteLand', 'denominator': 'OppervlakteTotaal', 'scale': 100, 'decimals': 1,
+                       'title': 'Aandeel land in oppervlakte', 'unit': '%'},
+}
+# Rangschikkingen: naam -> rang van een (basis of afgeleide) stat binnen de bovenliggende regio
+# (wijk binnen gemeente, gemeente binnen Nederland); 1 = hoogste waarde tenzij descending False.
+DERIVED_RANK_STATS = {
+    'RangAantalInwoners': {'stat': 'AantalInwoners', 'descending': True, 'title': 'Rang naar aantal inwoners'},
+    'RangBevolkingsdichtheid': {'stat': 'Bevolkingsdichtheid', 'descending': True, 'title': 'Rang naar bevolkingsdichtheid'},
+}
+
 # Bestandsnaam voor de gecachte gestripte & gefilterde data (in data map)
-STRIPPED_DATA_CACHE_FILENAME = "stripped_filtered_data_{year}.json" # Added 'filtered' to name
+STRIPPED_DATA_CACHE_FILENAME = "stripped_filtered_data_{year}.kwbc" # Binair kolom-formaat, zie save_stripped_cache
+STRIPPED_DATA_CACHE_MAGIC = b'KWBC'
+STRIPPED_DATA_CACHE_VERSION = 1
+
+# --- Download Configuratie (geprojecteerde download via de CBS OData API) ---
+CBS_ODATA_BASE_URL = "https://opendata.cbs.nl/ODataApi/odata" # Ondersteunt $select/$filter/$top/$skip
+DOWNLOAD_PAGE_SIZE = 10000      # Max. aantal rijen per request (limiet van de CBS OData API)
+DOWNLOAD_WORKERS = 4            # Aantal gelijktijdige page downloads
+DOWNLOAD_PAGES_DIRNAME = "_pages_TypedDataSet"        # Tussenmap voor hervatbare page downloads (in data map)
+DOWNLOAD_QUERY_FILENAME = "TypedDataSet.query.json"   # Beschrijft de projectie van een geprojecteerde download
+
+# --- Upload Configuratie (--upload, via de MediaWiki action API) ---
+WIKI_API_URL = "https://nl.wikipedia.org/w/api.php"
+WIKI_PASSWORD_ENV = "KWB_WIKI_PASSWORD" # Omgevingsvariabele met het (bot) wachtwoord; niet via de command line
+WIKI_USER_AGENT = "CBS-KWB-Wiki-Generator/1.0 (python-requests)"
+WIKI_QUERY_BATCH = 50      # Max. aantal titels per query (limiet voor gewone gebruikers)
+UPLOAD_WORKERS = 2         # Gelijktijdige edits
+UPLOAD_EDITS_PER_MINUTE = 30
+UPLOAD_MAXLAG = 5          # Seconden replicatie lag waarboven de wiki edits weigert (zie mw:Manual:Maxlag_parameter)
+UPLOAD_MAX_RETRIES = 5     # Pogingen per request bij maxlag/ratelimited/HTTP 429/503
+UPLOAD_BACKOFF = 5         # Seconden; verdubbelt per poging als de wiki geen Retry-After meegeeft
+UPLOAD_SUMMARY = "Bijgewerkt met de CBS Kerncijfers Wijken en Buurten generator"
+
+# Chunkgrootte (in tekens) voor het incrementeel inlezen van TypedDataSet.json
+STREAM_CHUNK_SIZE = 1 << 20
 
 # Map voor template bestanden
 TEMPLATE_DIR = "templates"
 
+# Buffergrootte (bytes) voor het streamend wegschrijven van grote output bestanden
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+# Manifest (in de output map) met per output bestand een hash van de inputs
+OUTPUT_MANIFEST_FILENAME = "_manifest.json"
+
+# Layouts van de Lua data (sub)modules: templates en beschrijving van de datastructuur voor de /doc pagina
+LUA_DATA_LAYOUTS = {
+    'rows': {
+        'module': "module_data.lua",
+        'shard': "module_data_shard.lua",
+        'doc': "* `p.data` (tabel): De kerncijfers per regio. De sleutels zijn de regiocodes ({region_id_key}, bv. <code>GM0363</code>, <code>WK036301</code>).",
+    },
+    'columns': {
+        'module': "module_data_columns.lua",
+        'shard': "module_data_shard_columns.lua",
+        'doc': "* `p.regions` (tabel): Het rijnummer per regiocode ({region_id_key}, bv. <code>GM0363</code>, <code>WK036301</code>).\n"
+               "* `p.columns` (tabel): Per statistiek (volledige CBS sleutel) een array met de waarde per rijnummer.",
+    },
+}
+LUA_COLUMN_VALUES_PER_LINE = 20 # Waarden (of regio's) per regel in de kolommen-layout
+
+# Profiel rapport (--profile), naast de wiki_output map
+PROFILE_REPORT_FILENAME = "run_profile.json"
+
+# Wijzigingsrapport: revisies t.o.v. de vorige release (de vorige cache), naast de wiki_output map
+CHANGE_REPORT_FILENAME = "changes.json"
+
+# Tijdreeks module (--series): per regio en stat een reeks over alle lokaal gecachte jaren
+SERIES_DIR = "reeks"                                # Map met de samengevoegde cache en wiki_output
+SERIES_CACHE_FILENAME = "series_cache.kwbc"         # Zelfde kolom-formaat als de stripped cache, kolom per stat@jaar
+SERIES_CACHE_MAGIC = b'KWBS'
+SERIES_MODULE_NAME = "Reeks"                        # Wiki pagina: LUA_DISPATCHER_MODULE_PATH/Reeks
+SERIES_STATS = REQUIRED_STATS_BASE_NAMES + list(DERIVED_RATIO_STATS) + list(DERIVED_RANK_STATS) # Basisnamen, zonder suffix
+
+# Watch modus (--watch): poll interval en welke stap een template gebruikt (op prefix van de bestandsnaam)
+WATCH_INTERVAL = 0.25 # Seconden
+WATCH_TEMPLATE_STEPS = {
+    'module_data': 'lua_data',        # module_data*.lua/.wikitext: data submodule, index en shards
+    'module_dispatcher': 'dispatcher',
+    'template_': 'templates',
+}
+OUTPUT_STEPS = ('lua_data', 'dispatcher', 'templates')
+
+# Batch modus: map voor de jaar-onafhankelijke outputs (dispatcher, Stat/Info sjablonen)
+BATCH_SHARED_OUTPUT_DIR = os.path.join("gedeeld", "wiki_output")
+BATCH_WORKERS = min(4, os.cpu_count() or 1)
+
+# Gesharde data submodule (--shard): een kleine index module plus één submodule per gemeente (of groep gemeenten)
+SHARD_MAX_BYTES = 2000 * 1024 # MediaWiki $wgMaxArticleSize is standaard 2048 KiB
+SHARD_DEFAULT_DIGITS = 4      # Cijfers van het gemeentenummer per shard: 4 = één shard per gemeente
+
 # --- Wiki Paden en Namen (Constanten voor duidelijkheid) ---
 LUA_DISPATCHER_MODULE_PATH = "Module:CBS_Kerncijfers_Wijken_en_Buurten_Data"
 TEMPLATE_STAT_PATH = "Template:CBS_Kerncijfers_Wijken_en_Buurten_Stat"
+TEMPLATE_STATS_PATH = "Template:CBS_Kerncijfers_Wijken_en_Buurten_Stats" # Meerdere stats/regio's in één aanroep
 TEMPLATE_INFO_PATH = "Template:CBS_Kerncijfers_Wijken_en_Buurten"
 
 
@@ -55,20 +171,177 @@ def check_data_files_exist(data_dir):
             return False
     return True
 
-def download_data(dataset_id, data_dir, overwrite=False):
-    """Downloadt CBS data, checkt eerst of data al bestaat."""
+def check_download_projection(data_dir, required_base_names, target_region_types):
+    """Controleert of een geprojecteerde TypedDataSet download alle benodigde stats en regio types bevat."""
+    query = load_json(os.path.join(data_dir, DOWNLOAD_QUERY_FILENAME))
+    if query is None: return True # Geen projectie vastgelegd: volledige download
+    missing_bases = set(required_base_names) - set(query.get('base_names', []))
+    missing_types = set(target_region_types) - set(query.get('region_types', []))
+    if missing_bases or missing_types:
+        print(f"  Info: Geprojecteerde download mist stats {sorted(missing_bases)} / regio types {sorted(missing_types)}.")
+        return False
+    return True
+
+def create_http_session(workers=DOWNLOAD_WORKERS, status_forcelist=(429, 500, 502, 503, 504)):
+    """Maakt een HTTP sessie met connection pooling en automatische retries.
+
+    Verbindingsfouten worden altijd opnieuw geprobeerd; GET requests met een status uit
+    `status_forcelist` ook. Met een lege `status_forcelist` handelt de aanroeper die statussen zelf af.
+    """
+    session = requests.Session()
+    retry = Retry(total=5, backoff_factor=1, status_forcelist=status_forcelist, allowed_methods=frozenset(['GET']))
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def fetch_odata_rows(session, url, params=None):
+    """Haalt alle rijen van een OData request op (volgt odata.nextLink). Geeft (rijen, bytes) terug."""
+    rows, received_bytes = [], 0
+    while url:
+        r = session.get(url, params=params, timeout=300)
+        r.raise_for_status()
+        r.encoding = 'utf-8'
+        received_bytes += len(r.content)
+        res = r.json()
+        rows.extend(res['value'])
+        url, params = res.get('odata.nextLink'), None
+    return rows, received_bytes
+
+def build_region_type_filter(region_type_key, region_types):
+    """Bouwt een OData $filter expressie die alleen de opgegeven regio types doorlaat."""
+    return " or ".join(f"substringof('{t}',{region_type_key})" for t in sorted(region_types))
+
+def download_projected_table(session, table_url, select, odata_filter, output_path, pages_dir,
+                             page_size=DOWNLOAD_PAGE_SIZE, workers=DOWNLOAD_WORKERS):
+    """Downloadt een tabel met $select/$filter in parallelle pages naar een JSON bestand.
+
+    Elke page wordt direct naar `pages_dir` geschreven zodra hij binnen is; een
+    onderbroken download hervat daardoor bij de volgende run met de ontbrekende pages.
+    Geeft (aantal rijen, ontvangen bytes, hervatte pages) terug.
+    """
+    query = {'select': select, 'filter': odata_filter, 'page_size': page_size}
+    query_path = os.path.join(pages_dir, 'query.json')
+    if os.path.isdir(pages_dir) and load_json(query_path) != query:
+        print("  Info: Bestaande pages horen bij een andere projectie. Opnieuw beginnen.")
+        shutil.rmtree(pages_dir)
+    os.makedirs(pages_dir, exist_ok=True)
+    save_json(query, query_path)
+
+    def page_path(index):
+        return os.path.join(pages_dir, f"page_{index:06d}.json")
+
+    def fetch_page(index):
+        path = page_path(index)
+        if os.path.isfile(path):
+            rows = load_json(path)
+            if rows is not None: return len(rows), 0, True
+        params = {
+            '$format': 'json', '$select': ','.join(select), '$filter': odata_filter,
+            '$top': page_size, '$skip': index * page_size,
+        }
+        rows, received_bytes = fetch_odata_rows(session, table_url, params)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(rows, f)
+        os.replace(tmp_path, path) # Atomisch: een page staat volledig of niet op schijf
+        return len(rows), received_bytes, False
+
+    last_index, next_index = None, 0
+    total_bytes, resumed_pages, pending = 0, 0, {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # Houd `workers` pages in de lucht totdat de laatste (onvolledige) page bekend is
+            while last_index is None and len(pending) < workers:
+                pending[pool.submit(fetch_page, next_index)] = next_index
+                next_index += 1
+            if not pending: break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                row_count, received_bytes, from_disk = future.result()
+                total_bytes += received_bytes
+                resumed_pages += from_disk
+                if row_count < page_size and (last_index is None or index < last_index):
+                    last_index = index
+
+    tmp_output = output_path + '.tmp'
+    total_rows = 0
+    with open(tmp_output, 'w', encoding='utf-8') as out:
+        out.write('[')
+        for index in range(last_index + 1):
+            for row in load_json(page_path(index)):
+                out.write(',\n' if total_rows else '\n')
+                json.dump(row, out)
+                total_rows += 1
+        out.write('\n]')
+    os.replace(tmp_output, output_path)
+    record_written(output_path)
+    shutil.rmtree(pages_dir)
+    return total_rows, total_bytes, resumed_pages
+
+def download_projected_data(dataset_id, data_dir, base_url=CBS_ODATA_BASE_URL, workers=DOWNLOAD_WORKERS):
+    """Downloadt metadata en alleen de benodigde kolommen/regio's van TypedDataSet via de OData API."""
+    table_url = f"{base_url.rstrip('/')}/{dataset_id}/"
+    total_bytes = 0
+    with create_http_session(workers) as session:
+        for table_name in ('TableInfos', 'DataProperties'):
+            rows, received_bytes = fetch_odata_rows(session, table_url + table_name, {'$format': 'json'})
+            total_bytes += received_bytes
+            if not save_json(rows, os.path.join(data_dir, f"{table_name}.json")): return False
+            if table_name == 'DataProperties': data_properties = rows
+
+        key_map, _, missing_bases = build_key_map(data_properties, REQUIRED_STATS_BASE_NAMES)
+        if missing_bases:
+            print(f"Fout: Mapping mist voor: {missing_bases}. Kan projectie niet bepalen.")
+            return False
+        select = [REGION_IDENTIFIER_KEY, REGION_TYPE_KEY] + sorted(set(key_map.values()))
+        odata_filter = build_region_type_filter(REGION_TYPE_KEY, TARGET_REGION_TYPES)
+        print(f"  Projectie: $select={','.join(select)}")
+        print(f"  Filter: $filter={odata_filter}")
+        # Eerst de projectie vastleggen: een TypedDataSet zonder beschrijving wordt als volledig beschouwd
+        projection = {
+            'dataset_id': dataset_id,
+            'base_names': sorted(REQUIRED_STATS_BASE_NAMES),
+            'region_types': sorted(TARGET_REGION_TYPES),
+            'select': select,
+            'filter': odata_filter,
+        }
+        if not save_json(projection, os.path.join(data_dir, DOWNLOAD_QUERY_FILENAME)): return False
+
+        total_rows, received_bytes, resumed_pages = download_projected_table(
+            session, table_url + 'TypedDataSet', select, odata_filter,
+            os.path.join(data_dir, 'TypedDataSet.json'), os.path.join(data_dir, DOWNLOAD_PAGES_DIRNAME),
+            workers=workers,
+        )
+        total_bytes += received_bytes
+    resumed_str = f", {resumed_pages} pages hervat" if resumed_pages else ""
+    print(f"  {total_rows} rijen gedownload ({total_bytes / 1e6:.1f} MB ontvangen{resumed_str}).")
+    return True
+
+def download_data(dataset_id, data_dir, overwrite=False, projected=True, base_url=CBS_ODATA_BASE_URL, workers=DOWNLOAD_WORKERS):
+    """Downloadt CBS data, checkt eerst of data al bestaat.
+
+    Met `projected=True` worden alleen de benodigde kolommen en regio types opgehaald
+    (parallel en hervatbaar); anders de volledige tabel via `cbsodata`.
+    """
     print(f"Controleren bron data directory: {data_dir}")
     os.makedirs(os.path.dirname(data_dir), exist_ok=True)
-    should_download = overwrite or not check_data_files_exist(data_dir)
+    should_download = (overwrite or not check_data_files_exist(data_dir)
+                       or not check_download_projection(data_dir, REQUIRED_STATS_BASE_NAMES, TARGET_REGION_TYPES))
     if not should_download:
         print("  Bron data bestanden gevonden. Download overgeslagen.")
         return True
     action = "Overschrijven" if overwrite else "Downloaden"
-    print(f"  {action} bron data...")
+    print(f"  {action} bron data{' (geprojecteerd)' if projected else ''}...")
     print(f"Poging tot download dataset '{dataset_id}' naar '{data_dir}'...")
     try:
         os.makedirs(data_dir, exist_ok=True)
-        cbsodata.download_data(dataset_id, dir=data_dir)
+        if projected:
+            if not download_projected_data(dataset_id, data_dir, base_url, workers): return False
+        else:
+            cbsodata.download_data(dataset_id, dir=data_dir)
+            query_path = os.path.join(data_dir, DOWNLOAD_QUERY_FILENAME)
+            if os.path.exists(query_path): os.remove(query_path) # Volledige tabel: geen projectie meer
         if check_data_files_exist(data_dir):
             print("Download succesvol en geverifieerd.")
             return True
@@ -86,11 +359,19 @@ def load_json(filepath):
     except FileNotFoundError: return None
     except Exception as e: print(f"Fout bij laden {filepath}: {e}"); return None
 
+_WRITE_STATS = {'files': 0, 'bytes': 0} # Totaal geschreven output, voor het profiel (--profile)
+
+def record_written(filepath):
+    """Telt een zojuist geschreven bestand mee in de geschreven bytes."""
+    _WRITE_STATS['files'] += 1
+    _WRITE_STATS['bytes'] += os.path.getsize(filepath)
+
 def save_json(data, filepath):
     """Slaat data op naar een JSON bestand."""
     try:
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
         with open(filepath, 'w', encoding='utf-8') as f: json.dump(data, f, indent=2)
+        record_written(filepath)
         return True
     except Exception as e: print(f"Fout bij opslaan JSON naar {filepath}: {e}"); return False
 
@@ -99,45 +380,584 @@ def clean_key(key):
     if isinstance(key, str): return key.strip()
     return key
 
-def load_and_strip_typed_data(filepath, identifier_key, region_type_key, target_region_types, full_keys_to_keep):
-    """Laadt TypedDataSet, filtert op regio type, en behoudt alleen vereiste volledige sleutels."""
-    print(f"Laden, filteren ({'/'.join(target_region_types)}), en strippen {filepath}...")
-    stripped_data = {}
-    keys_to_keep_set = set(full_keys_to_keep)
-    keys_to_keep_set.add(identifier_key)
+def build_key_map(data_properties, required_base_names):
+    """Bouwt de key map (basisnaam -> volledige CBS sleutel) en metadata uit DataProperties.
 
-    try:
-        full_data = load_json(filepath)
-        if full_data is None:
-            print(f"Fout: Kon bronbestand {filepath} niet laden voor stripping.")
-            return None
+    Geeft (key_map, metadata_dict, missing_bases) terug.
+    """
+    key_map, metadata_dict, missing_bases = {}, {}, set(required_base_names)
+    for prop in data_properties:
+        if prop.get('odata.type') == 'Cbs.OData.Topic':
+             full_key = clean_key(prop.get('Key', ''))
+             if not full_key: continue
+             metadata_dict[full_key] = { k: prop.get(k) for k in ['Title', 'Description', 'Unit', 'Decimals'] }
+             base_name = full_key
+             if '_' in full_key and full_key.split('_')[-1].isdigit():
+                 base_name = '_'.join(full_key.split('_')[:-1])
+             if base_name in required_base_names:
+                 if base_name not in key_map: key_map[base_name] = full_key; missing_bases.discard(base_name)
+                 elif key_map[base_name] != full_key: print(f"Waarschuwing: Dubbele basisnaam '{base_name}'")
+    return key_map, metadata_dict, missing_bases
+
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+def iter_json_array(filepath, chunk_size=STREAM_CHUNK_SIZE):
+    """Leest een JSON array incrementeel in en levert de elementen één voor één op.
+
+    Alleen het huidige element en een buffer van ongeveer `chunk_size` tekens
+    staan tegelijk in het geheugen, ongeacht de grootte van het bestand.
+    """
+    decoder = json.JSONDecoder()
+    with open(filepath, 'r', encoding='utf-8') as f:
+        buf, pos, eof = '', 0, False
+        expect_value, started = True, False
+
+        while True:
+            pos = _JSON_WHITESPACE.match(buf, pos).end()
+            if pos >= len(buf) or (not eof and len(buf) - pos < 2):
+                if eof:
+                    raise ValueError(f"Onverwacht einde van JSON array in {filepath}")
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+
+            ch = buf[pos]
+            if not started:
+                if ch != '[': raise ValueError(f"{filepath} bevat geen JSON array")
+                started, pos = True, pos + 1
+                continue
+            if ch == ']':
+                return
+            if not expect_value:
+                if ch != ',': raise ValueError(f"Ongeldig scheidingsteken '{ch}' in {filepath}")
+                expect_value, pos = True, pos + 1
+                continue
+
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof: raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            if not eof and (end >= len(buf) or buf[end] not in ' \t\n\r,]'):
+                # Getal of literal kan afgekapt zijn aan het eind van de buffer; lees verder
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            yield value
+            expect_value, pos = False, end
+            if pos >= chunk_size:
+                buf, pos = buf[pos:], 0
+
+# --- Regio Tabel (compacte kolom-opslag van gestripte data) ---
+
+# Maskerwaarden per regio per stat
+MASK_MISSING, MASK_NULL, MASK_VALUE = 0, 1, 2
+REGION_TABLE_CHUNK_ROWS = 4096 # Aantal rijen dat per keer naar kolommen wordt omgezet
 
-        print(f"  Verwerken {len(full_data)} records...")
-        processed_count = 0
-        filtered_out_count = 0
-        for record in full_data:
+_MISSING = object() # Sentinel voor een ontbrekende stat (i.t.t. een null waarde)
+_MASK_OF = {None: MASK_NULL, _MISSING: MASK_MISSING}.get
+_INT_ZERO_FILL = {None: 0, _MISSING: 0}.get
+_FLOAT_ZERO_FILL = {None: 0.0, _MISSING: 0.0}.get
+_NONE_FILL = {_MISSING: None}.get
+_NARROW_INT_TYPECODES = [('b', 1 << 7), ('h', 1 << 15), ('i', 1 << 31)]
+
+class _ColumnBuilder:
+    """Verzamelt één stat kolom blok voor blok en kiest het compactste opslagtype."""
+    __slots__ = ('mask', 'values', 'typed')
+
+    def __init__(self):
+        self.mask = bytearray()
+        self.values = array.array('q')
+        self.typed = False # True zodra er een echte waarde is opgeslagen
+
+    def extend(self, chunk):
+        self.mask.extend(map(_MASK_OF, chunk, repeat(MASK_VALUE)))
+        value_types = set(map(type, chunk)) - {type(None), type(_MISSING)}
+        if isinstance(self.values, array.array):
+            if not value_types: wanted = self.values.typecode
+            elif value_types == {int}: wanted = 'q'
+            elif value_types == {float}: wanted = 'd'
+            else: wanted = None
+            if wanted != self.values.typecode:
+                if wanted is not None and not self.typed:
+                    self.values = array.array(wanted, bytes(8 * len(self.values)))
+                else:
+                    self.values = list(self.values) # Gemengde types: terugvallen op een lijst
+            self.typed = self.typed or bool(value_types)
+        if isinstance(self.values, array.array):
+            fill = _INT_ZERO_FILL if self.values.typecode == 'q' else _FLOAT_ZERO_FILL
+            try:
+                self.values.extend(array.array(self.values.typecode, map(fill, chunk, chunk)))
+                return
+            except OverflowError:
+                self.values = list(self.values) # Integer buiten int64 bereik
+        self.values.extend(map(_NONE_FILL, chunk, chunk))
+
+    def finish(self):
+        """Geeft (masker, waarden) terug, met integer arrays versmald tot het kleinste type."""
+        mask, values = self.mask, self.values
+        if isinstance(values, array.array) and values.typecode == 'q' and values:
+            low, high = min(values), max(values)
+            for typecode, limit in _NARROW_INT_TYPECODES:
+                if -limit <= low and high < limit:
+                    values = array.array(typecode, values)
+                    break
+        return mask, values
+
+class RegionRow(Mapping):
+    """Read-only {stat: waarde} weergave van één regio in een RegionTable."""
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, key):
+        column = self._table._columns.get(key)
+        if column is None: raise KeyError(key)
+        mask, values = column
+        state = mask[self._row]
+        if state == MASK_VALUE: return values[self._row]
+        if state == MASK_NULL: return None
+        raise KeyError(key)
+
+    def __iter__(self):
+        row, columns = self._row, self._table._columns
+        return (key for key in self._table.stat_keys if columns[key][0][row] != MASK_MISSING)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"RegionRow({dict(self)!r})"
+
+class RegionTable(Mapping):
+    """Gestripte data als kolommen: per stat een masker en een array, plus een gesorteerde regio-index.
+
+    Gedraagt zich als een read-only {regiocode: {stat: waarde}} mapping (iteratie in
+    gesorteerde volgorde), maar bewaart geen dict per regio. Waarden staan in een
+    integer array (zo smal als de waarden toelaten), een array('d') of, bij
+    gemengde/andere types, een lijst. Rijen blijven in aankomstvolgorde staan;
+    `region_codes` en `_order` geven de gesorteerde volgorde.
+    """
+    __slots__ = ('row_codes', 'region_codes', 'stat_keys', '_index', '_order', '_columns')
+
+    def __init__(self, row_codes, columns):
+        """`row_codes` is de regiocode per rij; `columns` is {stat: (masker, waarden)}.
+
+        Komt een regiocode vaker voor, dan telt de laatste rij (zoals bij een dict).
+        """
+        self.row_codes = row_codes
+        self.stat_keys = sorted(columns)
+        self._index = {code: row for row, code in enumerate(row_codes)}
+        self.region_codes = sorted(self._index)
+        self._order = [self._index[code] for code in self.region_codes]
+        self._columns = columns
+
+    @classmethod
+    def from_rows(cls, rows, stat_keys):
+        """Bouwt een tabel uit (regiocode, {stat: waarde}) paren in willekeurige volgorde.
+
+        Alleen `stat_keys` worden opgenomen; de waarden mogen ook complete records zijn.
+        Rijen worden per blok getransponeerd naar kolommen.
+        """
+        stat_keys = sorted(stat_keys)
+        codes, chunk = [], []
+        columns = [_ColumnBuilder() for _ in stat_keys]
+        missing_defaults = [_MISSING] * len(stat_keys)
+
+        def flush():
+            for column, values in zip(columns, zip(*chunk)): column.extend(values)
+            chunk.clear()
+
+        for code, stats in rows:
+            codes.append(code)
+            chunk.append(tuple(map(stats.get, stat_keys, missing_defaults)))
+            if len(chunk) >= REGION_TABLE_CHUNK_ROWS: flush()
+        if chunk: flush()
+        return cls(codes, {key: column.finish() for key, column in zip(stat_keys, columns)})
+
+    @classmethod
+    def from_mapping(cls, stripped_data):
+        """Zet een {regiocode: {stat: waarde}} dict (of RegionTable) om naar een RegionTable."""
+        if isinstance(stripped_data, RegionTable): return stripped_data
+        stat_keys = set()
+        for stats in stripped_data.values(): stat_keys.update(stats)
+        return cls.from_rows(stripped_data.items(), stat_keys)
+
+    def column(self, key):
+        """Geeft (masker, waarden) voor een stat; een leeg masker als de stat ontbreekt."""
+        column = self._columns.get(key)
+        if column is None:
+            count = len(self.row_codes)
+            column = (bytearray(count), array.array('b', bytes(count)))
+        return column
+
+    def iter_rows(self):
+        """Levert (regiocode, [(stat, waarde), ...]) in gesorteerde volgorde, zonder opnieuw te sorteren."""
+        columns = [(key, *self._columns[key]) for key in self.stat_keys]
+        for code, row in zip(self.region_codes, self._order):
+            yield code, [(key, values[row] if mask[row] == MASK_VALUE else None)
+                         for key, mask, values in columns if mask[row] != MASK_MISSING]
+
+    def sorted_values(self, key):
+        """Waarden van een stat in gesorteerde regio volgorde; None bij een null of ontbrekende waarde."""
+        mask, values = self.column(key)
+        return [values[row] if mask[row] == MASK_VALUE else None for row in self._order]
+
+    def iter_row_indices(self):
+        """Levert (regiocode, rijnummer) in gesorteerde volgorde (bij dubbele codes alleen de laatste rij)."""
+        return zip(self.region_codes, self._order)
+
+    def with_columns(self, columns):
+        """Nieuwe tabel met dezelfde regio's en extra (of vervangende) kolommen {stat: (masker, waarden)}."""
+        return RegionTable(self.row_codes, {**self._columns, **columns})
+
+    def reindexed(self, region_codes):
+        """Nieuwe tabel met `region_codes` als rijen; regio's die hier niet in staan krijgen ontbrekende waarden."""
+        rows = [self._index.get(code) for code in region_codes]
+        columns = {}
+        for key, (mask, values) in self._columns.items():
+            new_mask = bytearray(MASK_MISSING if row is None else mask[row] for row in rows)
+            if isinstance(values, array.array):
+                new_values = array.array(values.typecode, (0 if row is None else values[row] for row in rows))
+            else:
+                new_values = [None if row is None else values[row] for row in rows]
+            columns[key] = (new_mask, new_values)
+        return RegionTable(list(region_codes), columns)
+
+    def fingerprint(self):
+        """SHA-256 over regiocodes en alle kolommen (maskers en waarden)."""
+        digest = hashlib.sha256()
+        digest.update('\n'.join(self.row_codes).encode('utf-8'))
+        for key in self.stat_keys:
+            mask, values = self._columns[key]
+            digest.update(key.encode('utf-8'))
+            digest.update(mask)
+            if isinstance(values, array.array):
+                digest.update(values.typecode.encode('ascii'))
+                digest.update(values.tobytes())
+            else:
+                digest.update(json.dumps(values, default=str).encode('utf-8'))
+        return digest.hexdigest()
+
+    def __getitem__(self, code):
+        return RegionRow(self, self._index[code])
+
+    def __contains__(self, code):
+        return code in self._index
+
+    def __iter__(self):
+        return iter(self.region_codes)
+
+    def __len__(self):
+        return len(self.region_codes)
+
+    def __repr__(self):
+        return f"RegionTable({len(self.region_codes)} regio's, {len(self.stat_keys)} stats)"
+
+def strip_records(records, identifier_key, region_type_key, target_region_types, full_keys_to_keep):
+    """Filtert records op regio type en behoudt alleen vereiste volledige sleutels.
+
+    Geeft (RegionTable, aantal_verwerkt, aantal_uitgefilterd) terug.
+    """
+    processed_count = 0
+    filtered_out_count = 0
+
+    def stripped_rows():
+        nonlocal processed_count, filtered_out_count
+        for record in records:
             region_type_cleaned = clean_key(record.get(region_type_key))
             if region_type_cleaned not in target_region_types:
                 filtered_out_count += 1; continue
 
             region_code = clean_key(record.get(identifier_key))
-            if region_code:
-                stats_for_region = {k: record[k] for k in keys_to_keep_set if k in record}
-                has_required_stat = any(k in stats_for_region for k in full_keys_to_keep)
+            if region_code and any(k in record for k in full_keys_to_keep):
+                # RegionTable neemt alleen de vereiste sleutels uit het record over
+                yield region_code, record
+                processed_count += 1
+
+    stripped_data = RegionTable.from_rows(stripped_rows(), sorted(full_keys_to_keep))
+    return stripped_data, processed_count, filtered_out_count
 
-                if identifier_key in stats_for_region and has_required_stat:
-                    value_dict = {k: v for k, v in stats_for_region.items() if k != identifier_key}
-                    stripped_data[region_code] = value_dict
-                    processed_count += 1
+def load_and_strip_typed_data(filepath, identifier_key, region_type_key, target_region_types, full_keys_to_keep, streaming=True):
+    """Laadt TypedDataSet, filtert op regio type, en behoudt alleen vereiste volledige sleutels.
+
+    Met `streaming=True` (standaard) wordt het bestand record voor record gelezen,
+    zodat het piekgeheugen meegroeit met de behouden data in plaats van het bronbestand.
+    Geeft een RegionTable terug (bruikbaar als {regiocode: {stat: waarde}} mapping).
+    """
+    mode = "streaming" if streaming else "volledig laden"
+    print(f"Laden, filteren ({'/'.join(target_region_types)}), en strippen {filepath} ({mode})...")
+
+    try:
+        if streaming:
+            records = iter_json_array(filepath)
+        else:
+            records = load_json(filepath)
+            if records is None:
+                print(f"Fout: Kon bronbestand {filepath} niet laden voor stripping.")
+                return None
+            print(f"  Verwerken {len(records)} records...")
+
+        stripped_data, processed_count, filtered_out_count = strip_records(
+            records, identifier_key, region_type_key, target_region_types, full_keys_to_keep
+        )
 
         print(f"  {filtered_out_count} records uitgefilterd (Buurten, etc.).")
         print(f"  Succesvol data gestript voor {processed_count} regio's (Gemeenten/Wijken).")
-        del full_data; gc.collect()
+        del records; gc.collect()
         return stripped_data
+    except FileNotFoundError:
+        print(f"Fout: Kon bronbestand {filepath} niet laden voor stripping.")
+        return None
     except Exception as e:
         print(f"Onverwachte fout tijdens filteren/strippen van {filepath}: {e}")
         return None
 
+# --- Afgeleide Statistieken (berekend over de kolommen van een RegionTable) ---
+
+def region_parent(region_code):
+    """Bovenliggende regio: wijk -> gemeente, buurt -> wijk, gemeente -> 'NL'."""
+    prefix = region_code[:2]
+    if prefix == 'WK': return 'GM' + region_code[2:6]
+    if prefix == 'BU': return 'WK' + region_code[2:8]
+    return 'NL'
+
+def _numeric_mask(column):
+    """Masker waarin alleen numerieke waarden als MASK_VALUE tellen (kolommen als lijst kunnen tekst bevatten)."""
+    mask, values = column
+    if isinstance(values, array.array): return mask
+    return bytearray(MASK_VALUE if m == MASK_VALUE and isinstance(v, (int, float)) and not isinstance(v, bool)
+                     else (MASK_MISSING if m == MASK_MISSING else MASK_NULL) for m, v in zip(mask, values))
+
+def ratio_column(numerator, denominator, scale=1, decimals=None):
+    """Kolom teller / noemer * schaal als (masker, array('d')).
+
+    Null als teller of noemer null is of de noemer 0; ontbrekend als beide ontbreken.
+    """
+    num_mask, num_values = _numeric_mask(numerator), numerator[1]
+    den_mask, den_values = _numeric_mask(denominator), denominator[1]
+    mask = bytearray(
+        MASK_MISSING if a == MASK_MISSING and b == MASK_MISSING
+        else MASK_VALUE if a == MASK_VALUE and b == MASK_VALUE and d
+        else MASK_NULL
+        for a, b, d in zip(num_mask, den_mask, den_values)
+    )
+    values = array.array('d', (n / d * scale if m == MASK_VALUE else 0.0
+                               for m, n, d in zip(mask, num_values, den_values)))
+    if decimals is not None: values = array.array('d', (round(v, decimals) for v in values))
+    return mask, values
+
+def rank_column(table, column, descending=True, parent_of=region_parent):
+    """Rang per regio binnen zijn bovenliggende regio als (masker, array('i')).
+
+    Gelijke waarden krijgen dezelfde rang (1, 2, 2, 4); regio's zonder waarde krijgen geen rang.
+    """
+    mask, values = _numeric_mask(column), column[1]
+    groups = {}
+    for code, row in table.iter_row_indices():
+        if mask[row] == MASK_VALUE: groups.setdefault(parent_of(code), []).append(row)
+    ranks = array.array('i', bytes(4 * len(mask)))
+    rank_mask = bytearray(MASK_MISSING if m == MASK_MISSING else MASK_NULL for m in mask)
+    for rows in groups.values():
+        rows.sort(key=values.__getitem__, reverse=descending)
+        rank, previous = 0, None
+        for position, row in enumerate(rows, 1):
+            if values[row] != previous: rank, previous = position, values[row]
+            ranks[row] = rank
+            rank_mask[row] = MASK_VALUE
+    return rank_mask, ranks
+
+def derive_statistics(stripped_data, key_map, metadata_dict, ratio_stats=DERIVED_RATIO_STATS, rank_stats=DERIVED_RANK_STATS):
+    """Voegt afgeleide statistieken (verhoudingen en rangschikkingen) als extra kolommen toe.
+
+    Geeft (RegionTable, key_map, metadata_dict) terug, aangevuld met de afgeleide sleutels
+    (zonder CBS suffix, dus de naam is ook de sleutel) en hun metadata. Een afgeleide stat
+    waarvan een bron stat ontbreekt wordt met een waarschuwing overgeslagen.
+    """
+    table = RegionTable.from_mapping(stripped_data)
+    key_map, metadata_dict = dict(key_map), dict(metadata_dict)
+    available = set(table.stat_keys)
+
+    def source_key(base_name, derived_name):
+        full_key = key_map.get(base_name)
+        if full_key not in available:
+            print(f"Waarschuwing: Afgeleide stat {derived_name} overgeslagen: bron stat '{base_name}' ontbreekt.")
+            return None
+        return full_key
+
+    def add(name, column, title, unit, decimals, description):
+        nonlocal table
+        table = table.with_columns({name: column})
+        available.add(name)
+        key_map[name] = name
+        metadata_dict[name] = {'Key': name, 'Title': title, 'Unit': unit, 'Decimals': decimals, 'Description': description}
+
+    for name, spec in ratio_stats.items():
+        numerator, denominator = source_key(spec['numerator'], name), source_key(spec['denominator'], name)
+        if not numerator or not denominator: continue
+        column = ratio_column(table.column(numerator), table.column(denominator), spec.get('scale', 1), spec.get('decimals'))
+        scale = f" * {spec['scale']}" if spec.get('scale', 1) != 1 else ""
+        add(name, column, spec['title'], spec.get('unit', ''), spec.get('decimals'),
+            f"Afgeleid: {numerator} / {denominator}{scale}.")
+
+    for name, spec in rank_stats.items():
+        source = source_key(spec['stat'], name)
+        if not source: continue
+        descending = spec.get('descending', True)
+        column = rank_column(table, table.column(source), descending)
+        order = "1 = hoogste" if descending else "1 = laagste"
+        add(name, column, spec['title'], 'rang', 0,
+            f"Afgeleid: rang van {source} binnen de bovenliggende regio (wijk binnen gemeente, gemeente binnen Nederland), {order}.")
+
+    return table, key_map, metadata_dict
+
+def file_fingerprint(filepath, with_hash=True):
+    """Geeft grootte, mtime en (optioneel) SHA-256 van een bestand terug."""
+    st = os.stat(filepath)
+    fingerprint = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if with_hash:
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''): digest.update(chunk)
+        fingerprint['sha256'] = digest.hexdigest()
+    return fingerprint
+
+def write_region_table(table, path, keys, header_fields, magic=STRIPPED_DATA_CACHE_MAGIC):
+    """Schrijft de kolommen `keys` van een RegionTable atomisch naar een binair kolom-bestand.
+
+    Indeling: magic, versie, header lengte, JSON header, payload. De header bevat
+    `header_fields`, een CRC32 van de payload en per kolom offset/lengte/type. De payload
+    bevat de regiocodes, per stat een masker (0 = ontbreekt, 1 = null, 2 = waarde) en een
+    getypeerde array, in de rijvolgorde van de RegionTable.
+    """
+    region_codes = table.row_codes
+    payload = bytearray()
+
+    def append_block(data):
+        offset = len(payload)
+        payload.extend(data)
+        return [offset, len(data)]
+
+    codes_block = append_block('\n'.join(region_codes).encode('utf-8'))
+    columns = []
+    for key in sorted(keys):
+        mask, values = table.column(key)
+        if isinstance(values, array.array):
+            col_type = values.typecode
+            if sys.byteorder != 'little':
+                values = array.array(col_type, values); values.byteswap()
+            values_bytes = values.tobytes()
+        else:
+            col_type = 'json'
+            values_bytes = json.dumps([v if m == MASK_VALUE else None for m, v in zip(mask, values)]).encode('utf-8')
+        columns.append({'key': key, 'type': col_type, 'mask': append_block(mask), 'values': append_block(values_bytes)})
+
+    header = {
+        **header_fields,
+        'region_count': len(region_codes),
+        'codes': codes_block,
+        'columns': columns,
+        'payload_size': len(payload),
+        'payload_crc32': zlib.crc32(payload),
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack('<4sHI', magic, STRIPPED_DATA_CACHE_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(payload)
+    os.replace(tmp_path, path) # Atomisch: nooit een half geschreven bestand
+    record_written(path)
+
+def read_region_table(path, magic=STRIPPED_DATA_CACHE_MAGIC):
+    """Leest een bestand van write_region_table; geeft (header, RegionTable) terug.
+
+    Gooit FileNotFoundError als het bestand ontbreekt en ValueError (met reden) als het
+    beschadigd is of een ander formaat heeft.
+    """
+    with open(path, 'rb') as f: raw = f.read()
+    prefix_size = struct.calcsize('<4sHI')
+    if len(raw) < prefix_size: raise ValueError("bestand te kort")
+    file_magic, version, header_len = struct.unpack_from('<4sHI', raw)
+    if file_magic != magic or version != STRIPPED_DATA_CACHE_VERSION: raise ValueError("onbekend formaat of versie")
+    try:
+        header = json.loads(raw[prefix_size:prefix_size + header_len])
+    except ValueError: raise ValueError("header corrupt")
+    payload = memoryview(raw)[prefix_size + header_len:]
+    if len(payload) != header.get('payload_size') or zlib.crc32(payload) != header.get('payload_crc32'):
+        raise ValueError("onvolledig of beschadigd")
+
+    def block(offset_length):
+        offset, length = offset_length
+        return payload[offset:offset + length]
+
+    region_count = header['region_count']
+    region_codes = bytes(block(header['codes'])).decode('utf-8').split('\n') if region_count else []
+    columns = {}
+    for col in header['columns']:
+        mask = bytearray(block(col['mask']))
+        if col['type'] == 'json':
+            values = json.loads(bytes(block(col['values'])))
+        else:
+            values = array.array(col['type'])
+            values.frombytes(block(col['values']))
+            if sys.byteorder != 'little': values.byteswap()
+        columns[col['key']] = (mask, values)
+    return header, RegionTable(region_codes, columns)
+
+def save_stripped_cache(stripped_data, cache_path, source_path, full_keys, region_types, identifier_key=REGION_IDENTIFIER_KEY):
+    """Slaat gestripte data op als binaire kolom-cache (zie write_region_table).
+
+    De header bevat de fingerprint van het bronbestand, de sleutelset en het regio type filter.
+    """
+    try:
+        header_fields = {
+            'source': file_fingerprint(source_path),
+            'full_keys': sorted(full_keys),
+            'region_types': sorted(region_types),
+            'identifier_key': identifier_key,
+        }
+        write_region_table(RegionTable.from_mapping(stripped_data), cache_path, full_keys, header_fields)
+        return True
+    except Exception as e: print(f"Fout bij opslaan cache naar {cache_path}: {e}"); return False
+
+def load_stripped_cache(cache_path, source_path, full_keys, region_types, identifier_key=REGION_IDENTIFIER_KEY):
+    """Laadt de binaire kolom-cache als deze bij het bronbestand en de configuratie past.
+
+    Geeft de gestripte data als RegionTable terug, of None (met reden) als de cache
+    ontbreekt, beschadigd of verouderd is.
+    """
+    def invalid(reason):
+        print(f"Waarschuwing: Cache ongeldig ({reason}). Zal opnieuw strippen.")
+        return None
+
+    try:
+        header, table = read_region_table(cache_path)
+    except FileNotFoundError: return None
+    except ValueError as e: return invalid(str(e))
+    except Exception as e: return invalid(f"lezen mislukt: {e}")
+
+    if header['full_keys'] != sorted(full_keys): return invalid("andere set statistieken")
+    if header['region_types'] != sorted(region_types): return invalid("ander regio type filter")
+    if header['identifier_key'] != identifier_key: return invalid("andere regio sleutel")
+    if not os.path.exists(source_path): return invalid("bronbestand ontbreekt")
+    cached_source = header['source']
+    current_source = file_fingerprint(source_path, with_hash=False)
+    if current_source['size'] != cached_source['size']: return invalid("bronbestand gewijzigd")
+    if current_source['mtime_ns'] != cached_source['mtime_ns']:
+        # Alleen bij gewijzigde mtime de (duurdere) hash controleren
+        if file_fingerprint(source_path)['sha256'] != cached_source['sha256']: return invalid("bronbestand gewijzigd")
+    return table
+
 def format_lua_value(value):
     """Formatteert Python waarden voor Lua."""
     if value is None: return "nil"
@@ -153,22 +973,183 @@ def format_lua_value(value):
         return f'"{processed}"'
     return f'"{str(value)}" --[[Onbekend Type: {type(value)}]]'
 
+_PLACEHOLDER_PATTERN = re.compile(r'%%[A-Z0-9_]+%%')
+
+class CompiledTemplate:
+    """Een eenmalig geparste template: een lijst van letterlijke tekst en placeholders.
+
+    Rendert in één doorgang naar een string of een bestand. Waarden die een iterator
+    zijn (bv. een generator van Lua regels) worden stuk voor stuk, gescheiden door
+    '\n', uitgevoerd en dus nooit als één string opgebouwd.
+    """
+    __slots__ = ('name', 'source_hash', 'segments', 'placeholders', '_repeated')
+
+    def __init__(self, name, content):
+        self.name = name
+        self.source_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        self.segments = [] # (is_placeholder, tekst)
+        pos = 0
+        for match in _PLACEHOLDER_PATTERN.finditer(content):
+            if match.start() > pos: self.segments.append((False, content[pos:match.start()]))
+            self.segments.append((True, match.group(0)))
+            pos = match.end()
+        if pos < len(content): self.segments.append((False, content[pos:]))
+        names = [text for is_placeholder, text in self.segments if is_placeholder]
+        self.placeholders = set(names)
+        self._repeated = {name for name in self.placeholders if names.count(name) > 1}
+
+    def check(self, replacements):
+        """Meldt placeholders die niet zijn ingevuld of vervangingen die niet worden gebruikt."""
+        missing = sorted(self.placeholders - set(replacements))
+        unused = sorted(set(replacements) - self.placeholders)
+        if missing: print(f"Waarschuwing: Template {self.name}: placeholder(s) niet ingevuld: {', '.join(missing)}")
+        if unused: print(f"Waarschuwing: Template {self.name}: vervanging(en) niet gebruikt: {', '.join(unused)}")
+        return missing, unused
+
+    def iter_chunks(self, replacements):
+        """Levert de output stuk voor stuk; onbekende placeholders blijven letterlijk staan."""
+        for name in self._repeated:
+            # Een iterator kan maar één keer worden doorlopen
+            if isinstance(replacements.get(name), Iterator):
+                replacements = {**replacements, name: '\n'.join(replacements[name])}
+        for is_placeholder, text in self.segments:
+            if not is_placeholder or text not in replacements:
+                yield text
+                continue
+            value = replacements[text]
+            if isinstance(value, Iterator):
+                separator = ''
+                for chunk in value:
+                    yield separator
+                    yield chunk
+                    separator = '\n'
+            else:
+                yield str(value)
+
+    def render(self, replacements):
+        """Rendert de template naar een string."""
+        return ''.join(self.iter_chunks(replacements))
+
+    def render_to(self, out, replacements):
+        """Rendert de template direct naar een (tekst) bestand."""
+        write = out.write
+        for chunk in self.iter_chunks(replacements): write(chunk)
+
+_TEMPLATE_CACHE = {} # pad -> (mtime_ns, grootte, CompiledTemplate)
+
+def load_template(template_filename):
+    """Geeft de gecompileerde template terug; wordt alleen opnieuw geparst als het bestand wijzigt."""
+    tpl_path = os.path.join(TEMPLATE_DIR, template_filename)
+    st = os.stat(tpl_path)
+    cached = _TEMPLATE_CACHE.get(tpl_path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    with open(tpl_path, 'r', encoding='utf-8') as f:
+        template = CompiledTemplate(template_filename, f.read())
+    _TEMPLATE_CACHE[tpl_path] = (st.st_mtime_ns, st.st_size, template)
+    return template
+
 def apply_template(template_filename, replacements):
-    """Leest een template bestand en voert vervangingen uit."""
+    """Leest (gecachet) een template bestand en voert vervangingen uit."""
     try:
-        tpl_path = os.path.join(TEMPLATE_DIR, template_filename)
-        with open(tpl_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        for placeholder, value in replacements.items():
-            content = content.replace(placeholder, str(value))
-        return content
+        template = load_template(template_filename)
+        template.check(replacements)
+        return template.render(replacements)
     except FileNotFoundError:
-        print(f"Fout: Template bestand niet gevonden: {tpl_path}")
+        print(f"Fout: Template bestand niet gevonden: {os.path.join(TEMPLATE_DIR, template_filename)}")
         return None
     except Exception as e:
         print(f"Fout bij toepassen template {template_filename}: {e}")
         return None
 
+def write_template_stream(template_filename, replacements, output_filename):
+    """Vult een template in en schrijft het resultaat direct naar een gebufferd bestand."""
+    try:
+        template = load_template(template_filename)
+        template.check(replacements)
+        os.makedirs(os.path.dirname(output_filename), exist_ok=True)
+        with open(output_filename, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) as out:
+            template.render_to(out, replacements)
+        record_written(output_filename)
+        print(f"Gegenereerd: {os.path.basename(output_filename)}")
+        return True
+    except FileNotFoundError:
+        print(f"Fout: Template bestand niet gevonden: {os.path.join(TEMPLATE_DIR, template_filename)}")
+        return False
+    except Exception as e:
+        print(f"Fout bij schrijven template {template_filename} naar {output_filename}: {e}")
+        return False
+
+_GENERATOR_HASH = None
+
+def generator_fingerprint():
+    """Hash van dit script: gewijzigde generatielogica maakt alle manifest entries ongeldig."""
+    global _GENERATOR_HASH
+    if _GENERATOR_HASH is None: _GENERATOR_HASH = file_fingerprint(os.path.abspath(__file__))['sha256']
+    return _GENERATOR_HASH
+
+def hash_inputs(template_filename, replacements, extra_inputs=None):
+    """Hash van alle inputs van een output: template, vervangingen (zonder tijdstempel) en extra inputs.
+
+    Gestreamde waarden (iterators) tellen niet mee; hun bron hoort in `extra_inputs`
+    (bv. de data fingerprint en metadata).
+    """
+    parts = {
+        'template': load_template(template_filename).source_hash,
+        'replacements': {k: str(v) for k, v in replacements.items()
+                         if k != '%%GENERATION_TIMESTAMP%%' and not isinstance(v, Iterator)},
+        'extra': extra_inputs,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class OutputManifest:
+    """Manifest naast de outputs met per output bestand de hash van zijn inputs.
+
+    Een output waarvan de inputs en het bestand zelf (grootte/mtime) sinds de vorige
+    run niet zijn veranderd, wordt overgeslagen; zo verandert ook de tijdstempel niet.
+    """
+
+    def __init__(self, path, force=False):
+        self.path = path
+        self.force = force
+        manifest = load_json(path) if os.path.exists(path) else None
+        valid = isinstance(manifest, dict) and manifest.get('generator') == generator_fingerprint()
+        self.entries = manifest.get('outputs', {}) if valid else {}
+        self.changed, self.unchanged = [], []
+
+    def is_current(self, output_filename, inputs_hash):
+        """True als het bestand bestaat, niet is aangepast en met dezelfde inputs is gemaakt."""
+        entry = self.entries.get(os.path.basename(output_filename))
+        if self.force or not entry or entry.get('inputs') != inputs_hash: return False
+        try: st = os.stat(output_filename)
+        except FileNotFoundError: return False
+        return entry.get('size') == st.st_size and entry.get('mtime_ns') == st.st_mtime_ns
+
+    def record(self, output_filename, inputs_hash):
+        """Legt de inputs hash en de bestandsstatus van een zojuist geschreven output vast."""
+        st = os.stat(output_filename)
+        self.entries[os.path.basename(output_filename)] = {
+            'inputs': inputs_hash, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+        }
+        self.changed.append(output_filename)
+
+    def save(self):
+        return save_json({'generator': generator_fingerprint(), 'outputs': self.entries}, self.path)
+
+def render_output(template_filename, replacements, output_filename, manifest=None, extra_inputs=None):
+    """Genereert een output bestand uit een template, tenzij het manifest zegt dat niets is veranderd."""
+    inputs_hash = None
+    if manifest is not None:
+        try: inputs_hash = hash_inputs(template_filename, replacements, extra_inputs)
+        except FileNotFoundError: pass # write_template_stream meldt de ontbrekende template
+        if inputs_hash and manifest.is_current(output_filename, inputs_hash):
+            print(f"Ongewijzigd (overgeslagen): {os.path.basename(output_filename)}")
+            manifest.unchanged.append(output_filename)
+            return True
+    ok = write_template_stream(template_filename, replacements, output_filename)
+    if ok and inputs_hash: manifest.record(output_filename, inputs_hash)
+    return ok
+
 def write_output_file(content, output_filename):
     """Schrijft content naar het output bestand."""
     if content is None: return False # Geef aan dat er niets geschreven is
@@ -176,40 +1157,80 @@ def write_output_file(content, output_filename):
         os.makedirs(os.path.dirname(output_filename), exist_ok=True)
         with open(output_filename, 'w', encoding='utf-8') as f:
             f.write(content)
+        record_written(output_filename)
         print(f"Gegenereerd: {os.path.basename(output_filename)}")
         return True
     except Exception as e:
         print(f"Fout bij schrijven output bestand {output_filename}: {e}")
         return False
 
-def generate_lua_data_submodule(stripped_data, metadata_dict, key_map, dataset_id, year, lua_filename, lua_doc_filename):
-    """Genereert de JAARLIJKSE Lua data submodule EN de bijbehorende documentatie."""
-    print(f"Genereren Lua data submodule en doc: {os.path.basename(lua_filename)}, {os.path.basename(lua_doc_filename)}...")
-
-    full_keys_required_set = set(key_map.values())
-
-    # -- Genereer Metadata Entries --
-    metadata_entries_list = []
+def iter_lua_metadata_entries(metadata_dict, full_keys):
+    """Levert de Lua metadata regels (één per opgenomen stat), gesorteerd op sleutel."""
     for full_key in sorted(metadata_dict.keys()):
-        if full_key in full_keys_required_set:
+        if full_key in full_keys:
             meta = metadata_dict.get(full_key)
             if meta:
-                metadata_entries_list.append(
-                    f'  ["{full_key}"] = {{ title = {format_lua_value(meta.get("Title"))}, unit = {format_lua_value(meta.get("Unit"))}, decimals = {format_lua_value(meta.get("Decimals"))}, description = {format_lua_value(meta.get("Description"))} }},'
-                )
-    metadata_entries_str = "\n".join(metadata_entries_list)
-
-    # -- Genereer Data Entries --
-    data_entries_list = []
-    for region_code in sorted(stripped_data.keys()):
-        stats = stripped_data[region_code]
-        stat_entries = []
-        for stat_key in sorted(stats.keys()):
-             stat_entries.append(f'    ["{stat_key}"] = {format_lua_value(stats[stat_key])},')
-        data_entries_list.append(f'  ["{region_code}"] = {{\n' + '\n'.join(stat_entries) + '\n  },')
-    data_entries_str = "\n".join(data_entries_list)
-
-    # -- Vul template voor Lua code in --
+                yield f'  ["{full_key}"] = {{ title = {format_lua_value(meta.get("Title"))}, unit = {format_lua_value(meta.get("Unit"))}, decimals = {format_lua_value(meta.get("Decimals"))}, description = {format_lua_value(meta.get("Description"))} }},'
+
+def format_lua_data_entry(region_code, stats):
+    """Het Lua data blok van één regio, uit (stat, waarde) paren."""
+    stat_entries = [f'    ["{stat_key}"] = {format_lua_value(value)},' for stat_key, value in stats]
+    return f'  ["{region_code}"] = {{\n' + '\n'.join(stat_entries) + '\n  },'
+
+def iter_lua_data_entries(stripped_data):
+    """Levert per regio (gesorteerd) het Lua data blok als losse string."""
+    for region_code, stats in RegionTable.from_mapping(stripped_data).iter_rows():
+        yield format_lua_data_entry(region_code, stats)
+
+def iter_lua_region_entries(region_codes, per_line=LUA_COLUMN_VALUES_PER_LINE):
+    """Levert de Lua regels {regiocode: rijnummer} (vanaf 1, in de gegeven volgorde), `per_line` per regel."""
+    for start in range(0, len(region_codes), per_line):
+        yield '  ' + ' '.join(f'["{code}"] = {row},' for row, code in enumerate(region_codes[start:start + per_line], start + 1))
+
+def iter_lua_column_entries(columns, per_line=LUA_COLUMN_VALUES_PER_LINE):
+    """Levert per stat (gesorteerd) de Lua array met waarden per rijnummer, uit {stat: [waarde, ...]}."""
+    for stat_key in sorted(columns):
+        cells = [format_lua_value(value) for value in columns[stat_key]]
+        lines = ['    ' + ', '.join(cells[start:start + per_line]) + ',' for start in range(0, len(cells), per_line)]
+        yield f'  ["{stat_key}"] = {{\n' + '\n'.join(lines) + '\n  },'
+
+def lua_data_replacements(layout, region_codes, stat_rows=None, stripped_data=None):
+    """Vervangingen voor de data van een module in de gegeven layout.
+
+    De data komt uit een RegionTable (`stripped_data`) of uit de (stat, waarde) lijsten
+    per regio in `stat_rows`, in dezelfde volgorde als `region_codes`.
+    """
+    if layout == 'rows':
+        if stripped_data is not None: return {'%%DATA_ENTRIES%%': iter_lua_data_entries(stripped_data)}
+        return {'%%DATA_ENTRIES%%': (format_lua_data_entry(code, stats) for code, stats in zip(region_codes, stat_rows))}
+    if stripped_data is not None:
+        columns = {key: stripped_data.sorted_values(key) for key in stripped_data.stat_keys}
+    else:
+        row_dicts = [dict(stats) for stats in stat_rows]
+        stat_keys = set().union(*row_dicts)
+        columns = {key: [stats.get(key) for stats in row_dicts] for key in stat_keys}
+    return {
+        '%%REGION_ENTRIES%%': iter_lua_region_entries(region_codes),
+        '%%COLUMN_ENTRIES%%': iter_lua_column_entries(columns),
+    }
+
+def generate_lua_data_submodule(stripped_data, metadata_dict, key_map, dataset_id, year, lua_filename, lua_doc_filename, manifest=None, layout='rows'):
+    """Genereert de JAARLIJKSE Lua data submodule EN de bijbehorende documentatie.
+
+    `layout` is 'rows' (een stats tabel per regio) of 'columns' (een array per stat
+    en een rijnummer per regio, zodat elke stat sleutel maar één keer voorkomt).
+    """
+    print(f"Genereren Lua data submodule ({layout}) en doc: {os.path.basename(lua_filename)}, {os.path.basename(lua_doc_filename)}...")
+
+    full_keys_required_set = set(key_map.values())
+    stripped_data = RegionTable.from_mapping(stripped_data)
+    extra_inputs = {
+        'key_map': key_map,
+        'metadata': {k: metadata_dict.get(k) for k in sorted(full_keys_required_set)},
+        'data': stripped_data.fingerprint() if manifest is not None else None,
+    }
+
+    # -- Vul template voor Lua code in (metadata en data worden gestreamd) --
     generation_timestamp = datetime.now(timezone.utc).isoformat()
     module_replacements = {
         '%%YEAR%%': year,
@@ -217,85 +1238,258 @@ def generate_lua_data_submodule(stripped_data, metadata_dict, key_map, dataset_i
         '%%GENERATION_TIMESTAMP%%': generation_timestamp,
         '%%REGION_TYPES%%': ", ".join(sorted(TARGET_REGION_TYPES)),
         '%%STATS_LIST_FULL%%': ", ".join(sorted(full_keys_required_set)),
-        '%%METADATA_ENTRIES%%': metadata_entries_str,
-        '%%DATA_ENTRIES%%': data_entries_str,
+        '%%METADATA_ENTRIES%%': iter_lua_metadata_entries(metadata_dict, full_keys_required_set),
+        **lua_data_replacements(layout, stripped_data.region_codes, stripped_data=stripped_data),
+    }
+    if render_output(LUA_DATA_LAYOUTS[layout]['module'], module_replacements, lua_filename, manifest, extra_inputs):
+        module_size = os.path.getsize(lua_filename)
+        print(f"Grootte data submodule ({layout}): {module_size} bytes ({format_size(module_size)})")
+        if module_size > SHARD_MAX_BYTES:
+            print(f"Waarschuwing: {os.path.basename(lua_filename)} is {format_size(module_size)}, groter dan de wiki limiet "
+                  f"van {format_size(SHARD_MAX_BYTES)}. Gebruik --shard.")
+
+    # --- Genereer Documentatie ---
+    doc_replacements = {
+        '%%YEAR%%': year,
+        '%%DATASET_ID%%': dataset_id,
+        '%%GENERATION_TIMESTAMP%%': generation_timestamp,
+        '%%DATA_STRUCTURE%%': LUA_DATA_LAYOUTS[layout]['doc'].format(region_id_key=REGION_IDENTIFIER_KEY),
+        '%%STATS_LIST_FULL%%': ", ".join(sorted(full_keys_required_set)),
+        '%%REGION_TYPES%%': ", ".join(sorted(TARGET_REGION_TYPES)),
+        '%%LUA_DISPATCHER_PATH%%': LUA_DISPATCHER_MODULE_PATH,
+        '%%TEMPLATE_STAT_PATH%%': TEMPLATE_STAT_PATH,
+        '%%TEMPLATE_STAT_NAME%%': TEMPLATE_STAT_PATH.split(':', 1)[1],
+    }
+    render_output("module_data_doc.wikitext", doc_replacements, lua_doc_filename, manifest, extra_inputs)
+
+def shard_key(region_code, digits=SHARD_DEFAULT_DIGITS):
+    """Shard van een regio: de eerste `digits` cijfers van het gemeentenummer (GM0363, WK036301, BU03630000 -> '0363')."""
+    return region_code[2:2 + digits]
+
+def iter_lua_shard_entries(shards):
+    """Levert de Lua index regels {gemeentenummer: shard}, gesorteerd op gemeentenummer."""
+    for gemeente, shard in sorted(shards.items()):
+        yield f'  ["{gemeente}"] = "{shard}",'
+
+def format_size(num_bytes):
+    """Bytes als leesbare KiB waarde."""
+    return f"{num_bytes / 1024:.1f} KiB"
+
+def remove_stale_shards(shard_dir, shards=()):
+    """Verwijdert shards van een vorige run die niet meer bestaan (bv. na het wijzigen van --shard-digits).
+
+    Zonder `shards` (een run zonder --shard) worden alle shards en de lege map verwijderd.
+    Geeft het aantal verwijderde shards terug.
+    """
+    current = {os.path.basename(filename) for _, filename, _ in shards}
+    if not os.path.isdir(shard_dir): return 0
+    removed = 0
+    for name in sorted(os.listdir(shard_dir)):
+        if name.endswith('.lua') and name not in current:
+            os.remove(os.path.join(shard_dir, name))
+            print(f"Verwijderd (verouderde shard): {name}")
+            removed += 1
+    if not os.listdir(shard_dir): os.rmdir(shard_dir)
+    if removed and not shards:
+        print(f"Let op: {removed} shard pagina('s) van een eerdere --shard run staan mogelijk nog op de wiki.")
+    return removed
+
+def check_shard_sizes(sizes, max_bytes, digits):
+    """Print de grootteverdeling van de shards; False (met melding) als een shard groter is dan `max_bytes`."""
+    if sizes:
+        ordered = sorted(sizes.values())
+        largest = max(sizes, key=sizes.get)
+        print(f"Shards: {len(sizes)}, totaal {format_size(sum(ordered))}, min {format_size(ordered[0])}, "
+              f"mediaan {format_size(ordered[len(ordered) // 2])}, max {format_size(ordered[-1])} ({largest})")
+    too_large = sorted(shard for shard, size in sizes.items() if size > max_bytes)
+    if too_large:
+        print(f"Fout: {len(too_large)} shard(s) groter dan het maximum van {format_size(max_bytes)}: "
+              f"{', '.join(f'{shard} ({format_size(sizes[shard])})' for shard in too_large)}")
+        if digits < SHARD_DEFAULT_DIGITS: print(f"Gebruik meer cijfers per shard (--shard-digits {digits + 1}).")
+        return False
+    return True
+
+def generate_sharded_lua_data_submodule(stripped_data, metadata_dict, key_map, dataset_id, year, lua_filename, lua_doc_filename,
+                                        shard_dir, module_path, manifest=None, digits=SHARD_DEFAULT_DIGITS, max_bytes=SHARD_MAX_BYTES,
+                                        layout='rows', only_shards=None):
+    """Genereert de JAARLIJKSE data submodule als index module plus shards per gemeente(groep), met documentatie.
+
+    De index (`lua_filename`) bevat de metadata en per gemeentenummer de shard; elke shard
+    (`shard_dir`, wiki pagina `module_path/<shard>`) bevat de data van zijn regio's in `layout`.
+    Met `only_shards` (--changed-only) worden alleen die shards opnieuw gemaakt; de andere
+    blijven staan zoals ze zijn (als het bestand bestaat).
+    Geeft een lijst van (shard, bestand, wiki pagina) terug, of None als een shard groter
+    is dan `max_bytes` of niet geschreven kon worden.
+    """
+    print(f"Genereren gesharde Lua data submodule ({layout}, {digits} cijfer(s) per shard): {os.path.basename(lua_filename)} + {os.path.basename(shard_dir)}/...")
+
+    full_keys_required_set = set(key_map.values())
+    stripped_data = RegionTable.from_mapping(stripped_data)
+    module_file_base = os.path.splitext(os.path.basename(lua_filename))[0]
+
+    # -- Verdeel de (gesorteerde) regio's over de shards --
+    shard_rows, index = {}, {}
+    for region_code, stats in stripped_data.iter_rows():
+        shard = shard_key(region_code, digits)
+        codes, stat_rows = shard_rows.setdefault(shard, ([], []))
+        codes.append(region_code)
+        stat_rows.append(stats)
+        index[shard_key(region_code)] = shard
+
+    # -- Shards --
+    generation_timestamp = datetime.now(timezone.utc).isoformat()
+    shards, sizes, ok, kept = [], {}, True, 0
+    for shard, (codes, stat_rows) in sorted(shard_rows.items()):
+        shard_filename = os.path.join(shard_dir, f"{module_file_base}_{shard}.lua")
+        if only_shards is not None and shard not in only_shards and os.path.exists(shard_filename):
+            sizes[shard] = os.path.getsize(shard_filename)
+            shards.append((shard, shard_filename, f"{module_path}/{shard}"))
+            kept += 1
+            continue
+        shard_replacements = {
+            '%%YEAR%%': year,
+            '%%DATASET_ID%%': dataset_id,
+            '%%GENERATION_TIMESTAMP%%': generation_timestamp,
+            '%%SHARD%%': shard,
+            '%%SHARD_MODULE_PATH%%': module_path,
+            **lua_data_replacements(layout, codes, stat_rows),
+        }
+        data_hash = hashlib.sha256(json.dumps([codes, stat_rows], default=str).encode('utf-8')).hexdigest()
+        if not render_output(LUA_DATA_LAYOUTS[layout]['shard'], shard_replacements, shard_filename, manifest, {'data': data_hash}):
+            ok = False
+            continue
+        sizes[shard] = os.path.getsize(shard_filename)
+        shards.append((shard, shard_filename, f"{module_path}/{shard}"))
+
+    if kept: print(f"{kept} shard(s) zonder gewijzigde regio's niet opnieuw gemaakt (--changed-only).")
+    if ok: remove_stale_shards(shard_dir, shards)
+    if not check_shard_sizes(sizes, max_bytes, digits) or not ok: return None
+
+    # -- Index --
+    extra_inputs = {
+        'key_map': key_map,
+        'metadata': {k: metadata_dict.get(k) for k in sorted(full_keys_required_set)},
+        'shards': index,
+    }
+    index_replacements = {
+        '%%YEAR%%': year,
+        '%%DATASET_ID%%': dataset_id,
+        '%%GENERATION_TIMESTAMP%%': generation_timestamp,
+        '%%REGION_TYPES%%': ", ".join(sorted(TARGET_REGION_TYPES)),
+        '%%STATS_LIST_FULL%%': ", ".join(sorted(full_keys_required_set)),
+        '%%METADATA_ENTRIES%%': iter_lua_metadata_entries(metadata_dict, full_keys_required_set),
+        '%%SHARD_MODULE_PATH%%': module_path,
+        '%%SHARD_ENTRIES%%': iter_lua_shard_entries(index),
     }
-    module_content = apply_template("module_data.lua", module_replacements)
-    write_output_file(module_content, lua_filename)
+    if not render_output("module_data_index.lua", index_replacements, lua_filename, manifest, extra_inputs): return None
+    index_size = os.path.getsize(lua_filename)
+    print(f"Index: {format_size(index_size)} ({len(index)} gemeenten)")
+    if index_size > max_bytes:
+        print(f"Fout: Index module groter dan het maximum van {format_size(max_bytes)}.")
+        return None
 
     # --- Genereer Documentatie ---
     doc_replacements = {
         '%%YEAR%%': year,
         '%%DATASET_ID%%': dataset_id,
         '%%GENERATION_TIMESTAMP%%': generation_timestamp,
-        '%%REGION_ID_KEY%%': REGION_IDENTIFIER_KEY,
+        '%%SHARD_COUNT%%': len(shards),
+        '%%SHARD_EXAMPLE_PATH%%': shards[0][2] if shards else module_path,
+        '%%DATA_STRUCTURE%%': LUA_DATA_LAYOUTS[layout]['doc'].format(region_id_key=REGION_IDENTIFIER_KEY),
         '%%STATS_LIST_FULL%%': ", ".join(sorted(full_keys_required_set)),
         '%%REGION_TYPES%%': ", ".join(sorted(TARGET_REGION_TYPES)),
         '%%LUA_DISPATCHER_PATH%%': LUA_DISPATCHER_MODULE_PATH,
         '%%TEMPLATE_STAT_PATH%%': TEMPLATE_STAT_PATH,
         '%%TEMPLATE_STAT_NAME%%': TEMPLATE_STAT_PATH.split(':', 1)[1],
     }
-    module_doc_content = apply_template("module_data_doc.wikitext", doc_replacements)
-    write_output_file(module_doc_content, lua_doc_filename)
+    render_output("module_data_index_doc.wikitext", doc_replacements, lua_doc_filename, manifest, {**extra_inputs, 'shard_count': len(shards)})
+    return shards
+
+def key_candidates(full_key):
+    """Geeft de volledige sleutel(s) van een key map waarde als lijst (str of lijst van str)."""
+    return [full_key] if isinstance(full_key, str) else list(full_key)
 
-def generate_dispatcher_lua(key_map, output_filename):
+def merge_key_maps(key_maps):
+    """Voegt de key maps van meerdere jaren samen tot {basisnaam: volledige sleutel of lijst van sleutels}.
+
+    Een basisnaam met in alle jaren dezelfde sleutel houdt één sleutel; anders een
+    gesorteerde lijst van alle sleutels, zodat de dispatcher per jaar de juiste kiest.
+    """
+    merged = {}
+    for key_map in key_maps:
+        for base_name, full_key in key_map.items():
+            candidates = merged.setdefault(base_name, [])
+            for key in key_candidates(full_key):
+                if key not in candidates: candidates.append(key)
+    return {base_name: keys[0] if len(keys) == 1 else sorted(keys) for base_name, keys in merged.items()}
+
+def generate_dispatcher_lua(key_map, output_filename, manifest=None):
     """Genereert de Dispatcher Lua module vanuit een template (voor handmatige upload)."""
     print(f"Genereren Dispatcher Lua module (voor handmatig kopiëren): {os.path.basename(output_filename)}...")
 
     alias_mapping_block_list = []
     for base_name, full_key in key_map.items():
-        if base_name != full_key:
-            alias_mapping_block_list.append(f"    if stat_alias == '{base_name}' then internal_stat_key = '{full_key}' end")
+        candidates = key_candidates(full_key)
+        if len(candidates) > 1:
+            # Suffix verschilt per jaar: kies de sleutel die in de geladen jaarmodule bestaat
+            candidates_lua = ", ".join(f"'{key}'" for key in candidates)
+            alias_mapping_block_list.append(
+                f"    if stat_alias == '{base_name}' then for _, key in ipairs({{{candidates_lua}}}) do"
+                f" if data_module.metadata and data_module.metadata[key] then internal_stat_key = key break end end end"
+            )
+        elif base_name != candidates[0]:
+            alias_mapping_block_list.append(f"    if stat_alias == '{base_name}' then internal_stat_key = '{candidates[0]}' end")
 
     replacements = {
         '%%MODULE_BASE_NAME%%': LUA_DISPATCHER_MODULE_PATH.split(':')[1], # Naam zonder 'Module:'
+        '%%SERIES_MODULE_NAME%%': SERIES_MODULE_NAME,
         '%%ALIAS_MAPPING_BLOCK%%': "\n".join(alias_mapping_block_list)
     }
-    dispatcher_content = apply_template("module_dispatcher.lua", replacements)
-    write_output_file(dispatcher_content, output_filename)
+    render_output("module_dispatcher.lua", replacements, output_filename, manifest, {'key_map': key_map})
 
-def generate_dispatcher_doc(key_map, year, dataset_id, output_doc_filename):
+def generate_dispatcher_doc(key_map, year, dataset_id, output_doc_filename, manifest=None):
     """Genereert de documentatie voor de Dispatcher Lua module vanuit een template."""
     print(f"Genereren Dispatcher Lua documentatie: {os.path.basename(output_doc_filename)}...")
 
     # Bouw Wikitext tabelrijen voor aliassen
     alias_table_rows_list = []
     for base_name in sorted(key_map.keys()):
-        full_key = key_map[base_name]
+        candidates = key_candidates(key_map[base_name])
         # Alleen rijen toevoegen als het een echte alias is
-        if base_name != full_key:
-            row = f"|-\n| <code>{base_name}</code> \n|| <code>{full_key}</code>"
+        if candidates != [base_name]:
+            full_keys_str = ", ".join(f"<code>{key}</code>" for key in candidates)
+            row = f"|-\n| <code>{base_name}</code> \n|| {full_keys_str}"
             alias_table_rows_list.append(row)
 
     # Definieer placeholders en hun waarden
     replacements = {
         '%%TEMPLATE_STAT_PATH%%': TEMPLATE_STAT_PATH,
         '%%TEMPLATE_STAT_NAME%%': TEMPLATE_STAT_PATH.split(':', 1)[1],
-        '%%LUA_DISPATCHER_PATH%%': LUA_DISPATCHER_MODULE_PATH,
+        '%%TEMPLATE_STATS_PATH%%': TEMPLATE_STATS_PATH,
+        '%%TEMPLATE_STATS_NAME%%': TEMPLATE_STATS_PATH.split(':', 1)[1],
         '%%LUA_DATA_SUBMODULE_EXAMPLE_PATH%%': f"{LUA_DISPATCHER_MODULE_PATH}/{year}", # Gebruik huidig jaar als voorbeeld
         '%%EXAMPLE_YEAR%%': str(year),
+        '%%SERIES_MODULE_PATH%%': f"{LUA_DISPATCHER_MODULE_PATH}/{SERIES_MODULE_NAME}",
+        '%%MODULE_INVOKE_PATH%%': LUA_DISPATCHER_MODULE_PATH.split(':', 1)[1],
         '%%ALIAS_TABLE_ROWS%%': "\n".join(alias_table_rows_list) if alias_table_rows_list else "|-\n| ''(Geen aliassen gedefinieerd)'' \n|| -", # Fallback als er geen aliassen zijn
-        # %%DATASET_ID%% en andere placeholders indien nodig in de doc template
-        '%%DATASET_ID%%': dataset_id,
     }
 
     # Pas template toe en schrijf weg
-    dispatcher_doc_content = apply_template("module_dispatcher_doc.wikitext", replacements)
-    write_output_file(dispatcher_doc_content, output_doc_filename)
+    render_output("module_dispatcher_doc.wikitext", replacements, output_doc_filename, manifest, {'key_map': key_map})
 
-def generate_wikitemplates(metadata_dict, key_map, year, dataset_id, stat_filename, info_filename, stat_doc_filename, info_doc_filename):
+def generate_wikitemplates(metadata_dict, key_map, year, dataset_id, stat_filename, info_filename, stat_doc_filename, info_doc_filename,
+                           stats_filename, stats_doc_filename, manifest=None):
     """Genereert de Wiki sjabloon boilerplate/documentatie IN HET NEDERLANDS vanuit templates."""
     print(f"Genereren Nederlandse Wikitext sjablonen vanuit templates...")
 
     # Paden en namen setup
     lua_data_submodule_path = f"{LUA_DISPATCHER_MODULE_PATH}/{year}"
     template_stat_name = TEMPLATE_STAT_PATH.split(':', 1)[1]
+    template_stats_name = TEMPLATE_STATS_PATH.split(':', 1)[1]
 
     # Zorg dat output directories bestaan
-    os.makedirs(os.path.dirname(stat_filename), exist_ok=True)
-    os.makedirs(os.path.dirname(info_filename), exist_ok=True)
-    os.makedirs(os.path.dirname(stat_doc_filename), exist_ok=True)
-    os.makedirs(os.path.dirname(info_doc_filename), exist_ok=True)
+    for filename in (stat_filename, info_filename, stat_doc_filename, info_doc_filename, stats_filename, stats_doc_filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
 
     # Strings voor documentatie
     user_facing_keys = sorted(key_map.keys())
@@ -307,8 +1501,7 @@ def generate_wikitemplates(metadata_dict, key_map, year, dataset_id, stat_filena
         '%%MODULE_INVOKE_PATH%%': LUA_DISPATCHER_MODULE_PATH.split(':', 1)[1],
         '%%YEAR%%': str(year),
     }
-    stat_content = apply_template("template_stat.wikitext", stat_replacements)
-    write_output_file(stat_content, stat_filename)
+    render_output("template_stat.wikitext", stat_replacements, stat_filename, manifest, {'key_map': key_map})
 
     # --- Documentatie voor Stat Sjabloon (/doc pagina) ---
     available_stats_table_rows = []
@@ -326,24 +1519,37 @@ def generate_wikitemplates(metadata_dict, key_map, year, dataset_id, stat_filena
     stat_doc_replacements = {
         '%%TEMPLATE_STAT_NAME%%': template_stat_name,
         '%%YEAR%%': str(year),
-        '%%REGION_ID_KEY%%': REGION_IDENTIFIER_KEY,
-        '%%STATS_LIST_USER%%': included_stats_str,
         '%%REGION_TYPES%%': included_regions_str,
         '%%AVAILABLE_STATS_TABLE%%': available_stats_table_str,
         '%%LUA_DISPATCHER_PATH%%': LUA_DISPATCHER_MODULE_PATH,
         '%%LUA_DATA_SUBMODULE_PATH%%': lua_data_submodule_path,
         '%%DATASET_ID%%': dataset_id,
+        '%%TEMPLATE_STATS_PATH%%': TEMPLATE_STATS_PATH,
+        '%%TEMPLATE_STATS_NAME%%': template_stats_name,
     }
-    stat_doc_content = apply_template("template_stat_doc.wikitext", stat_doc_replacements)
-    write_output_file(stat_doc_content, stat_doc_filename)
+    render_output("template_stat_doc.wikitext", stat_doc_replacements, stat_doc_filename, manifest, {'key_map': key_map})
+
+    # --- Sjabloon: ... Stats (meerdere stats/regio's, één #invoke) ---
+    render_output("template_stats.wikitext", stat_replacements, stats_filename, manifest, {'key_map': key_map})
+
+    # --- Documentatie voor Stats Sjabloon (/doc pagina) ---
+    stats_doc_replacements = {
+        '%%TEMPLATE_STATS_NAME%%': template_stats_name,
+        '%%TEMPLATE_STAT_PATH%%': TEMPLATE_STAT_PATH,
+        '%%TEMPLATE_STAT_NAME%%': template_stat_name,
+        '%%YEAR%%': str(year),
+        '%%STATS_LIST_USER%%': included_stats_str,
+        '%%STATS_PARAMS_USER%%': ", ".join(f"<code>{key}</code>" for key in user_facing_keys),
+        '%%LUA_DISPATCHER_PATH%%': LUA_DISPATCHER_MODULE_PATH,
+    }
+    render_output("template_stats_doc.wikitext", stats_doc_replacements, stats_doc_filename, manifest, {'key_map': key_map})
 
     # --- Sjabloon: ... Info ---
     info_replacements = {
         '%%TEMPLATE_STAT_PATH%%': TEMPLATE_STAT_PATH,
         '%%TEMPLATE_STAT_NAME%%': template_stat_name
     }
-    info_content = apply_template("template_info.wikitext", info_replacements)
-    write_output_file(info_content, info_filename)
+    render_output("template_info.wikitext", info_replacements, info_filename, manifest, {'key_map': key_map})
 
     # --- Documentatie voor Info Sjabloon (/doc pagina) ---
     info_doc_replacements = {
@@ -356,144 +1562,1237 @@ def generate_wikitemplates(metadata_dict, key_map, year, dataset_id, stat_filena
         '%%REGION_TYPES%%': included_regions_str,
         '%%DATASET_ID%%': dataset_id,
     }
-    info_doc_content = apply_template("template_info_doc.wikitext", info_doc_replacements)
-    write_output_file(info_doc_content, info_doc_filename)
+    render_output("template_info_doc.wikitext", info_doc_replacements, info_doc_filename, manifest, {'key_map': key_map})
 
 
-# --- Hoofd Uitvoeringslogica ---
+# --- Profiel (--profile) ---
 
-if __name__ == "__main__":
-    # --- Argument Parsing ---
-    parser = argparse.ArgumentParser(description="Download/verwerk CBS KWB data en genereer Wiki Lua/sjablonen.")
-    parser.add_argument("year", type=int, help="Het doeljaar voor de data.")
-    parser.add_argument("--overwrite", action="store_true", help="Forceer opnieuw downloaden CBS bron data.")
-    parser.add_argument("--overwrite-stripped", action="store_true", help="Forceer opnieuw filteren/strippen van data.")
-    parser.add_argument("--dataset-id", type=str, default=None, help="Overschrijf het standaard CBS dataset ID.")
-    args = parser.parse_args()
+def max_rss_kib():
+    """Hoogste resident set size van dit proces tot nu toe (KiB), of None als onbekend."""
+    if resource is None: return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss # macOS geeft bytes, Linux KiB
+
+class RunProfiler:
+    """Meet per pipeline stap wall/CPU tijd, geheugenpiek, aantallen en geschreven bytes.
+
+    Uitgeschakeld (standaard) meet `stage()` niets. Met `cprofile` ('hottest' of een
+    stapnaam) draait cProfile mee, ook zonder `enabled`; `save()` bewaart dan het profiel
+    van die stap (bij 'hottest' de stap met de langste wall tijd).
+    RSS per stap: `max_rss_kib` is de piek van het hele proces tot het einde van de stap
+    (ru_maxrss), `max_rss_growth_kib` hoeveel die piek tijdens de stap gestegen is.
+    """
+
+    def __init__(self, enabled=False, cprofile=None):
+        enabled = enabled or bool(cprofile) # --cprofile impliceert --profile
+        self.enabled = enabled
+        self.cprofile = cprofile
+        self.stages = []
+        self._profiles = {}
+        self._start = (time.perf_counter(), time.process_time())
+        self.started = datetime.now(timezone.utc).isoformat()
+        if enabled and not tracemalloc.is_tracing(): tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        """Context voor één stap; de stap kan aantallen in de meegegeven dict zetten."""
+        counts = {}
+        if not self.enabled:
+            yield counts
+            return
+        written = dict(_WRITE_STATS)
+        tracemalloc.reset_peak()
+        traced_start = tracemalloc.get_traced_memory()[0]
+        profile = cProfile.Profile() if self.cprofile in ('hottest', name) else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        rss_start = max_rss_kib()
+        error = None
+        if profile: profile.enable()
+        try:
+            yield counts
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if profile:
+                profile.disable()
+                self._profiles[name] = profile
+            entry = {
+                'stage': name,
+                'wall_s': round(time.perf_counter() - wall, 6),
+                'cpu_s': round(time.process_time() - cpu, 6),
+                'tracemalloc_peak_kib': round((tracemalloc.get_traced_memory()[1] - traced_start) / 1024, 1),
+                'max_rss_kib': max_rss_kib(), # Cumulatief: piek van het proces tot nu toe
+                'max_rss_growth_kib': None if rss_start is None else max_rss_kib() - rss_start,
+                'files_written': _WRITE_STATS['files'] - written['files'],
+                'bytes_written': _WRITE_STATS['bytes'] - written['bytes'],
+                'counts': counts,
+            }
+            if error: entry['error'] = error
+            self.stages.append(entry)
+
+    def save(self, report_path, **context):
+        """Schrijft het JSON rapport (plus eventueel het cProfile bestand) en print een samenvatting."""
+        if not self.enabled: return True
+        report = {
+            **context,
+            'started': self.started,
+            'python': sys.version.split()[0],
+            'argv': sys.argv[1:],
+            'total': {
+                'wall_s': round(time.perf_counter() - self._start[0], 6),
+                'cpu_s': round(time.process_time() - self._start[1], 6),
+                'max_rss_kib': max_rss_kib(),
+                'bytes_written': sum(stage['bytes_written'] for stage in self.stages),
+            },
+            'stages': self.stages,
+        }
+        profiled = [stage for stage in self.stages if stage['stage'] in self._profiles]
+        if profiled:
+            hottest = max(profiled, key=lambda stage: stage['wall_s'])['stage']
+            profile_path = f"{os.path.splitext(report_path)[0]}.{hottest}.prof"
+            os.makedirs(os.path.dirname(profile_path) or '.', exist_ok=True)
+            self._profiles[hottest].dump_stats(profile_path)
+            report['cprofile'] = {'stage': hottest, 'path': profile_path}
+        print("Profiel per stap:")
+        for stage in self.stages:
+            print(f"  {stage['stage']:<14} {stage['wall_s']:>8.3f}s wall {stage['cpu_s']:>8.3f}s cpu "
+                  f"{stage['tracemalloc_peak_kib']:>10.0f} KiB piek {stage['bytes_written']:>12} bytes")
+        if not save_json(report, report_path): return False
+        print(f"Profiel rapport: {report_path}" + (f" (cProfile: {report['cprofile']['path']})" if profiled else ""))
+        return True
+
+
+# --- Wijzigingen tussen Releases (revisies van CBS) ---
+
+def load_previous_cache(cache_path):
+    """Leest de bestaande cache als vorige release, ook als die niet meer bij het bronbestand past.
+
+    Geeft (header, RegionTable) terug, of None als er geen (leesbare) vorige cache is.
+    """
+    try:
+        return read_region_table(cache_path)
+    except FileNotFoundError: return None
+    except Exception as e:
+        print(f"Waarschuwing: Vorige cache onleesbaar ({e}); geen wijzigingsrapport.")
+        return None
+
+def _change_delta(old, new):
+    """Verschil nieuw - oud voor twee getallen, anders None."""
+    if type(old) not in (int, float) or type(new) not in (int, float): return None
+    delta = new - old
+    return round(delta, 10) if isinstance(delta, float) else delta
+
+def _gather(sequence, rows):
+    """Elementen van `sequence` op de posities `rows` als tuple (itemgetter: zonder Python lus)."""
+    if len(rows) > 1: return itemgetter(*rows)(sequence)
+    return tuple(sequence[row] for row in rows)
+
+def diff_region_tables(previous, current):
+    """Vergelijkt twee RegionTables per regio en stat; null en ontbrekend tellen als 'geen waarde'.
+
+    Per stat worden de maskers en waarden van de gemeenschappelijke regio's als geheel
+    vergeleken (in C); alleen de posities die verschillen worden in Python bekeken. Geeft
+    een dict met toegevoegde/verwijderde regio's en stats en per herziene regio
+    {stat: {old, new, delta}}.
+    """
+    previous_index, current_index = dict(previous.iter_row_indices()), dict(current.iter_row_indices())
+    regions_added = [code for code in current.region_codes if code not in previous_index]
+    regions_removed = [code for code in previous.region_codes if code not in current_index]
+    common = [code for code in current.region_codes if code in previous_index] # Gesorteerd
+    previous_rows = _gather(previous_index, common)
+    current_rows = _gather(current_index, common)
+
+    previous_stats, current_stats = set(previous.stat_keys), set(current.stat_keys)
+    revised, revisions = {}, {}
+    for key in sorted(previous_stats & current_stats):
+        previous_mask, previous_values = (_gather(part, previous_rows) for part in previous.column(key))
+        current_mask, current_values = (_gather(part, current_rows) for part in current.column(key))
+        if previous_mask == current_mask and previous_values == current_values: continue
+        candidates = set(compress(count(), map(ne, previous_mask, current_mask)))
+        candidates.update(compress(count(), map(ne, previous_values, current_values)))
+        revised_count = 0
+        for position in sorted(candidates):
+            old = previous_values[position] if previous_mask[position] == MASK_VALUE else None
+            new = current_values[position] if current_mask[position] == MASK_VALUE else None
+            if old == new: continue # Bv. null -> ontbrekend, of een andere vulwaarde
+            revised.setdefault(common[position], {})[key] = {'old': old, 'new': new, 'delta': _change_delta(old, new)}
+            revised_count += 1
+        if revised_count: revisions[key] = revised_count
+
+    return {
+        'regions_added': regions_added,
+        'regions_removed': regions_removed,
+        'stats_added': sorted(current_stats - previous_stats),
+        'stats_removed': sorted(previous_stats - current_stats),
+        'stat_revisions': revisions,
+        'revised': {code: revised[code] for code in sorted(revised)},
+    }
+
+def build_change_report(year, dataset_id, previous_header, previous, current, source_path):
+    """Wijzigingsrapport van de nieuwe (verwerkte) data t.o.v. de vorige release, als JSON-baar dict.
+
+    `affected_regions` zijn de regio's waarvan de output kan veranderen: toegevoegd, verwijderd
+    of herzien; bij toegevoegde of verwijderde stats alle regio's. Zonder vorige release
+    (`previous_header` None, `previous` leeg) is alles toegevoegd. De fingerprint van `current`
+    koppelt het rapport aan de data waarvoor het geldt (zie load_change_report).
+    """
+    start = time.perf_counter()
+    current_fingerprint = current.fingerprint()
+    previous_fingerprint = previous.fingerprint()
+    diff = diff_region_tables(previous, current)
+    if diff['stats_added'] or diff['stats_removed']:
+        affected = sorted(set(previous) | set(current))
+    else:
+        affected = sorted(set(diff['regions_added']) | set(diff['regions_removed']) | set(diff['revised']))
+    return {
+        'year': year,
+        'dataset_id': dataset_id,
+        'generated': datetime.now(timezone.utc).isoformat(),
+        'previous': None if previous_header is None else {
+            'source': previous_header.get('source'), 'fingerprint': previous_fingerprint, 'regions': len(previous)},
+        'current': {'source': file_fingerprint(source_path, with_hash=False), 'fingerprint': current_fingerprint, 'regions': len(current)},
+        'summary': {
+            'regions_added': len(diff['regions_added']),
+            'regions_removed': len(diff['regions_removed']),
+            'regions_revised': len(diff['revised']),
+            'values_revised': sum(diff['stat_revisions'].values()),
+            'stats_added': len(diff['stats_added']),
+            'stats_removed': len(diff['stats_removed']),
+            'diff_seconds': round(time.perf_counter() - start, 6),
+        },
+        **diff,
+        'affected_regions': affected,
+    }
 
-    # --- Variabelen Setup ---
-    TARGET_YEAR = args.year
-    OVERWRITE_SOURCE_DATA = args.overwrite
-    OVERWRITE_STRIPPED_DATA = args.overwrite_stripped
-    YEAR_BASE_DIR = str(TARGET_YEAR)
-    DATA_DIR = os.path.join(YEAR_BASE_DIR, "cbs_data")
-    OUTPUT_DIR = os.path.join(YEAR_BASE_DIR, "wiki_output")
-
-    # Paden naar bron en cache bestanden
-    full_typed_data_set_path = os.path.join(DATA_DIR, 'TypedDataSet.json')
-    stripped_data_cache_path = os.path.join(DATA_DIR, STRIPPED_DATA_CACHE_FILENAME.format(year=TARGET_YEAR))
-    data_properties_path = os.path.join(DATA_DIR, 'DataProperties.json')
-
-    # Definieer Wiki paden en output bestandsnamen
-    lua_data_submodule_path = f"{LUA_DISPATCHER_MODULE_PATH}/{TARGET_YEAR}"
-    lua_data_submodule_filename = os.path.join(OUTPUT_DIR, f"{LUA_DISPATCHER_MODULE_PATH.replace(':', '_')}_{TARGET_YEAR}.lua")
-    lua_data_submodule_doc_filename = os.path.join(OUTPUT_DIR, f"{LUA_DISPATCHER_MODULE_PATH.replace(':', '_')}_{TARGET_YEAR}_doc.wikitext")
-
-    template_stat_filename = os.path.join(OUTPUT_DIR, f"{TEMPLATE_STAT_PATH.replace(':', '_')}.wikitext")
-    template_info_filename = os.path.join(OUTPUT_DIR, f"{TEMPLATE_INFO_PATH.replace(':', '_')}.wikitext")
-    template_stat_doc_filename = os.path.join(OUTPUT_DIR, f"{TEMPLATE_STAT_PATH.replace(':', '_')}_doc.wikitext")
-    template_info_doc_filename = os.path.join(OUTPUT_DIR, f"{TEMPLATE_INFO_PATH.replace(':', '_')}_doc.wikitext")
-    dispatcher_lua_output_filename = os.path.join(OUTPUT_DIR, f"{LUA_DISPATCHER_MODULE_PATH.replace(':', '_')}_DISPATCHER_MANUAL_COPY.lua")
-    dispatcher_lua_doc_output_filename = os.path.join(OUTPUT_DIR, f"{LUA_DISPATCHER_MODULE_PATH.replace(':', '_')}_doc.wikitext")
-    
-    # --- Start Proces ---
-    print(f"--- Start KWB Generator {TARGET_YEAR} (Templates, Suffix-Agnostisch) ---")
+def print_change_report(report, limit=10):
+    """Print een samenvatting van een wijzigingsrapport (met de eerste `limit` herziene regio's)."""
+    summary = report['summary']
+    if report['previous'] is None:
+        print(f"Geen vorige release (cache) om mee te vergelijken: alle {len(report['affected_regions'])} regio's zijn nieuw.")
+        return
+    if not report['affected_regions']:
+        print(f"Geen revisies t.o.v. de vorige release ({summary['diff_seconds']:.3f}s).")
+        return
+    print(f"Revisies t.o.v. de vorige release ({summary['diff_seconds']:.3f}s): "
+          f"{summary['regions_added']} regio's toegevoegd, {summary['regions_removed']} verwijderd, "
+          f"{summary['regions_revised']} herzien ({summary['values_revised']} waarden)")
+    if report['stats_added'] or report['stats_removed']:
+        print(f"  Stats toegevoegd: {', '.join(report['stats_added']) or '-'}; verwijderd: {', '.join(report['stats_removed']) or '-'}")
+    for key, count in sorted(report['stat_revisions'].items(), key=lambda item: -item[1]):
+        print(f"  {key}: {count} regio's")
+    for code in list(report['revised'])[:limit]:
+        changes = ', '.join(f"{key} {change['old']} -> {change['new']}" for key, change in report['revised'][code].items())
+        print(f"  {code}: {changes}")
+    if len(report['revised']) > limit: print(f"  ... en {len(report['revised']) - limit} andere herziene regio's")
+
+def load_change_report(report_path, processed_data):
+    """Laadt het opgeslagen wijzigingsrapport als het bij `processed_data` hoort; anders None (met reden)."""
+    if not os.path.exists(report_path):
+        print(f"Geen wijzigingsrapport ({report_path}); vergelijking met een vorige release ontbreekt.")
+        return None
+    report = load_json(report_path)
+    if not isinstance(report, dict) or 'affected_regions' not in report:
+        print(f"Waarschuwing: Wijzigingsrapport {report_path} onleesbaar.")
+        return None
+    if report.get('current', {}).get('fingerprint') != RegionTable.from_mapping(processed_data).fingerprint():
+        print(f"Waarschuwing: Wijzigingsrapport {report_path} hoort bij andere data (andere configuratie of --no-derived).")
+        return None
+    return report
+
+
+# --- Pipeline per Jaar ---
+
+class PipelineError(Exception):
+    """Fout waardoor de verwerking van een jaar wordt afgebroken."""
+
+def get_year_paths(year):
+    """Bepaalt de data/output mappen en bestandsnamen voor een jaar."""
+    data_dir = os.path.join(str(year), "cbs_data")
+    output_dir = os.path.join(str(year), "wiki_output")
+    module_file_base = LUA_DISPATCHER_MODULE_PATH.replace(':', '_')
+    return {
+        'data_dir': data_dir,
+        'output_dir': output_dir,
+        'typed_data_set': os.path.join(data_dir, 'TypedDataSet.json'),
+        'stripped_cache': os.path.join(data_dir, STRIPPED_DATA_CACHE_FILENAME.format(year=year)),
+        'data_properties': os.path.join(data_dir, 'DataProperties.json'),
+        'lua_data_submodule_path': f"{LUA_DISPATCHER_MODULE_PATH}/{year}",
+        'lua_data_submodule': os.path.join(output_dir, f"{module_file_base}_{year}.lua"),
+        'lua_data_submodule_doc': os.path.join(output_dir, f"{module_file_base}_{year}_doc.wikitext"),
+        'lua_data_shard_dir': os.path.join(output_dir, f"{module_file_base}_{year}_shards"),
+        'profile_report': os.path.join(str(year), PROFILE_REPORT_FILENAME),
+        'change_report': os.path.join(str(year), CHANGE_REPORT_FILENAME),
+    }
+
+def get_shared_output_files(output_dir):
+    """Bestandsnamen van de jaar-onafhankelijke outputs (dispatcher en sjablonen) in `output_dir`."""
+    return {
+        'template_stat': os.path.join(output_dir, f"{TEMPLATE_STAT_PATH.replace(':', '_')}.wikitext"),
+        'template_info': os.path.join(output_dir, f"{TEMPLATE_INFO_PATH.replace(':', '_')}.wikitext"),
+        'template_stat_doc': os.path.join(output_dir, f"{TEMPLATE_STAT_PATH.replace(':', '_')}_doc.wikitext"),
+        'template_info_doc': os.path.join(output_dir, f"{TEMPLATE_INFO_PATH.replace(':', '_')}_doc.wikitext"),
+        'template_stats': os.path.join(output_dir, f"{TEMPLATE_STATS_PATH.replace(':', '_')}.wikitext"),
+        'template_stats_doc': os.path.join(output_dir, f"{TEMPLATE_STATS_PATH.replace(':', '_')}_doc.wikitext"),
+        'dispatcher_lua': os.path.join(output_dir, f"{LUA_DISPATCHER_MODULE_PATH.replace(':', '_')}_DISPATCHER_MANUAL_COPY.lua"),
+        'dispatcher_doc': os.path.join(output_dir, f"{LUA_DISPATCHER_MODULE_PATH.replace(':', '_')}_doc.wikitext"),
+    }
+
+def get_output_pages(year_paths=None, shared_files=None, shards=None):
+    """Lijst van (label, bestand, wiki pagina) voor de opgegeven outputs."""
+    pages = []
+    if year_paths:
+        pages += [
+            ("Lua Data Index" if shards else "Lua Data Submodule", year_paths['lua_data_submodule'], year_paths['lua_data_submodule_path']),
+            ("Lua Data Submodule Doc", year_paths['lua_data_submodule_doc'], f"{year_paths['lua_data_submodule_path']}/doc"),
+        ]
+    if shards:
+        pages += [("Lua Data Shard", filename, page) for _, filename, page in shards]
+    if shared_files:
+        pages += [
+            ("Stat Sjabloon", shared_files['template_stat'], TEMPLATE_STAT_PATH),
+            ("Stat Sjabloon Doc", shared_files['template_stat_doc'], f"{TEMPLATE_STAT_PATH}/doc"),
+            ("Stats Sjabloon", shared_files['template_stats'], TEMPLATE_STATS_PATH),
+            ("Stats Sjabloon Doc", shared_files['template_stats_doc'], f"{TEMPLATE_STATS_PATH}/doc"),
+            ("Info Sjabloon", shared_files['template_info'], TEMPLATE_INFO_PATH),
+            ("Info Sjabloon Doc", shared_files['template_info_doc'], f"{TEMPLATE_INFO_PATH}/doc"),
+            ("Dispatcher Lua Doc", shared_files['dispatcher_doc'], f"{LUA_DISPATCHER_MODULE_PATH}/doc"),
+            ("Dispatcher Lua (Handmatig)", shared_files['dispatcher_lua'], LUA_DISPATCHER_MODULE_PATH),
+        ]
+    return pages
+
+def limit_output_pages(output_pages, affected_regions, digits=SHARD_DEFAULT_DIGITS):
+    """Met --changed-only: alleen shards met getroffen regio's, en zonder getroffen regio's geen data (sub)module."""
+    affected_shards = {shard_key(code, digits) for code in affected_regions}
+    data_labels = {"Lua Data Submodule", "Lua Data Index", "Lua Data Submodule Doc"}
+    return [(label, filename, page) for label, filename, page in output_pages
+            if not (label == "Lua Data Shard" and page.rsplit('/', 1)[1] not in affected_shards)
+            and not (label in data_labels and not affected_regions)]
+
+def prepare_year_data(year, dataset_id, args, profiler=None):
+    """Stappen 1-4 voor één jaar: download, metadata, key map, gestripte data en het wijzigingsrapport.
+
+    Als de data opnieuw gestript wordt, is de bestaande cache de vorige release; het
+    wijzigingsrapport (revisies per regio) komt dan in JAAR/changes.json. Komt de data uit de
+    cache, dan wordt het opgeslagen rapport gebruikt als het bij deze data hoort.
+    Geeft (key_map, metadata_dict, processed_data, change_report) terug; change_report is None
+    als er geen revisie-informatie is. Gooit PipelineError bij een fout.
+    """
+    profiler = profiler or RunProfiler()
+    paths = get_year_paths(year)
+    print(f"--- Start KWB Generator {year} (Templates, Suffix-Agnostisch) ---")
     print(f"Benodigde Stats (basisnamen): {', '.join(REQUIRED_STATS_BASE_NAMES)}")
     print(f"Gefilterde Regio Types: {', '.join(TARGET_REGION_TYPES)}")
-    print(f"Bron Data: {DATA_DIR}, Cache: {stripped_data_cache_path}, Output: {OUTPUT_DIR}")
-    print(f"Overschrijf bron: {OVERWRITE_SOURCE_DATA}, Overschrijf stripped: {OVERWRITE_STRIPPED_DATA}")
-
-    dataset_id = args.dataset_id if args.dataset_id else DEFAULT_DATASET_ID_PATTERN
+    print(f"Bron Data: {paths['data_dir']}, Cache: {paths['stripped_cache']}, Output: {paths['output_dir']}")
+    print(f"Overschrijf bron: {args.overwrite}, Overschrijf stripped: {args.overwrite_stripped}")
     print(f"Gebruikt Dataset ID: {dataset_id}")
 
     # 1. Download Bron Data
-    if not download_data(dataset_id, DATA_DIR, OVERWRITE_SOURCE_DATA): sys.exit(1)
+    with profiler.stage('download'):
+        if not download_data(dataset_id, paths['data_dir'], args.overwrite, projected=not args.full_download,
+                             base_url=args.odata_url, workers=args.download_workers):
+            raise PipelineError("Download van bron data mislukt.")
 
     # 2. Laad Metadata
-    print("Laden metadata (DataProperties)...")
-    data_properties = load_json(data_properties_path)
-    if not data_properties: print("AFGEBROKEN: Kon DataProperties.json niet laden."); sys.exit(1)
+    with profiler.stage('metadata') as counts:
+        print("Laden metadata (DataProperties)...")
+        data_properties = load_json(paths['data_properties'])
+        if not data_properties: raise PipelineError("Kon DataProperties.json niet laden.")
+        counts['properties'] = len(data_properties)
 
     # 3. Bouw Key Map
-    print("Bouwen key map van metadata...")
-    key_map, metadata_dict, missing_bases = {}, {}, set(REQUIRED_STATS_BASE_NAMES)
-    for prop in data_properties:
-        if prop.get('odata.type') == 'Cbs.OData.Topic':
-             full_key = clean_key(prop.get('Key', ''))
-             if not full_key: continue
-             metadata_dict[full_key] = { k: prop.get(k) for k in ['Title', 'Description', 'Unit', 'Decimals'] }
-             base_name = full_key
-             if '_' in full_key and full_key.split('_')[-1].isdigit():
-                 base_name = '_'.join(full_key.split('_')[:-1])
-             if base_name in REQUIRED_STATS_BASE_NAMES:
-                 if base_name not in key_map: key_map[base_name] = full_key; missing_bases.discard(base_name)
-                 elif key_map[base_name] != full_key: print(f"Waarschuwing: Dubbele basisnaam '{base_name}'")
-    if missing_bases: print(f"AFGEBROKEN: Mapping mist voor: {missing_bases}"); sys.exit(1)
-    full_keys_required_set = set(key_map.values())
-    print(f"Afgeleide volledige sleutels: {', '.join(sorted(full_keys_required_set))}")
+    with profiler.stage('key_map') as counts:
+        print("Bouwen key map van metadata...")
+        key_map, metadata_dict, missing_bases = build_key_map(data_properties, REQUIRED_STATS_BASE_NAMES)
+        if missing_bases: raise PipelineError(f"Mapping mist voor: {missing_bases}")
+        full_keys_required_set = set(key_map.values())
+        print(f"Afgeleide volledige sleutels: {', '.join(sorted(full_keys_required_set))}")
+        counts['stats'] = len(full_keys_required_set)
 
     # 4. Verkrijg Stripped/Filtered Data
-    processed_data = None
-    use_cache = not OVERWRITE_STRIPPED_DATA and os.path.exists(stripped_data_cache_path)
-    if use_cache:
-        print(f"Poging tot laden data uit cache: {stripped_data_cache_path}")
-        processed_data = load_json(stripped_data_cache_path)
-        if processed_data:
-            first_rec_keys = set(next(iter(processed_data.values())).keys()) if processed_data else set()
-            if not full_keys_required_set.issubset(first_rec_keys):
-                 print("Waarschuwing: Cache data verouderd. Forceer re-strip."); processed_data = None
-            else: print(f"Succesvol {len(processed_data)} regios geladen uit cache.")
-        else: print("Waarschuwing: Cache bestand corrupt/leeg. Zal opnieuw strippen.")
-    if processed_data is None:
-        reason = "(--overwrite-stripped)" if OVERWRITE_STRIPPED_DATA else "(cache mist/fout/verouderd)"
-        print(f"Uitvoeren data filtering en stripping {reason}...")
-        if not os.path.exists(full_typed_data_set_path): print(f"Fout: Bronbestand mist: {full_typed_data_set_path}"); sys.exit(1)
-        processed_data = load_and_strip_typed_data(full_typed_data_set_path, REGION_IDENTIFIER_KEY, REGION_TYPE_KEY, TARGET_REGION_TYPES, full_keys_required_set)
-        if processed_data is not None:
-            print(f"Opslaan data naar cache: {stripped_data_cache_path}")
-            if not save_json(processed_data, stripped_data_cache_path): print("Waarschuwing: Opslaan cache mislukt.")
-            print(f"NOTE: Cache reflecteert basisnamen: {', '.join(REQUIRED_STATS_BASE_NAMES)}.")
-    if processed_data is None: print("AFGEBROKEN: Kon data niet verkrijgen."); sys.exit(1)
+    with profiler.stage('stripped_data') as counts:
+        processed_data = previous_cache = None
+        use_cache = not args.overwrite_stripped and os.path.exists(paths['stripped_cache'])
+        if use_cache:
+            print(f"Poging tot laden data uit cache: {paths['stripped_cache']}")
+            processed_data = load_stripped_cache(paths['stripped_cache'], paths['typed_data_set'], full_keys_required_set, TARGET_REGION_TYPES)
+            if processed_data is not None:
+                print(f"Succesvol {len(processed_data)} regios geladen uit cache.")
+                counts['source'] = 'cache'
+        if processed_data is None:
+            reason = "(--overwrite-stripped)" if args.overwrite_stripped else "(cache mist/fout/verouderd)"
+            print(f"Uitvoeren data filtering en stripping {reason}...")
+            if not os.path.exists(paths['typed_data_set']): raise PipelineError(f"Bronbestand mist: {paths['typed_data_set']}")
+            processed_data = load_and_strip_typed_data(paths['typed_data_set'], REGION_IDENTIFIER_KEY, REGION_TYPE_KEY, TARGET_REGION_TYPES, full_keys_required_set, streaming=not args.no_streaming)
+            if processed_data is not None:
+                counts['source'] = 'strip'
+                # Vóór het overschrijven; zonder vorige cache wordt met een lege release vergeleken
+                previous_cache = load_previous_cache(paths['stripped_cache']) or (None, RegionTable([], {}))
+                print(f"Opslaan data naar cache: {paths['stripped_cache']}")
+                if not save_stripped_cache(processed_data, paths['stripped_cache'], paths['typed_data_set'], full_keys_required_set, TARGET_REGION_TYPES):
+                    print("Waarschuwing: Opslaan cache mislukt.")
+                print(f"NOTE: Cache reflecteert basisnamen: {', '.join(REQUIRED_STATS_BASE_NAMES)}.")
+        if processed_data is None: raise PipelineError("Kon data niet verkrijgen.")
+        counts['regions'] = len(processed_data)
 
-    # 5. Genereer Lua Data Submodule EN Documentatie
-    generate_lua_data_submodule(
-        processed_data, metadata_dict, key_map, dataset_id, TARGET_YEAR,
-        lua_data_submodule_filename, lua_data_submodule_doc_filename
-    )
+    # 4b. Bereken Afgeleide Statistieken (verhoudingen en rangschikkingen)
+    previous_data = previous_cache[1] if previous_cache else None
+    if not args.no_derived:
+        with profiler.stage('derive') as counts:
+            start = time.perf_counter()
+            base_key_map, base_metadata_dict = key_map, metadata_dict
+            processed_data, key_map, metadata_dict = derive_statistics(processed_data, base_key_map, base_metadata_dict)
+            if previous_data:
+                # Ook voor de vorige release, zodat het rapport verschoven rangen e.d. meeneemt
+                previous_data = derive_statistics(previous_data, base_key_map, base_metadata_dict)[0]
+            derived = sorted(set(key_map.values()) - full_keys_required_set)
+            print(f"Afgeleide statistieken ({len(derived)}) berekend in {time.perf_counter() - start:.3f}s: {', '.join(derived)}")
+            counts['stats'] = len(derived)
+
+    # 4c. Vergelijk met de vorige release (of gebruik het rapport van de run die deze cache maakte)
+    with profiler.stage('diff') as counts:
+        if previous_data is not None:
+            report = build_change_report(year, dataset_id, previous_cache[0], previous_data,
+                                         RegionTable.from_mapping(processed_data), paths['typed_data_set'])
+            print_change_report(report)
+            if save_json(report, paths['change_report']): print(f"Wijzigingsrapport: {paths['change_report']}")
+        else:
+            report = load_change_report(paths['change_report'], processed_data)
+            if report is None:
+                print("Geen revisie-informatie voor de data uit de cache; --changed-only is niet mogelijk.")
+            else:
+                print(f"Revisie-informatie: data uit de cache, wijzigingsrapport van {report['generated']} "
+                      f"({len(report['affected_regions'])} gewijzigde regio's).")
+        counts['affected_regions'] = None if report is None else len(report['affected_regions'])
+    return key_map, metadata_dict, processed_data, report
+
+def generate_shared_outputs(metadata_dict, key_map, dispatcher_key_map, year, dataset_id, output_dir, manifest=None, profiler=None, steps=OUTPUT_STEPS):
+    """Stappen 6-7: dispatcher en sjablonen (jaar-onafhankelijk, op basis van `year` als standaardjaar).
+
+    `steps` beperkt de generatie tot 'dispatcher' en/of 'templates' (gebruikt door de watch modus).
+    """
+    profiler = profiler or RunProfiler()
+    shared_files = get_shared_output_files(output_dir)
 
     # 6. Genereer Dispatcher Lua code (voor handmatige upload)
-    generate_dispatcher_lua(key_map, dispatcher_lua_output_filename)    
-    generate_dispatcher_doc(key_map, TARGET_YEAR, dataset_id, dispatcher_lua_doc_output_filename)
+    if 'dispatcher' in steps:
+        with profiler.stage('dispatcher') as counts:
+            generate_dispatcher_lua(dispatcher_key_map, shared_files['dispatcher_lua'], manifest)
+            generate_dispatcher_doc(dispatcher_key_map, year, dataset_id, shared_files['dispatcher_doc'], manifest)
+            counts['aliases'] = len(dispatcher_key_map)
 
     # 7. Genereer Wiki Sjablonen en Hun Documentatie
-    generate_wikitemplates(
-        metadata_dict, key_map, TARGET_YEAR, dataset_id,
-        template_stat_filename, template_info_filename,
-        template_stat_doc_filename, template_info_doc_filename
-    )
+    if 'templates' in steps:
+        with profiler.stage('templates') as counts:
+            generate_wikitemplates(
+                metadata_dict, key_map, year, dataset_id,
+                shared_files['template_stat'], shared_files['template_info'],
+                shared_files['template_stat_doc'], shared_files['template_info_doc'],
+                shared_files['template_stats'], shared_files['template_stats_doc'], manifest
+            )
+            counts['stats'] = len(key_map)
+    return shared_files
+
+def generate_year_outputs(year, dataset_id, args, key_map, metadata_dict, processed_data, manifest, profiler=None,
+                          include_shared=True, steps=OUTPUT_STEPS, affected_regions=None):
+    """Stappen 5-7 voor één jaar met al geladen data; geeft (shared_files, shards) terug.
+
+    `steps` beperkt de generatie tot een deel van OUTPUT_STEPS (gebruikt door de watch modus).
+    `affected_regions` (--changed-only) beperkt de data submodule tot de gewijzigde regio's:
+    met --shard alleen hun shards, zonder --shard wordt de module overgeslagen als er geen zijn.
+    """
+    paths = get_year_paths(year)
+    profiler = profiler or RunProfiler()
+
+    # 5. Genereer Lua Data Submodule EN Documentatie
+    shards = None
+    if 'lua_data' in steps:
+        with profiler.stage('lua_data') as counts:
+            if args.shard:
+                only_shards = None
+                if affected_regions is not None:
+                    only_shards = {shard_key(code, args.shard_digits) for code in affected_regions}
+                shards = generate_sharded_lua_data_submodule(
+                    processed_data, metadata_dict, key_map, dataset_id, year,
+                    paths['lua_data_submodule'], paths['lua_data_submodule_doc'], paths['lua_data_shard_dir'],
+                    paths['lua_data_submodule_path'], manifest, args.shard_digits, args.max_shard_bytes, args.layout,
+                    only_shards
+                )
+                if shards is None:
+                    manifest.save()
+                    raise PipelineError("Genereren gesharde data submodule mislukt.")
+                counts['shards'] = len(shards)
+            # Shards (en index) van een eerdere --shard run horen niet meer bij de output
+            elif (not remove_stale_shards(paths['lua_data_shard_dir']) and affected_regions is not None
+                  and not affected_regions and os.path.exists(paths['lua_data_submodule'])):
+                print(f"Geen gewijzigde regio's: {os.path.basename(paths['lua_data_submodule'])} niet opnieuw gemaakt (--changed-only).")
+            else:
+                generate_lua_data_submodule(
+                    processed_data, metadata_dict, key_map, dataset_id, year,
+                    paths['lua_data_submodule'], paths['lua_data_submodule_doc'], manifest, args.layout
+                )
+            counts['regions'] = len(processed_data)
+            counts['stats'] = len(set(key_map.values()))
+    shared_files = None
+    if include_shared:
+        shared_files = generate_shared_outputs(metadata_dict, key_map, key_map, year, dataset_id, paths['output_dir'],
+                                               manifest, profiler, steps)
+    if not manifest.save(): print("Waarschuwing: Opslaan output manifest mislukt.")
+    return shared_files, shards
+
+def run_year(year, dataset_id, args, include_shared=True):
+    """Volledige pipeline voor één jaar. Geeft een resultaat dict terug en gooit PipelineError bij een fout.
+
+    Met `include_shared=False` (batch modus) worden alleen de jaarlijkse outputs gemaakt.
+    Met --profile wordt (ook bij een fout) een profiel rapport naast wiki_output geschreven.
+    Met --changed-only beperken het wijzigingsrapport (JAAR/changes.json) de data submodule
+    en de output pagina's tot de gewijzigde regio's (of hun shards).
+    """
+    paths = get_year_paths(year)
+    profiler = RunProfiler(args.profile, args.cprofile)
+    try:
+        key_map, metadata_dict, processed_data, change_report = prepare_year_data(year, dataset_id, args, profiler)
+        affected_regions = None
+        if args.changed_only:
+            if change_report is None:
+                raise PipelineError("--changed-only: geen revisie-informatie voor deze data. Draai zonder --changed-only, "
+                                    "of maak een rapport met --overwrite-stripped (vergelijkt met de huidige cache).")
+            affected_regions = change_report['affected_regions']
+        manifest = OutputManifest(os.path.join(paths['output_dir'], OUTPUT_MANIFEST_FILENAME), force=args.force_generate)
+        shared_files, shards = generate_year_outputs(year, dataset_id, args, key_map, metadata_dict, processed_data,
+                                                     manifest, profiler, include_shared, affected_regions=affected_regions)
+    finally:
+        profiler.save(paths['profile_report'], year=year, dataset_id=dataset_id)
+
+    output_pages = get_output_pages(paths, shared_files, shards)
+    if affected_regions is not None:
+        output_pages = limit_output_pages(output_pages, affected_regions, args.shard_digits)
+        print(f"--changed-only: {len(affected_regions)} gewijzigde regio's, {len(output_pages)} output pagina's.")
+    full_keys = set(key_map.values())
+    return {
+        'year': year,
+        'dataset_id': dataset_id,
+        'key_map': key_map,
+        'metadata_dict': {k: v for k, v in metadata_dict.items() if k in full_keys},
+        'output_pages': output_pages,
+        'changed': manifest.changed,
+    }
+
+def _run_year_worker(year, dataset_id, args):
+    """Batch worker: draait één jaar en vangt alle fouten af, zodat andere jaren doorlopen."""
+    try:
+        return run_year(year, dataset_id, args, include_shared=False)
+    except PipelineError as e:
+        return {'year': year, 'dataset_id': dataset_id, 'error': str(e)}
+    except Exception as e:
+        return {'year': year, 'dataset_id': dataset_id, 'error': f"Onverwachte fout: {type(e).__name__}: {e}"}
+
+def parse_year_range(value):
+    """Parseert '2020-2024', '2021,2023' of '2024' naar een gesorteerde lijst jaren."""
+    years = set()
+    for part in value.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = (int(p) for p in part.split('-', 1))
+            years.update(range(start, end + 1))
+        elif part:
+            years.add(int(part))
+    return sorted(years)
+
+def load_dataset_map(filepath):
+    """Laadt een JSON bestand {jaar: dataset_id}."""
+    mapping = load_json(filepath)
+    if not isinstance(mapping, dict): return None
+    return {int(year): str(dataset_id) for year, dataset_id in mapping.items()}
+
+def print_upload_summary(output_pages, changed):
+    """Toont per output of deze gewijzigd is en welke wiki pagina's opnieuw geüpload moeten worden."""
+    shard_pages = [(filename, page) for label, filename, page in output_pages if label == "Lua Data Shard"]
+    for label, filename, page in output_pages:
+        if label == "Lua Data Shard": continue
+        status = "gewijzigd" if filename in changed else "ongewijzigd"
+        print(f"  - {label}: {os.path.basename(filename)} ({status})")
+        print(f"    -> Upload naar Wiki Pagina: '{page}'")
+    if shard_pages:
+        # Shards samengevat; de gewijzigde shards staan hieronder afzonderlijk
+        changed_shards = sum(1 for filename, _ in shard_pages if filename in changed)
+        print(f"  - Lua Data Shards: {len(shard_pages)} bestanden in {os.path.basename(os.path.dirname(shard_pages[0][0]))}/ ({changed_shards} gewijzigd)")
+        print(f"    -> Upload naar Wiki Pagina's: '{shard_pages[0][1].rsplit('/', 1)[0]}/<shard>'")
+
+    changed_pages = [(filename, page) for _, filename, page in output_pages if filename in changed]
+    if not changed_pages:
+        print("\nGeen wijzigingen: er hoeven geen pagina's opnieuw geüpload te worden.")
+    else:
+        print(f"\nGewijzigde pagina's ({len(changed_pages)}), opnieuw uploaden:")
+        for filename, page in changed_pages:
+            print(f"  * '{page}' <- {os.path.basename(filename)}")
+    dispatcher_files = [filename for label, filename, page in output_pages if page == LUA_DISPATCHER_MODULE_PATH]
+    if any(filename in changed for filename in dispatcher_files):
+        print(f"\n!!! BELANGRIJK: Handmatige Actie Nodig !!!")
+        print(f"1. Creëer/Update de hoofdmodule '{LUA_DISPATCHER_MODULE_PATH}' op de wiki.")
+        print(f"2. Kopieer de inhoud van '{os.path.basename(dispatcher_files[0])}' hiernaartoe.")
+        print(f"3. Upload de inhoud van de andere gewijzigde bestanden (incl. /doc) naar hun respectievelijke pagina's.")
+
+def run_batch(year_dataset_ids, args):
+    """Draait de pipelines van meerdere jaren parallel in een process pool.
+
+    De jaar-onafhankelijke outputs worden daarna één keer gemaakt in
+    BATCH_SHARED_OUTPUT_DIR, met de dispatcher aliassen uit de key maps van alle jaren.
+    Geeft True terug als alle jaren gelukt zijn.
+    """
+    years = sorted(year_dataset_ids)
+    print(f"--- Start KWB Batch: {len(years)} jaren ({', '.join(map(str, years))}), {args.workers} workers ---")
+    results = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(_run_year_worker, year, year_dataset_ids[year], args) for year in years]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result['year']] = result
+            status = f"MISLUKT: {result['error']}" if 'error' in result else "klaar"
+            print(f"[{result['year']}] {status}")
+
+    succeeded = [results[year] for year in years if 'error' not in results[year]]
+    failed = [results[year] for year in years if 'error' in results[year]]
+
+    shared_pages, shared_changed = [], []
+    if succeeded:
+        latest = succeeded[-1]
+        print(f"Genereren gedeelde outputs (standaardjaar {latest['year']}, aliassen uit {len(succeeded)} jaren)...")
+        manifest = OutputManifest(os.path.join(BATCH_SHARED_OUTPUT_DIR, OUTPUT_MANIFEST_FILENAME), force=args.force_generate)
+        profiler = RunProfiler(args.profile, args.cprofile)
+        dispatcher_key_map = merge_key_maps(result['key_map'] for result in succeeded)
+        shared_files = generate_shared_outputs(
+            latest['metadata_dict'], latest['key_map'], dispatcher_key_map,
+            latest['year'], latest['dataset_id'], BATCH_SHARED_OUTPUT_DIR, manifest, profiler
+        )
+        if not manifest.save(): print("Waarschuwing: Opslaan output manifest mislukt.")
+        profiler.save(os.path.join(os.path.dirname(BATCH_SHARED_OUTPUT_DIR), PROFILE_REPORT_FILENAME),
+                      years=[result['year'] for result in succeeded])
+        shared_pages, shared_changed = get_output_pages(shared_files=shared_files), manifest.changed
 
     # --- Afronden ---
     print("-" * 30)
-    print("Script succesvol voltooid.")
-    print(f"Gegenereerde bestanden staan in: {OUTPUT_DIR}")
-    print(f"  - Lua Data Submodule: {os.path.basename(lua_data_submodule_filename)}")
-    print(f"    -> Upload naar Wiki Pagina: '{lua_data_submodule_path}'")
-    print(f"  - Lua Data Submodule Doc: {os.path.basename(lua_data_submodule_doc_filename)}")
-    print(f"    -> Upload naar Wiki Pagina: '{lua_data_submodule_path}/doc'")
-    print(f"  - Stat Sjabloon: {os.path.basename(template_stat_filename)}")
-    print(f"    -> Upload naar Wiki Pagina: '{TEMPLATE_STAT_PATH}'")
-    print(f"  - Stat Sjabloon Doc: {os.path.basename(template_stat_doc_filename)}")
-    print(f"    -> Upload naar Wiki Pagina: '{TEMPLATE_STAT_PATH}/doc'")
-    print(f"  - Info Sjabloon: {os.path.basename(template_info_filename)}")
-    print(f"    -> Upload naar Wiki Pagina: '{TEMPLATE_INFO_PATH}'")
-    print(f"  - Info Sjabloon Doc: {os.path.basename(template_info_doc_filename)}")
-    print(f"  - Dispatcher Lua Doc: {os.path.basename(dispatcher_lua_doc_output_filename)}")
-    print(f"    -> Upload naar Wiki Pagina: '{TEMPLATE_INFO_PATH}/doc'")
-    print(f"  - Dispatcher Lua (Handmatig): {os.path.basename(dispatcher_lua_output_filename)}")
-    print(f"\n!!! BELANGRIJK: Handmatige Actie Nodig !!!")
-    if os.path.exists(dispatcher_lua_output_filename):
-        print(f"1. Creëer/Update de hoofdmodule '{LUA_DISPATCHER_MODULE_PATH}' op de wiki.")
-        print(f"2. Kopieer de inhoud van '{os.path.basename(dispatcher_lua_output_filename)}' hiernaartoe.")
+    print(f"Batch voltooid: {len(succeeded)} gelukt, {len(failed)} mislukt.")
+    for result in failed:
+        print(f"  - {result['year']} ({result['dataset_id']}): {result['error']}")
+    output_pages = [page for result in succeeded for page in result['output_pages']] + shared_pages
+    changed = set(shared_changed).union(*(result['changed'] for result in succeeded))
+    print_upload_summary(output_pages, changed)
+    if args.upload and output_pages and not upload_output_pages(output_pages, args): return False
+    return not failed
+
+
+# --- Tijdreeks Module (--series) ---
+
+def series_column_key(stat, year):
+    """Kolom van een stat in een bepaald jaar in de samengevoegde reeksen tabel."""
+    return f"{stat}@{year}"
+
+def get_series_paths():
+    """Data/output bestandsnamen voor de tijdreeks module."""
+    output_dir = os.path.join(SERIES_DIR, "wiki_output")
+    module_path = f"{LUA_DISPATCHER_MODULE_PATH}/{SERIES_MODULE_NAME}"
+    module_file_base = module_path.replace(':', '_').replace('/', '_')
+    return {
+        'output_dir': output_dir,
+        'cache': os.path.join(SERIES_DIR, SERIES_CACHE_FILENAME),
+        'module_path': module_path,
+        'module': os.path.join(output_dir, f"{module_file_base}.lua"),
+        'module_doc': os.path.join(output_dir, f"{module_file_base}_doc.wikitext"),
+        'shard_dir': os.path.join(output_dir, f"{module_file_base}_shards"),
+    }
+
+def local_years():
+    """Jaren met een lokale data map (JJJJ/cbs_data/DataProperties.json), gesorteerd."""
+    return sorted(int(name) for name in os.listdir('.')
+                  if re.fullmatch(r'\d{4}', name) and os.path.isfile(get_year_paths(int(name))['data_properties']))
+
+def series_config(args):
+    """Configuratie waar alle reeksen van afhangen; bij een wijziging wordt de reeksen cache niet hergebruikt."""
+    return {
+        'stats': SERIES_STATS,
+        'region_types': sorted(TARGET_REGION_TYPES),
+        'derived': None if args.no_derived else [DERIVED_RATIO_STATS, DERIVED_RANK_STATS],
+    }
+
+def series_year_inputs(year):
+    """Grootte en mtime van de bestanden waar de reeksen van een jaar uit komen (None als een bestand ontbreekt)."""
+    paths = get_year_paths(year)
+    inputs = {}
+    for name in ('data_properties', 'typed_data_set', 'stripped_cache'):
+        try: inputs[name] = file_fingerprint(paths[name], with_hash=False)
+        except FileNotFoundError: inputs[name] = None
+    return inputs
+
+def load_year_for_series(year, args):
+    """Laadt de gestripte data van één jaar uit zijn cache; gestript wordt alleen als die ontbreekt of verouderd is.
+
+    Elk jaar heeft een eigen key_map, dus een andere CBS suffix per jaar maakt niet uit. Een
+    stat die in een jaar niet bestaat heeft in dat jaar geen waarde. Geeft
+    (RegionTable, key_map, metadata_dict, dataset_id) terug, of None.
+    """
+    paths = get_year_paths(year)
+    data_properties = load_json(paths['data_properties'])
+    if not data_properties:
+        print(f"Waarschuwing: {year}: Kon DataProperties.json niet laden; jaar overgeslagen.")
+        return None
+    key_map, metadata_dict, missing_bases = build_key_map(data_properties, REQUIRED_STATS_BASE_NAMES)
+    if missing_bases: print(f"  Info: {year} heeft geen {', '.join(sorted(missing_bases))}.")
+    full_keys = set(key_map.values())
+    table = load_stripped_cache(paths['stripped_cache'], paths['typed_data_set'], full_keys, TARGET_REGION_TYPES)
+    if table is None:
+        if not os.path.exists(paths['typed_data_set']):
+            print(f"Waarschuwing: {year}: Geen cache en geen {paths['typed_data_set']}; jaar overgeslagen.")
+            return None
+        print(f"  {year}: Strippen (cache mist of is verouderd)...")
+        table = load_and_strip_typed_data(paths['typed_data_set'], REGION_IDENTIFIER_KEY, REGION_TYPE_KEY, TARGET_REGION_TYPES,
+                                          full_keys, streaming=not args.no_streaming)
+        if table is None: return None
+        if not save_stripped_cache(table, paths['stripped_cache'], paths['typed_data_set'], full_keys, TARGET_REGION_TYPES):
+            print("Waarschuwing: Opslaan cache mislukt.")
+    if not args.no_derived:
+        table, key_map, metadata_dict = derive_statistics(table, key_map, metadata_dict)
+    table_infos = load_json(os.path.join(paths['data_dir'], 'TableInfos.json'))
+    dataset_id = table_infos[0].get('Identifier') if table_infos else None
+    return table, key_map, metadata_dict, dataset_id
+
+def build_series(years, args):
+    """Voegt de gestripte data van `years` samen tot één tabel met een kolom per stat en jaar.
+
+    Incrementeel: de vorige uitkomst staat in de reeksen cache, met per jaar de fingerprints
+    van zijn bronbestanden. Een jaar waarvan die niet zijn veranderd wordt uit de cache
+    overgenomen zonder het te laden of te strippen. Geeft (RegionTable, {jaar: info}) terug,
+    of None als geen enkel jaar geladen kon worden.
+    """
+    cache_path = os.path.join(SERIES_DIR, SERIES_CACHE_FILENAME)
+    config = series_config(args)
+    previous, previous_years = None, {}
+    try:
+        header, previous = read_region_table(cache_path, SERIES_CACHE_MAGIC)
+        if header.get('config') == config: previous_years = header['years']
+        else: print("Info: Configuratie gewijzigd; reeksen cache wordt niet hergebruikt.")
+    except FileNotFoundError: pass
+    except ValueError as e: print(f"Waarschuwing: Reeksen cache ongeldig ({e}).")
+
+    parts, year_info, reused = [], {}, []
+    for year in years:
+        cached = previous_years.get(str(year))
+        if cached and cached['inputs'] == series_year_inputs(year):
+            keys = [series_column_key(stat, year) for stat in cached['stats']]
+            parts.append(RegionTable(previous.row_codes, {key: previous.column(key) for key in keys}))
+            year_info[year] = cached
+            reused.append(year)
+            continue
+        loaded = load_year_for_series(year, args)
+        if loaded is None: continue
+        table, key_map, metadata_dict, dataset_id = loaded
+        stats = [stat for stat in SERIES_STATS if key_map.get(stat) in table.stat_keys]
+        parts.append(RegionTable(table.row_codes, {series_column_key(stat, year): table.column(key_map[stat]) for stat in stats}))
+        year_info[year] = {
+            'inputs': series_year_inputs(year),
+            'dataset_id': dataset_id,
+            'stats': stats,
+            'full_keys': {stat: key_map[stat] for stat in stats},
+            'metadata': {stat: metadata_dict.get(key_map[stat]) for stat in stats},
+        }
+    if not year_info: return None
+
+    # Alle jaren op dezelfde (gesorteerde) regio's; een regio die in een jaar niet bestaat heeft daar geen waarden
+    region_codes = sorted(set().union(*(part.region_codes for part in parts)))
+    columns = {}
+    for part in parts:
+        aligned = part if part.row_codes == region_codes else part.reindexed(region_codes)
+        for key in aligned.stat_keys: columns[key] = aligned.column(key)
+    series = RegionTable(region_codes, columns)
+    try:
+        write_region_table(series, cache_path, columns, {'config': config, 'years': {str(year): info for year, info in year_info.items()}},
+                           SERIES_CACHE_MAGIC)
+    except Exception as e: print(f"Waarschuwing: Opslaan reeksen cache mislukt: {e}")
+
+    loaded_years = [year for year in year_info if year not in reused]
+    print(f"Reeksen: {len(year_info)} jaren, {len(region_codes)} regio's ({len(reused)} jaren uit de reeksen cache"
+          + (f", geladen: {', '.join(map(str, loaded_years))}" if loaded_years else "") + ")")
+    return series, year_info
+
+def iter_series_rows(series, years, stats):
+    """Levert (regiocode, [(stat, [waarde per jaar]), ...]) in gesorteerde volgorde; lege reeksen en regio's worden weggelaten."""
+    value_lists = [(stat, [series.sorted_values(series_column_key(stat, year)) for year in years]) for stat in stats]
+    for position, region_code in enumerate(series.region_codes):
+        row = []
+        for stat, per_year in value_lists:
+            values = [column[position] for column in per_year]
+            if any(value is not None for value in values): row.append((stat, values))
+        if row: yield region_code, row
+
+def format_lua_series_entry(region_code, stat_series):
+    """Het Lua blok van één regio: per stat een array met de waarde per jaar (positie i hoort bij p.years[i])."""
+    lines = [f'    ["{stat}"] = {{ {", ".join(format_lua_value(value) for value in values)} }},' for stat, values in stat_series]
+    return f'  ["{region_code}"] = {{\n' + '\n'.join(lines) + '\n  },'
+
+def generate_series_module(series, year_info, paths, manifest=None, digits=None, max_bytes=SHARD_MAX_BYTES):
+    """Genereert de tijdreeks module (of met `digits` een index plus shards per gemeente(groep)) en de documentatie.
+
+    Geeft een lijst van (shard, bestand, wiki pagina) terug (leeg zonder shards), of None bij een fout.
+    """
+    years = sorted(year_info)
+    stats = [stat for stat in SERIES_STATS if any(stat in year_info[year]['stats'] for year in years)]
+    metadata = {} # Per stat de metadata van het meest recente jaar met die stat
+    for year in years: metadata.update(year_info[year]['metadata'])
+    full_keys = {stat: sorted({year_info[year]['full_keys'][stat] for year in years if stat in year_info[year]['stats']}) for stat in stats}
+    print(f"Genereren Lua tijdreeks module ({years[0]}-{years[-1]}, {len(stats)} stats"
+          + (f", {digits} cijfer(s) per shard" if digits else "") + f"): {os.path.basename(paths['module'])}...")
+
+    generation_timestamp = datetime.now(timezone.utc).isoformat()
+    header_replacements = {
+        '%%YEARS_RANGE%%': f"{years[0]}-{years[-1]}",
+        '%%GENERATION_TIMESTAMP%%': generation_timestamp,
+        '%%REGION_TYPES%%': ", ".join(sorted(TARGET_REGION_TYPES)),
+        '%%STATS_LIST%%': ", ".join(stats),
+    }
+    extra_inputs = {
+        'years': {year: year_info[year]['dataset_id'] for year in years},
+        'metadata': {stat: metadata.get(stat) for stat in stats},
+        'data': series.fingerprint() if manifest is not None else None,
+    }
+    module_replacements = {
+        **header_replacements,
+        '%%YEARS_LIST%%': ", ".join(map(str, years)),
+        '%%DATASET_ID_ENTRIES%%': "\n".join(f"  [{year}] = {format_lua_value(year_info[year]['dataset_id'])}," for year in years),
+        '%%METADATA_ENTRIES%%': iter_lua_metadata_entries(metadata, set(stats)),
+    }
+    rows = iter_series_rows(series, years, stats)
+
+    shards = []
+    if not digits:
+        remove_stale_shards(paths['shard_dir']) # Van een eerdere run met --shard
+        module_replacements['%%DATA_ENTRIES%%'] = (format_lua_series_entry(code, stat_series) for code, stat_series in rows)
+        if not render_output("module_series.lua", module_replacements, paths['module'], manifest, extra_inputs): return None
+        module_size = os.path.getsize(paths['module'])
+        print(f"Grootte tijdreeks module: {format_size(module_size)}")
+        if module_size > max_bytes:
+            print(f"Waarschuwing: {os.path.basename(paths['module'])} is {format_size(module_size)}, groter dan de wiki limiet "
+                  f"van {format_size(max_bytes)}. Gebruik --shard.")
     else:
-         print(f"1. CREËER de hoofdmodule '{LUA_DISPATCHER_MODULE_PATH}' handmatig op de wiki met de Lua code!")
-    print(f"3. Upload de inhoud van de andere gegenereerde bestanden (incl. /doc) naar hun respectievelijke pagina's.")
\ No newline at end of file
+        shard_entries, index = {}, {}
+        for code, stat_series in rows:
+            shard_entries.setdefault(shard_key(code, digits), []).append(format_lua_series_entry(code, stat_series))
+            index[shard_key(code)] = shard_key(code, digits)
+        sizes, ok = {}, True
+        module_file_base = os.path.splitext(os.path.basename(paths['module']))[0]
+        for shard, entries in sorted(shard_entries.items()):
+            shard_filename = os.path.join(paths['shard_dir'], f"{module_file_base}_{shard}.lua")
+            shard_replacements = {
+                '%%YEARS_RANGE%%': header_replacements['%%YEARS_RANGE%%'],
+                '%%GENERATION_TIMESTAMP%%': generation_timestamp,
+                '%%SHARD%%': shard,
+                '%%SHARD_MODULE_PATH%%': paths['module_path'],
+                '%%DATA_ENTRIES%%': "\n".join(entries),
+            }
+            data_hash = hashlib.sha256("\n".join(entries).encode('utf-8')).hexdigest()
+            if not render_output("module_series_shard.lua", shard_replacements, shard_filename, manifest, {'data': data_hash}):
+                ok = False
+                continue
+            sizes[shard] = os.path.getsize(shard_filename)
+            shards.append((shard, shard_filename, f"{paths['module_path']}/{shard}"))
+        if ok: remove_stale_shards(paths['shard_dir'], shards)
+        if not check_shard_sizes(sizes, max_bytes, digits) or not ok: return None
+        module_replacements['%%SHARD_MODULE_PATH%%'] = paths['module_path']
+        module_replacements['%%SHARD_ENTRIES%%'] = iter_lua_shard_entries(index)
+        if not render_output("module_series_index.lua", module_replacements, paths['module'], manifest, {**extra_inputs, 'shards': index}):
+            return None
+
+    # --- Genereer Documentatie ---
+    shard_structure = (f"* `p.shards` (tabel): Per gemeentenummer de shard; de reeksen staan in de submodules "
+                       f"[[{paths['module_path']}/{shards[0][0]}]] enz. ({len(shards)} shards), elk met een `p.data` tabel zoals hieronder." if shards else "")
+    doc_replacements = {
+        '%%YEARS_RANGE%%': header_replacements['%%YEARS_RANGE%%'],
+        '%%GENERATION_TIMESTAMP%%': generation_timestamp,
+        '%%REGION_TYPES%%': header_replacements['%%REGION_TYPES%%'],
+        '%%SHARD_STRUCTURE%%': shard_structure,
+        '%%YEAR_ROWS%%': "\n".join(f"|-\n| {year} || {year_info[year]['dataset_id'] or '?'} || {len(year_info[year]['stats'])}" for year in years),
+        '%%STAT_ROWS%%': "\n".join(f"|-\n| <code>{stat}</code> || {', '.join(f'<code>{key}</code>' for key in full_keys[stat])}" for stat in stats),
+        '%%LUA_DISPATCHER_PATH%%': LUA_DISPATCHER_MODULE_PATH,
+        '%%MODULE_INVOKE_PATH%%': LUA_DISPATCHER_MODULE_PATH.split(':', 1)[1],
+        '%%EXAMPLE_STAT%%': stats[0] if stats else '',
+    }
+    render_output("module_series_doc.wikitext", doc_replacements, paths['module_doc'], manifest, {**extra_inputs, 'shard_count': len(shards)})
+    return shards
+
+def run_series(years, args):
+    """Bouwt de reeksen uit de lokale jaren en genereert de tijdreeks module. Gooit PipelineError bij een fout.
+
+    Zonder `years` worden alle lokale jaren (JJJJ/cbs_data) gebruikt. Geeft (output pages, gewijzigde bestanden) terug.
+    """
+    years = years or local_years()
+    if not years: raise PipelineError("Geen lokale jaren gevonden (JJJJ/cbs_data/DataProperties.json).")
+    print(f"--- Start KWB Tijdreeks: {len(years)} jaren ({', '.join(map(str, years))}) ---")
+    start = time.perf_counter()
+    built = build_series(years, args)
+    if built is None: raise PipelineError("Geen van de jaren kon geladen worden.")
+    series, year_info = built
+    print(f"Reeksen samengevoegd in {time.perf_counter() - start:.2f}s")
+
+    paths = get_series_paths()
+    manifest = OutputManifest(os.path.join(paths['output_dir'], OUTPUT_MANIFEST_FILENAME), force=args.force_generate)
+    shards = generate_series_module(series, year_info, paths, manifest, args.shard_digits if args.shard else None, args.max_shard_bytes)
+    if not manifest.save(): print("Waarschuwing: Opslaan output manifest mislukt.")
+    if shards is None: raise PipelineError("Genereren tijdreeks module mislukt.")
+    output_pages = [
+        ("Lua Tijdreeks Index" if shards else "Lua Tijdreeks Module", paths['module'], paths['module_path']),
+        ("Lua Tijdreeks Module Doc", paths['module_doc'], f"{paths['module_path']}/doc"),
+    ] + [("Lua Data Shard", filename, page) for _, filename, page in shards]
+    return output_pages, manifest.changed
+
+
+# --- Wiki Upload ---
+
+class WikiApiError(Exception):
+    """Fout van de MediaWiki API, of een request dat na UPLOAD_MAX_RETRIES nog steeds geweigerd wordt."""
+
+class RateLimiter:
+    """Laat over alle threads samen hoogstens `per_minute` acties per minuut starten."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now: time.sleep(start - now)
+
+def retry_after_seconds(response, attempt):
+    """Wachttijd voor een nieuwe poging: de Retry-After header, anders exponentiële backoff."""
+    try: return max(1, int(response.headers.get('Retry-After', '')))
+    except ValueError: return UPLOAD_BACKOFF * 2 ** attempt
+
+class WikiClient:
+    """Minimale client voor de MediaWiki action API op één gepoolde HTTP sessie.
+
+    Elk request krijgt `maxlag`; bij een maxlag of ratelimited fout of HTTP 429/503
+    wacht de client (Retry-After of backoff) en probeert het opnieuw.
+    """
+
+    def __init__(self, api_url, workers=UPLOAD_WORKERS, maxlag=UPLOAD_MAXLAG):
+        self.api_url = api_url
+        self.maxlag = maxlag
+        # Geen status retries in urllib3: 429/503 (en maxlag) lopen via request(), met Retry-After en UPLOAD_MAX_RETRIES
+        self.session = create_http_session(workers, status_forcelist=())
+        self.session.headers['User-Agent'] = WIKI_USER_AGENT
+        self.csrf_token = None
+
+    def request(self, method, params):
+        """Voert een API request uit en geeft het JSON resultaat terug; gooit WikiApiError bij een fout."""
+        params = {**params, 'format': 'json', 'formatversion': 2, 'maxlag': self.maxlag}
+        for attempt in range(UPLOAD_MAX_RETRIES):
+            if method == 'POST': r = self.session.post(self.api_url, data=params, timeout=300)
+            else: r = self.session.get(self.api_url, params=params, timeout=60)
+            if r.status_code in (429, 503):
+                reason = f"HTTP {r.status_code}"
+            else:
+                r.raise_for_status()
+                result = r.json()
+                error = result.get('error')
+                if not error: return result
+                if error.get('code') not in ('maxlag', 'ratelimited'):
+                    raise WikiApiError(f"{error.get('code')}: {error.get('info')}")
+                reason = error['code']
+            delay = retry_after_seconds(r, attempt)
+            print(f"  Wiki API: {reason}, nieuwe poging over {delay}s...")
+            time.sleep(delay)
+        raise WikiApiError(f"Opgegeven na {UPLOAD_MAX_RETRIES} pogingen ({reason}).")
+
+    def login(self, username, password):
+        """Logt één keer in (bot password aanbevolen) en haalt het CSRF token voor edits op."""
+        login_token = self.request('GET', {'action': 'query', 'meta': 'tokens', 'type': 'login'})['query']['tokens']['logintoken']
+        result = self.request('POST', {'action': 'login', 'lgname': username, 'lgpassword': password, 'lgtoken': login_token})['login']
+        if result.get('result') != 'Success':
+            raise WikiApiError(f"Inloggen als {username} mislukt: {result.get('reason', result.get('result'))}")
+        self.csrf_token = self.request('GET', {'action': 'query', 'meta': 'tokens'})['query']['tokens']['csrftoken']
+
+    def page_hashes(self, titles):
+        """SHA-1 van de huidige inhoud per pagina (None als de pagina niet bestaat), per WIKI_QUERY_BATCH titels."""
+        hashes = {}
+        for i in range(0, len(titles), WIKI_QUERY_BATCH):
+            query = self.request('GET', {
+                'action': 'query', 'prop': 'revisions', 'rvprop': 'sha1', 'titles': '|'.join(titles[i:i + WIKI_QUERY_BATCH]),
+            })['query']
+            # De wiki normaliseert titels (bv. 'Template:' -> 'Sjabloon:'); terugvertalen naar onze titels
+            original = {entry['to']: entry['from'] for entry in query.get('normalized', [])}
+            for page in query.get('pages', []):
+                revisions = page.get('revisions')
+                hashes[original.get(page['title'], page['title'])] = revisions[0]['sha1'] if revisions else None
+        return hashes
+
+    def edit(self, title, text, summary):
+        """Slaat een pagina op; geeft True terug als de wiki een nieuwe revisie heeft gemaakt."""
+        result = self.request('POST', {
+            'action': 'edit', 'title': title, 'text': text, 'summary': summary, 'bot': 1,
+            'md5': hashlib.md5(text.encode('utf-8')).hexdigest(), 'token': self.csrf_token,
+        })['edit']
+        if result.get('result') != 'Success': raise WikiApiError(f"Edit van {title} mislukt: {result}")
+        return not result.get('nochange', False)
+
+def wiki_content_sha1(filename):
+    """SHA-1 van een output bestand zoals de wiki het opslaat (witruimte aan het eind wordt verwijderd)."""
+    with open(filename, 'r', encoding='utf-8') as f:
+        return hashlib.sha1(f.read().rstrip().encode('utf-8')).hexdigest()
+
+def upload_output_pages(output_pages, args):
+    """Stap 8 (--upload): zet de outputs op hun wiki pagina's. Geeft True terug als alles gelukt is.
+
+    Pagina's waarvan de huidige inhoud op de wiki al gelijk is (SHA-1) worden overgeslagen,
+    ook als het bestand lokaal opnieuw is gegenereerd. Met --dry-run wordt alleen getoond
+    wat er zou gebeuren.
+    """
+    pages = {page: filename for _, filename, page in output_pages}
+    print("-" * 30)
+    print(f"Upload naar {args.wiki_api}: {len(pages)} pagina's" + (" (dry-run)" if args.dry_run else ""))
+    password = os.environ.get(WIKI_PASSWORD_ENV)
+    if not args.dry_run and not (args.wiki_user and password):
+        print(f"Fout: Upload vereist --wiki-user en het wachtwoord in ${WIKI_PASSWORD_ENV}.")
+        return False
+
+    client = WikiClient(args.wiki_api, args.upload_workers, args.maxlag)
+    try:
+        if not args.dry_run: client.login(args.wiki_user, password)
+        remote_hashes = client.page_hashes(list(pages))
+        todo = []
+        for page, filename in pages.items():
+            remote = remote_hashes.get(page)
+            if remote == wiki_content_sha1(filename):
+                print(f"  Ongewijzigd op wiki: '{page}'")
+                continue
+            todo.append(page)
+            print(f"  {'Nieuw' if remote is None else 'Gewijzigd'}: '{page}' <- {os.path.basename(filename)}")
+        if args.dry_run or not todo:
+            print(f"{len(todo)} van {len(pages)} pagina's " + ("zouden worden geüpload." if args.dry_run else "hoeven geüpload te worden."))
+            return True
+
+        limiter = RateLimiter(args.edits_per_minute)
+
+        def upload(page):
+            with open(pages[page], 'r', encoding='utf-8') as f: text = f.read()
+            limiter.wait()
+            return client.edit(page, text, args.upload_summary)
+
+        start, failed, saved = time.perf_counter(), [], 0
+        with ThreadPoolExecutor(max_workers=args.upload_workers) as pool:
+            futures = {pool.submit(upload, page): page for page in todo}
+            for future in as_completed(futures):
+                page = futures[future]
+                try:
+                    saved += future.result()
+                    print(f"  Geüpload: '{page}'")
+                except (WikiApiError, requests.RequestException) as e:
+                    failed.append(page)
+                    print(f"  MISLUKT: '{page}': {e}")
+        print(f"Upload klaar in {time.perf_counter() - start:.1f}s: {saved} opgeslagen, "
+              f"{len(todo) - saved - len(failed)} zonder wijziging, {len(failed)} mislukt.")
+        return not failed
+    except (WikiApiError, requests.RequestException, OSError) as e:
+        print(f"Fout bij upload: {e}")
+        return False
+    finally:
+        client.session.close()
+
+
+# --- Watch Modus ---
+
+def snapshot_files(filepaths):
+    """(mtime_ns, grootte) per bestaand bestand; ontbrekende bestanden krijgen None."""
+    snapshot = {}
+    for filepath in filepaths:
+        try:
+            st = os.stat(filepath)
+            snapshot[filepath] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            snapshot[filepath] = None
+    return snapshot
+
+def template_files():
+    """Alle bestanden in TEMPLATE_DIR (ook nieuwe, zodat een later toegevoegde template wordt gezien)."""
+    try: return [os.path.join(TEMPLATE_DIR, name) for name in sorted(os.listdir(TEMPLATE_DIR))]
+    except FileNotFoundError: return []
+
+def steps_for_templates(changed_templates):
+    """Bepaalt via WATCH_TEMPLATE_STEPS welke output stappen een gewijzigde template gebruiken."""
+    steps = set()
+    for filepath in changed_templates:
+        name = os.path.basename(filepath)
+        step = next((step for prefix, step in WATCH_TEMPLATE_STEPS.items() if name.startswith(prefix)), None)
+        if step is None: return set(OUTPUT_STEPS) # Onbekende template: voor de zekerheid alles
+        steps.add(step)
+    return steps
+
+def wait_until_stable(filepaths, snapshot, interval=WATCH_INTERVAL):
+    """Wacht tot de bestanden niet meer veranderen (bv. een editor of download die nog schrijft)."""
+    while True:
+        time.sleep(interval)
+        current = snapshot_files(filepaths)
+        if current == snapshot: return current
+        snapshot = current
+
+def watch_year(year, dataset_id, args):
+    """Houdt metadata, key map en gestripte data in het geheugen en genereert opnieuw bij wijzigingen.
+
+    - template in TEMPLATE_DIR gewijzigd: alleen de stappen die die template gebruiken
+    - DataProperties.json of TypedDataSet.json gewijzigd: data opnieuw laden (de cache
+      fingerprint ziet een gewijzigde bron), daarna alle outputs
+    - dit script (de configuratie constanten) gewijzigd: het proces herstart zichzelf
+    Stopt met Ctrl+C.
+    """
+    paths = get_year_paths(year)
+    source_files = [paths['data_properties'], paths['typed_data_set']]
+    config_files = [os.path.abspath(__file__)]
+    data, force = None, args.force_generate
+
+    def generate(steps):
+        nonlocal force
+        start = time.perf_counter()
+        manifest = OutputManifest(os.path.join(paths['output_dir'], OUTPUT_MANIFEST_FILENAME), force=force)
+        try:
+            generate_year_outputs(year, dataset_id, args, *data[:3], manifest, steps=steps)
+        except PipelineError as e:
+            print(f"FOUT: {e}")
+        force = False # --force-generate alleen bij de eerste generatie
+        names = ', '.join(os.path.basename(filename) for filename in manifest.changed) or "geen wijzigingen"
+        print(f"[watch] {', '.join(step for step in OUTPUT_STEPS if step in steps)} in "
+              f"{(time.perf_counter() - start) * 1000:.0f} ms: {names}")
+
+    def load():
+        nonlocal data
+        start = time.perf_counter()
+        try:
+            data = prepare_year_data(year, dataset_id, args)
+        except PipelineError as e:
+            print(f"FOUT: {e}" + (" (vorige data blijft in gebruik)" if data else ""))
+            return False
+        print(f"[watch] Data geladen in {time.perf_counter() - start:.2f}s ({len(data[2])} regio's)")
+        args.overwrite = args.overwrite_stripped = False # Alleen bij de eerste keer laden
+        return True
+
+    if not load(): raise PipelineError("Kon de data niet laden; watch modus gestopt.")
+    generate(OUTPUT_STEPS)
+    watched = source_files + config_files + template_files()
+    snapshot = snapshot_files(watched)
+    print(f"[watch] Bewaakt: {TEMPLATE_DIR}/, {', '.join(map(os.path.basename, source_files + config_files))}. Stop met Ctrl+C.")
+    try:
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            watched = source_files + config_files + template_files()
+            current = snapshot_files(watched)
+            if current == snapshot: continue
+            current = wait_until_stable(watched, current)
+            changed = [filepath for filepath in watched if current.get(filepath) != snapshot.get(filepath)]
+            changed += [filepath for filepath in snapshot if filepath not in current] # Verwijderde templates
+            snapshot = current
+            print(f"[watch] Gewijzigd: {', '.join(map(os.path.basename, changed))}")
+            if any(filepath in config_files for filepath in changed):
+                print("[watch] Configuratie gewijzigd, herstarten...")
+                sys.stdout.flush()
+                os.execv(sys.executable, [sys.executable] + sys.argv)
+            if any(filepath in source_files for filepath in changed):
+                if load(): generate(OUTPUT_STEPS)
+                continue
+            steps = steps_for_templates(changed)
+            if steps: generate(steps)
+    except KeyboardInterrupt:
+        print("\n[watch] Gestopt.")
+
+
+# --- Hoofd Uitvoeringslogica ---
+
+if __name__ == "__main__":
+    # --- Argument Parsing ---
+    parser = argparse.ArgumentParser(description="Download/verwerk CBS KWB data en genereer Wiki Lua/sjablonen.")
+    parser.add_argument("year", type=int, nargs='?', help="Het doeljaar voor de data (niet nodig met --years/--dataset-map).")
+    parser.add_argument("--overwrite", action="store_true", help="Forceer opnieuw downloaden CBS bron data.")
+    parser.add_argument("--overwrite-stripped", action="store_true", help="Forceer opnieuw filteren/strippen van data.")
+    parser.add_argument("--dataset-id", type=str, default=None, help="Overschrijf het standaard CBS dataset ID.")
+    parser.add_argument("--years", type=str, default=None, help="Batch modus: jaren, bv. '2020-2024' of '2021,2023'.")
+    parser.add_argument("--dataset-map", type=str, default=None, help="Batch modus: JSON bestand met {jaar: dataset_id}.")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="Batch modus: aantal parallelle processen.")
+    parser.add_argument("--full-download", action="store_true", help="Download de volledige tabel via cbsodata i.p.v. alleen de benodigde kolommen/regio's.")
+    parser.add_argument("--odata-url", type=str, default=CBS_ODATA_BASE_URL, help="Basis URL van de CBS OData API (voor geprojecteerde download).")
+    parser.add_argument("--download-workers", type=int, default=DOWNLOAD_WORKERS, help="Aantal gelijktijdige page downloads.")
+    parser.add_argument("--force-generate", action="store_true", help="Genereer alle output bestanden opnieuw, ook als hun inputs niet zijn gewijzigd.")
+    parser.add_argument("--layout", choices=sorted(LUA_DATA_LAYOUTS), default='rows',
+                        help="Layout van de Lua data: 'rows' (tabel per regio) of 'columns' (array per stat, compacter).")
+    parser.add_argument("--shard", action="store_true", help="Verdeel de data submodule over een index module en shards per gemeente(groep).")
+    parser.add_argument("--shard-digits", type=int, choices=range(1, SHARD_DEFAULT_DIGITS + 1), default=SHARD_DEFAULT_DIGITS,
+                        help="Met --shard: cijfers van het gemeentenummer per shard (4 = één shard per gemeente).")
+    parser.add_argument("--max-shard-bytes", type=int, default=SHARD_MAX_BYTES, help="Met --shard: maximale grootte van een shard in bytes.")
+    parser.add_argument("--series", action="store_true",
+                        help=f"Genereer de tijdreeks module ({SERIES_MODULE_NAME}) uit de lokaal gecachte jaren (of --years); met --shard per gemeente(groep).")
+    parser.add_argument("--changed-only", action="store_true",
+                        help=f"Maak en upload alleen de data (shards) van regio's die volgens <jaar>/{CHANGE_REPORT_FILENAME} gewijzigd zijn.")
+    parser.add_argument("--no-derived", action="store_true", help="Bereken geen afgeleide statistieken (DERIVED_RATIO_STATS/DERIVED_RANK_STATS).")
+    parser.add_argument("--no-streaming", action="store_true", help="Laad TypedDataSet.json volledig in het geheugen i.p.v. streamend te strippen.")
+    parser.add_argument("--upload", action="store_true", help=f"Upload de outputs naar de wiki (wachtwoord in ${WIKI_PASSWORD_ENV}).")
+    parser.add_argument("--dry-run", action="store_true", help="Met --upload: toon alleen welke pagina's geüpload zouden worden.")
+    parser.add_argument("--wiki-api", type=str, default=WIKI_API_URL, help="URL van de MediaWiki action API (api.php).")
+    parser.add_argument("--wiki-user", type=str, default=None, help="Gebruikersnaam (bv. een bot password 'Naam@Generator').")
+    parser.add_argument("--upload-workers", type=int, default=UPLOAD_WORKERS, help="Aantal gelijktijdige edits.")
+    parser.add_argument("--edits-per-minute", type=float, default=UPLOAD_EDITS_PER_MINUTE, help="Maximaal aantal edits per minuut (0 = onbeperkt).")
+    parser.add_argument("--maxlag", type=int, default=UPLOAD_MAXLAG, help="maxlag parameter voor de wiki (seconden).")
+    parser.add_argument("--upload-summary", type=str, default=UPLOAD_SUMMARY, help="Bewerkingssamenvatting.")
+    parser.add_argument("--watch", action="store_true",
+                        help="Blijf draaien en genereer opnieuw bij wijzigingen in templates/, de bron data of de configuratie.")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"Meet tijd, CPU, geheugen en geschreven bytes per stap; rapport in <jaar>/{PROFILE_REPORT_FILENAME}.")
+    parser.add_argument("--cprofile", nargs='?', const='hottest', default=None, metavar="STAP",
+                        help="Bewaar een cProfile dump van STAP (standaard de traagste stap); impliceert --profile.")
+    args = parser.parse_args()
+
+    # --- Tijdreeks Module ---
+    if args.series:
+        try:
+            output_pages, changed = run_series(parse_year_range(args.years) if args.years else None, args)
+        except PipelineError as e:
+            print(f"AFGEBROKEN: {e}"); sys.exit(1)
+        print("-" * 30)
+        print(f"Tijdreeks module gegenereerd in: {get_series_paths()['output_dir']}")
+        print_upload_summary(output_pages, changed)
+        if args.upload and not upload_output_pages(output_pages, args): sys.exit(1)
+        sys.exit(0)
+
+    # --- Batch Modus ---
+    if args.years or args.dataset_map:
+        if args.watch: parser.error("--watch werkt alleen voor één jaar.")
+        dataset_map = {}
+        if args.dataset_map:
+            dataset_map = load_dataset_map(args.dataset_map)
+            if dataset_map is None: print(f"AFGEBROKEN: Kon dataset map {args.dataset_map} niet laden."); sys.exit(1)
+        years = parse_year_range(args.years) if args.years else sorted(dataset_map)
+        missing_ids = [year for year in years if year not in dataset_map]
+        if missing_ids and not args.dataset_id:
+            # Elk KWB jaar heeft een eigen dataset ID; niet stilzwijgend het standaard ID gebruiken
+            print(f"AFGEBROKEN: Geen dataset ID voor jaren {missing_ids}. Gebruik --dataset-map.")
+            sys.exit(1)
+        year_dataset_ids = {year: dataset_map.get(year, args.dataset_id) for year in years}
+        sys.exit(0 if run_batch(year_dataset_ids, args) else 1)
+
+    # --- Enkel Jaar ---
+    if args.year is None: parser.error("Geef een jaar op, of gebruik --years/--dataset-map.")
+    dataset_id = args.dataset_id if args.dataset_id else DEFAULT_DATASET_ID_PATTERN
+    if args.watch:
+        try:
+            watch_year(args.year, dataset_id, args)
+        except PipelineError as e:
+            print(f"AFGEBROKEN: {e}"); sys.exit(1)
+        sys.exit(0)
+    try:
+        result = run_year(args.year, dataset_id, args)
+    except PipelineError as e:
+        print(f"AFGEBROKEN: {e}"); sys.exit(1)
+
+    # --- Afronden ---
+    print("-" * 30)
+    print("Script succesvol voltooid.")
+    print(f"Gegenereerde bestanden staan in: {get_year_paths(args.year)['output_dir']}")
+    print_upload_summary(result['output_pages'], result['changed'])
+    if args.upload and not upload_output_pages(result['output_pages'], args): sys.exit(1)
@@ -0,0 +1,25 @@
+-- KWB Data Submodule %%YEAR%% (Dataset: %%DATASET_ID%%), kolommen-layout
+-- Automatisch gegenereerd: %%GENERATION_TIMESTAMP%%
+-- Filtered: %%REGION_TYPES%% | Stripped stats (full keys): %%STATS_LIST_FULL%%
+-- Alleen data (geen functies), zodat de module met mw.loadData geladen kan worden.
+local p = {}
+
+p.dataset_id = '%%DATASET_ID%%'
+p.data_year = %%YEAR%%
+
+-- Metadata alleen voor de opgenomen statistieken
+p.metadata = {
+%%METADATA_ENTRIES%%
+}
+
+-- Rijnummer per regiocode (Gemeenten/Wijken only)
+p.regions = {
+%%REGION_ENTRIES%%
+}
+
+-- Per statistiek één array met de waarde per rijnummer (nil = geen waarde)
+p.columns = {
+%%COLUMN_ENTRIES%%
+}
+
+return p
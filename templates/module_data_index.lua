@@ -0,0 +1,20 @@
+-- KWB Data Index %%YEAR%% (Dataset: %%DATASET_ID%%)
+-- Automatisch gegenereerd: %%GENERATION_TIMESTAMP%%
+-- Filtered: %%REGION_TYPES%% | Stripped stats (full keys): %%STATS_LIST_FULL%%
+local p = {}
+
+p.dataset_id = '%%DATASET_ID%%'
+p.data_year = %%YEAR%%
+
+-- Metadata alleen voor de opgenomen statistieken
+p.metadata = {
+%%METADATA_ENTRIES%%
+}
+
+-- Shard per gemeentenummer (de 4 cijfers na GM/WK/BU in de regiocode).
+-- De data staat in de submodules %%SHARD_MODULE_PATH%%/<shard>.
+p.shards = {
+%%SHARD_ENTRIES%%
+}
+
+return p
@@ -0,0 +1,11 @@
+-- KWB Data Shard %%YEAR%%/%%SHARD%% (Dataset: %%DATASET_ID%%)
+-- Automatisch gegenereerd: %%GENERATION_TIMESTAMP%%
+-- Regio's uit gemeente(n) %%SHARD%%*, geladen via de index %%SHARD_MODULE_PATH%%
+local p = {}
+
+-- Uitgeklede en gefilterde data voor deze shard
+p.data = {
+%%DATA_ENTRIES%%
+}
+
+return p
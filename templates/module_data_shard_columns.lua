@@ -0,0 +1,16 @@
+-- KWB Data Shard %%YEAR%%/%%SHARD%% (Dataset: %%DATASET_ID%%), kolommen-layout
+-- Automatisch gegenereerd: %%GENERATION_TIMESTAMP%%
+-- Regio's uit gemeente(n) %%SHARD%%*, geladen via de index %%SHARD_MODULE_PATH%%
+local p = {}
+
+-- Rijnummer per regiocode
+p.regions = {
+%%REGION_ENTRIES%%
+}
+
+-- Per statistiek één array met de waarde per rijnummer (nil = geen waarde)
+p.columns = {
+%%COLUMN_ENTRIES%%
+}
+
+return p
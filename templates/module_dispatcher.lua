@@ -1,6 +1,8 @@
 -- Hoofdmodule (Dispatcher) voor CBS Kerncijfers Wijken en Buurten Data
 local p = {}
 local loaded_data = {} -- Cache
+local loaded_shards = {} -- Cache per shard submodule
+local loaded_series = nil -- Cache van de tijdreeks module (false als laden mislukt is)
 
 local function get_data_module(year)
     if not year then return nil, 'Jaar ontbreekt' end
@@ -10,7 +12,7 @@ local function get_data_module(year)
     if loaded_data[year] then return loaded_data[year] end
 
     local module_path = 'Module:%%MODULE_BASE_NAME%%/' .. year -- Pad naar submodule, met Module: prefix!
-    local success, module_data = pcall(require, module_path)
+    local success, module_data = pcall(mw.loadData, module_path) -- Gecached voor alle aanroepen op de pagina
 
     if success and module_data then
         loaded_data[year] = module_data
@@ -20,100 +22,321 @@ local function get_data_module(year)
     end
 end
 
-function p.getStat(frame)
-    local args = frame.args
-    local parent_args = frame:getParent().args
+local column_rows = {} -- Cache per kolommen-module: rijnummer -> accessor
 
-    local jaar_arg = args.jaar or parent_args.jaar or ''
-    local regio_arg = args.regio or parent_args.regio or ''
-    local stat_arg = args.stat or parent_args.stat or ''
+-- Geeft de stats van een regio als tabel {sleutel = waarde}, voor beide data layouts:
+-- rijen (p.data[regio]) of kolommen (p.regions[regio] is het rijnummer in elke p.columns array).
+-- Bij kolommen is dat een accessor die source.columns[sleutel][rij] pas bij het opvragen leest,
+-- zonder de kolommen te kopiëren.
+local function region_from(source, regio)
+    if not source.columns then
+        return source.data and source.data[regio]
+    end
+    local row = source.regions and source.regions[regio]
+    if not row then return nil end
+    local rows = column_rows[source]
+    if not rows then
+        rows = {}
+        column_rows[source] = rows
+    end
+    if not rows[row] then
+        local columns = source.columns
+        rows[row] = setmetatable({}, { __index = function(_, key)
+            local column = columns[key]
+            return column and column[row]
+        end })
+    end
+    return rows[row]
+end
 
-    local jaar = mw.text.trim(jaar_arg)
-    local regio = mw.text.trim(regio_arg)
-    local stat_alias = mw.text.trim(stat_arg)
+-- Laadt de tijdreeks module (alle jaren in één module, eventueel een index met shards)
+local function get_series_module()
+    local module_path = 'Module:%%MODULE_BASE_NAME%%/%%SERIES_MODULE_NAME%%'
+    if loaded_series == nil then
+        local success, module_data = pcall(mw.loadData, module_path)
+        loaded_series = success and module_data or false
+    end
+    if not loaded_series then
+        return nil, 'Kon tijdreeks module niet laden: ' .. module_path
+    end
+    return loaded_series
+end
 
-    if stat_alias == 'Ref' then
-        if jaar == '' then
-            return '<span class="error">Fout: Jaar parameter is vereist voor stat=Ref.</span>'
-        end
-        local data_module, err = get_data_module(jaar)
-        if not data_module then
-            return '<span class="error">' .. (err or 'Laden data module mislukt voor Ref.') .. '</span>'
-        end
-        local ds_id = data_module.dataset_id or 'ONBEKEND'
-        local d_year = data_module.data_year or jaar
-        local ref_name = 'CBS_KWB_' .. d_year
-        local ref_url = 'https://opendata.cbs.nl/statline/#/CBS/nl/dataset/' .. ds_id .. '/table?dl=40544'
-        local ref_titel = 'Kerncijfers Wijken en Buurten ' .. d_year
-        local ref_uitgever = 'CBS'
-
-        -- Bouw de {{Citeer web}} aanroep binnen de <ref> tag
-        -- Gebruik mw.text.tag voor correcte <ref> generatie
-        local cite_web_args = {
-            ['url'] = ref_url,
-            ['titel'] = ref_titel,
-            ['uitgever'] = ref_uitgever,
-        }
-        -- Roep het Citeer web sjabloon aan binnen Lua
-        local citation_wikitext = frame:expandTemplate{ title = 'Citeer web', args = cite_web_args }
-        -- Genereer de <ref> tag
-        local ref_tag = mw.text.tag{ name = 'ref', attrs = { name = ref_name }, content = citation_wikitext }
-
-        return frame:preprocess(ref_tag)
-    end
-
-    -- === Code hieronder wordt alleen uitgevoerd als stat NIET 'Ref' is ===
-
-    -- <<< Check lege regio/stat VOORDAT module geladen wordt >>>
-    if regio == '' or stat_alias == '' then
-         return nil -- Sjabloon toont default '-'
+-- Zoekt de data van een regio op. Bij een gesharde submodule (index met p.shards)
+-- wordt alleen de shard van de gemeente van de regio geladen.
+local function get_region_data(data_module, year, regio)
+    if not data_module.shards then
+        return region_from(data_module, regio)
+    end
+    local shard = data_module.shards[string.sub(regio, 3, 6)]
+    if not shard then return nil end
+
+    local shard_path = 'Module:%%MODULE_BASE_NAME%%/' .. year .. '/' .. shard
+    if loaded_shards[shard_path] == nil then
+        local success, shard_module = pcall(mw.loadData, shard_path)
+        loaded_shards[shard_path] = success and shard_module or false
+    end
+    local shard_module = loaded_shards[shard_path]
+    if not shard_module then
+        return nil, 'Kon data shard niet laden: ' .. shard_path
+    end
+    return region_from(shard_module, regio)
+end
+
+-- Leest een parameter uit de #invoke of anders uit de aanroepende sjabloon (getrimd)
+local function get_arg(frame, name, default)
+    local value = frame.args[name]
+    if value == nil then
+        local parent = frame:getParent()
+        value = parent and parent.args[name]
+    end
+    if value == nil then return default end
+    return mw.text.trim(value)
+end
+
+-- Splitst een komma-gescheiden parameter in een lijst van niet-lege waarden
+local function split_list(value)
+    local items = {}
+    for _, item in ipairs(mw.text.split(value, ',', true)) do
+        item = mw.text.trim(item)
+        if item ~= '' then table.insert(items, item) end
     end
-    -- <<< EINDE Check >>>
+    return items
+end
+
+local function error_span(message)
+    return '<span class="error">' .. message .. '</span>'
+end
 
-    -- Valideer jaar nu pas (als het is opgegeven)
+-- Vertaalt een gebruikersvriendelijke stat naam (alias) naar de interne CBS-sleutel
+local function resolve_stat_key(data_module, stat_alias)
+    local internal_stat_key = stat_alias
+%%ALIAS_MAPPING_BLOCK%%
+    return internal_stat_key
+end
+
+-- Zoekt één stat op voor een regio. Geeft de waarde terug (nil als er geen waarde is),
+-- of nil en een foutmelding.
+local function lookup_stat(jaar, regio, stat_alias)
     if jaar == '' then
-         return '<span class="error">Fout: Jaar ontbreekt.</span>' -- Fout als jaar echt leeg is
+        return nil, 'Fout: Jaar ontbreekt.'
     end
 
     -- Laad de data voor het gevraagde jaar
     local data_module, err = get_data_module(jaar)
     if not data_module then
-        return '<span class="error">' .. (err or 'Laden data module mislukt.') .. '</span>'
+        return nil, err or 'Laden data module mislukt.'
     end
 
-    -- Alias Mapping
-    local internal_stat_key = stat_alias
-%%ALIAS_MAPPING_BLOCK%%
+    local internal_stat_key = resolve_stat_key(data_module, stat_alias)
 
-    local regionData = data_module.data and data_module.data[regio]
+    local regionData, shard_err = get_region_data(data_module, jaar, regio)
+    if shard_err then
+        return nil, shard_err
+    end
     if not regionData then
          if string.sub(regio, 1, 2) == 'GM' or string.sub(regio, 1, 2) == 'WK' then
-              return '<span class="error">Fout: Regio \'' .. regio .. '\' (GM/WK) niet gevonden voor jaar ' .. jaar .. '.</span>'
+              return nil, 'Fout: Regio \'' .. regio .. '\' (GM/WK) niet gevonden voor jaar ' .. jaar .. '.'
          else
-              return '<span class="error">Fout: Regio \'' .. regio .. '\' niet gevonden (alleen GM/WK types).</span>'
+              return nil, 'Fout: Regio \'' .. regio .. '\' niet gevonden (alleen GM/WK types).'
          end
     end
 
     local value = regionData[internal_stat_key]
-    local output_value
+    if value == nil and not (data_module.metadata and data_module.metadata[internal_stat_key]) then
+        return nil, 'Fout: Onbekende stat \'' .. stat_alias .. '\'.'
+    end
+    return value
+end
+
+-- Genereert de <ref> tag naar de CBS dataset van een jaar
+local function make_ref(frame, jaar)
+    if jaar == '' then
+        return error_span('Fout: Jaar parameter is vereist voor stat=Ref.')
+    end
+    local data_module, err = get_data_module(jaar)
+    if not data_module then
+        return error_span(err or 'Laden data module mislukt voor Ref.')
+    end
+    local ds_id = data_module.dataset_id or 'ONBEKEND'
+    local d_year = data_module.data_year or jaar
+    local ref_name = 'CBS_KWB_' .. d_year
+    local ref_url = 'https://opendata.cbs.nl/statline/#/CBS/nl/dataset/' .. ds_id .. '/table?dl=40544'
+    local ref_titel = 'Kerncijfers Wijken en Buurten ' .. d_year
+    local ref_uitgever = 'CBS'
+
+    -- Bouw de {{Citeer web}} aanroep binnen de <ref> tag
+    -- Gebruik mw.text.tag voor correcte <ref> generatie
+    local cite_web_args = {
+        ['url'] = ref_url,
+        ['titel'] = ref_titel,
+        ['uitgever'] = ref_uitgever,
+    }
+    -- Roep het Citeer web sjabloon aan binnen Lua
+    local citation_wikitext = frame:expandTemplate{ title = 'Citeer web', args = cite_web_args }
+    -- Genereer de <ref> tag
+    local ref_tag = mw.text.tag{ name = 'ref', attrs = { name = ref_name }, content = citation_wikitext }
+
+    return frame:preprocess(ref_tag)
+end
+
+-- Eén stat voor één regio. Parameters: jaar, regio, stat (of stat=Ref) en optioneel leeg:
+-- de tekst als er geen data is (het sjabloon geeft '-' mee; zonder leeg is de uitvoer leeg).
+function p.getStat(frame)
+    local jaar = get_arg(frame, 'jaar', '')
+    local regio = get_arg(frame, 'regio', '')
+    local stat_alias = get_arg(frame, 'stat', '')
+    local leeg = get_arg(frame, 'leeg')
+
+    if stat_alias == 'Ref' then
+        return make_ref(frame, jaar)
+    end
 
+    -- Check lege regio/stat VOORDAT module geladen wordt
+    if regio == '' or stat_alias == '' then
+        return leeg
+    end
+
+    local value, err = lookup_stat(jaar, regio, stat_alias)
+    if err then
+        return error_span(err)
+    end
     if value == nil then
-        if data_module.metadata and data_module.metadata[internal_stat_key] then
-            output_value = nil -- Sjabloon toont default
-        else
-            return '<span class="error">Fout: Onbekende stat \'' .. stat_alias .. '\'.</span>'
+        return leeg
+    end
+    return tostring(value)
+end
+
+-- Meerdere stats en/of regio's in één aanroep. Parameters: jaar, regio en stat (komma-gescheiden),
+-- leeg (standaard '-') en formaat:
+-- * rij (standaard): wikitable cellen '| waarde || waarde', één rij per regio (met regiokolom=ja
+--   eerst de regiocode). Meerdere rijen worden gescheiden door '|-'.
+-- * sjabloon: roept per regio het sjabloon uit de parameter sjabloon aan, met jaar, regio en
+--   elke stat als benoemde parameter (bv. AantalInwoners=...).
+function p.getStats(frame)
+    local jaar = get_arg(frame, 'jaar', '')
+    local regios = split_list(get_arg(frame, 'regio', ''))
+    local stats = split_list(get_arg(frame, 'stat', ''))
+    local formaat = get_arg(frame, 'formaat', 'rij')
+    local leeg = get_arg(frame, 'leeg', '-')
+
+    if #regios == 0 or #stats == 0 then
+        return nil
+    end
+
+    local function value_text(regio, stat_alias)
+        local value, err = lookup_stat(jaar, regio, stat_alias)
+        if err then return error_span(err) end
+        if value == nil then return leeg end
+        return tostring(value)
+    end
+
+    local output = {}
+    if formaat == 'sjabloon' then
+        local sjabloon = get_arg(frame, 'sjabloon', '')
+        if sjabloon == '' then
+            return error_span('Fout: Parameter sjabloon is vereist voor formaat=sjabloon.')
         end
-    else
-        output_value = value
+        for _, regio in ipairs(regios) do
+            local template_args = { jaar = jaar, regio = regio }
+            for _, stat_alias in ipairs(stats) do
+                template_args[stat_alias] = value_text(regio, stat_alias)
+            end
+            table.insert(output, frame:expandTemplate{ title = sjabloon, args = template_args })
+        end
+        return table.concat(output, '\n')
+    elseif formaat == 'rij' then
+        local regiokolom = get_arg(frame, 'regiokolom', '') ~= ''
+        for _, regio in ipairs(regios) do
+            local cells = {}
+            if regiokolom then table.insert(cells, regio) end
+            for _, stat_alias in ipairs(stats) do
+                table.insert(cells, value_text(regio, stat_alias))
+            end
+            table.insert(output, '| ' .. table.concat(cells, ' || '))
+        end
+        return table.concat(output, '\n|-\n')
+    end
+    return error_span('Fout: Onbekend formaat \'' .. formaat .. '\' (gebruik rij of sjabloon).')
+end
+
+-- Tijdreeks van één stat voor één regio uit de tijdreeks module. Parameters: regio, stat,
+-- van en tot (jaren, standaard alle jaren), leeg (standaard '-') en formaat:
+-- * lijst (standaard): 'jaar: waarde' per jaar, gescheiden door scheiding (standaard ', ')
+-- * rij: wikitable cellen '| waarde || waarde', één per jaar
+-- * jaren: de kopcellen '! jaar !! jaar' bij formaat=rij (regio en stat zijn dan niet nodig)
+-- * sjabloon: roept per jaar het sjabloon uit de parameter sjabloon aan, met jaar, regio, stat en waarde
+function p.getSeries(frame)
+    local regio = get_arg(frame, 'regio', '')
+    local stat_alias = get_arg(frame, 'stat', '')
+    local formaat = get_arg(frame, 'formaat', 'lijst')
+    local leeg = get_arg(frame, 'leeg', '-')
+    local van = tonumber(get_arg(frame, 'van', '')) or 0
+    local tot = tonumber(get_arg(frame, 'tot', '')) or 9999
+
+    local series, err = get_series_module()
+    if not series then
+        return error_span(err)
+    end
+    local positions = {} -- Posities in p.years (en in elke reeks) binnen [van, tot]
+    for i, year in ipairs(series.years) do
+        if year >= van and year <= tot then table.insert(positions, i) end
     end
 
-    if output_value == nil then
+    if formaat == 'jaren' then
+        local cells = {}
+        for _, i in ipairs(positions) do table.insert(cells, tostring(series.years[i])) end
+        return '! ' .. table.concat(cells, ' !! ')
+    end
+    if regio == '' or stat_alias == '' then
         return nil
-    else
-        -- Geef alleen de waarde terug
-        return tostring(output_value)
     end
 
+    -- De reeksen gebruiken basisnamen; een volledige CBS sleutel (met suffix) werkt ook
+    local stat_key = stat_alias
+    if not series.metadata[stat_key] then
+        stat_key = (string.gsub(stat_alias, '_%d+$', ''))
+    end
+    if not series.metadata[stat_key] then
+        return error_span('Fout: Onbekende stat \'' .. stat_alias .. '\' in tijdreeks.')
+    end
+    local regionData, shard_err = get_region_data(series, '%%SERIES_MODULE_NAME%%', regio)
+    if shard_err then
+        return error_span(shard_err)
+    end
+    if not regionData then
+        return error_span('Fout: Regio \'' .. regio .. '\' niet gevonden in tijdreeks.')
+    end
+    local values = regionData[stat_key] or {}
+
+    local function value_text(i)
+        local value = values[i]
+        if value == nil then return leeg end
+        return tostring(value)
+    end
+
+    local output = {}
+    if formaat == 'lijst' then
+        for _, i in ipairs(positions) do
+            table.insert(output, series.years[i] .. ': ' .. value_text(i))
+        end
+        return table.concat(output, get_arg(frame, 'scheiding', ', '))
+    elseif formaat == 'rij' then
+        for _, i in ipairs(positions) do table.insert(output, value_text(i)) end
+        return '| ' .. table.concat(output, ' || ')
+    elseif formaat == 'sjabloon' then
+        local sjabloon = get_arg(frame, 'sjabloon', '')
+        if sjabloon == '' then
+            return error_span('Fout: Parameter sjabloon is vereist voor formaat=sjabloon.')
+        end
+        for _, i in ipairs(positions) do
+            table.insert(output, frame:expandTemplate{ title = sjabloon, args = {
+                jaar = tostring(series.years[i]), regio = regio, stat = stat_key, waarde = value_text(i),
+            } })
+        end
+        return table.concat(output, '\n')
+    end
+    return error_span('Fout: Onbekend formaat \'' .. formaat .. '\' (gebruik lijst, rij, jaren of sjabloon).')
 end
 
-return p
\ No newline at end of file
+return p
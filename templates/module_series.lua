@@ -0,0 +1,24 @@
+-- KWB Tijdreeks Module %%YEARS_RANGE%%
+-- Automatisch gegenereerd: %%GENERATION_TIMESTAMP%%
+-- Filtered: %%REGION_TYPES%% | Stats (basisnamen, zonder CBS suffix): %%STATS_LIST%%
+local p = {}
+
+-- Jaren van de reeksen: positie i van elke reeks hoort bij p.years[i] (nil = geen waarde in dat jaar)
+p.years = { %%YEARS_LIST%% }
+
+-- CBS dataset ID per jaar
+p.dataset_ids = {
+%%DATASET_ID_ENTRIES%%
+}
+
+-- Metadata per stat (van het meest recente jaar met die stat)
+p.metadata = {
+%%METADATA_ENTRIES%%
+}
+
+-- Reeksen per regio: p.data[regio][stat] = { waarde per jaar }
+p.data = {
+%%DATA_ENTRIES%%
+}
+
+return p
@@ -0,0 +1,25 @@
+-- KWB Tijdreeks Index %%YEARS_RANGE%%
+-- Automatisch gegenereerd: %%GENERATION_TIMESTAMP%%
+-- Filtered: %%REGION_TYPES%% | Stats (basisnamen, zonder CBS suffix): %%STATS_LIST%%
+local p = {}
+
+-- Jaren van de reeksen: positie i van elke reeks hoort bij p.years[i] (nil = geen waarde in dat jaar)
+p.years = { %%YEARS_LIST%% }
+
+-- CBS dataset ID per jaar
+p.dataset_ids = {
+%%DATASET_ID_ENTRIES%%
+}
+
+-- Metadata per stat (van het meest recente jaar met die stat)
+p.metadata = {
+%%METADATA_ENTRIES%%
+}
+
+-- Shard per gemeentenummer (de 4 cijfers na GM/WK/BU in de regiocode).
+-- De reeksen staan in de submodules %%SHARD_MODULE_PATH%%/<shard>.
+p.shards = {
+%%SHARD_ENTRIES%%
+}
+
+return p
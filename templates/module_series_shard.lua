@@ -0,0 +1,11 @@
+-- KWB Tijdreeks Shard %%YEARS_RANGE%%/%%SHARD%%
+-- Automatisch gegenereerd: %%GENERATION_TIMESTAMP%%
+-- Regio's uit gemeente(n) %%SHARD%%*, geladen via de index %%SHARD_MODULE_PATH%%
+local p = {}
+
+-- Reeksen per regio: p.data[regio][stat] = { waarde per jaar, zie p.years in de index }
+p.data = {
+%%DATA_ENTRIES%%
+}
+
+return p